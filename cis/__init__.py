@@ -6,12 +6,24 @@ from flask_swagger_ui import get_swaggerui_blueprint
 from .validation import PublicKeyCache
 from .record_schedule_cache import RecordScheduleCache
 from .hf_model import HuggingFaceModel
+from .model_manager import ModelManager
+from .inference_backends import configure_threads, intra_op_thread_count
 from .app_config import config_from_file
 import logging
 from .shared_mailbox_manager import SharedMailboxManager
 from .help_item_cache import HelpItemCache
 from .secrets_manager import load_all_secrets
-from .keyword_extractor import IdentifierExtractor, KeywordExtractor, CapstoneDetector
+from .keyword_extractor import IdentifierExtractor, KeywordExtractor, CapstoneDetector, DocumentScanner
+from .tika_client import TikaClient, TIKA_TEXT_UPPER_LIMIT
+from .tika_cache import TikaResultCache
+from .file_sniffer import FileSniffer
+from .local_extractors import LocalExtractors
+from .ocr_jobs import OcrJobQueue
+from .pdf_pages import PdfPageSplitter
+from .extractor_artifacts import ExtractorArtifacts, load_extractor
+from .process_stats import get_memory_breakdown, format_memory_breakdown
+import tempfile
+import os
 
 logging.basicConfig(level=logging.INFO, format = '[%(asctime)s] %(levelname)s in %(module)s: %(message)s')
 
@@ -22,19 +34,26 @@ schedule_cache = None
 help_item_cache = None
 identifier_extractor = None
 capstone_detector = None
+document_scanner = None
 c = None
 model = None
+tika_client = None
+tika_cache = None
+file_sniffer = FileSniffer()
+local_extractors = None
+ocr_jobs = None
+pdf_splitter = None
 mailbox_manager = None
 SWAGGER_URL = ''  # URL for exposing Swagger UI
 SWAGGER_PATH = 'swagger.yaml'
 swagger_yml = load(open(SWAGGER_PATH, 'r'), Loader=Loader)
 
 
-def create_app(env, region_name, patt_host, patt_api_key, model_path, capstone_path, label_mapping_path, office_info_mapping_path, config_path, mailbox_data_path, vocab_path, keyword_idf_path, database_uri, wam_username, wam_password, priority_categories_path, cities_path, water_bodies_path, db_schema_change=False, tika_server=None, cis_server=None, upgrade_db=False, wam_host=None):
+def create_app(env, region_name, patt_host, patt_api_key, model_path, capstone_path, label_mapping_path, office_info_mapping_path, config_path, mailbox_data_path, vocab_path, keyword_idf_path, database_uri, wam_username, wam_password, priority_categories_path, cities_path, water_bodies_path, db_schema_change=False, tika_server=None, cis_server=None, upgrade_db=False, wam_host=None, model_backend='pytorch', threads=4, tokenizer_pool_size=None, max_batch_size=1, batch_wait_ms=5, batch_buckets=None, intra_op_threads=None, inter_op_threads=1, warmup_rounds=3, cascade_path=None, cascade_threshold=0.9, cascade_audit_rate=0.05, max_windows=1, tika_pool_size=10, tika_connect_timeout=5, tika_read_timeout=30, tika_ocr_timeout=300, tika_cache_dir=None, tika_cache_max_mb=1024, tika_cache_ttl_hours=24, stream_tika_text=False, tika_text_limit=TIKA_TEXT_UPPER_LIMIT, tika_max_concurrency=4, tika_max_queue_depth=8, tika_queue_timeout=10, local_extraction=False, ocr_workers=0, ocr_max_pending=32, ocr_job_dir=None, ocr_job_ttl_hours=1, tika_hedge_after=None, tika_probe_interval=10, tika_eject_after=3, tika_eject_seconds=30, large_pdf_pages=0, pdf_pages_per_range=25, pdf_range_parallelism=4, extractor_artifact_dir=None, workers=1, model_root=None):
     """Construct the core application."""
     app = Flask(__name__, instance_relative_config=False)
     app.config.from_object("flask_config.Config")
-    global model, c, mailbox_manager, schedule_cache, keyword_extractor, identifier_extractor, help_item_cache, capstone_detector
+    global model, c, tika_client, tika_cache, local_extractors, ocr_jobs, pdf_splitter, mailbox_manager, schedule_cache, keyword_extractor, identifier_extractor, help_item_cache, capstone_detector, document_scanner
     c = config_from_file(config_path)
     if database_uri:
         c.database_uri = database_uri
@@ -42,9 +61,12 @@ def create_app(env, region_name, patt_host, patt_api_key, model_path, capstone_p
         load_all_secrets(c, region_name, app.logger)
         app.logger.info('Secrets loaded.')
     if not db_schema_change:
-        keyword_extractor = KeywordExtractor(vocab_path, priority_categories_path, keyword_idf_path)
-        identifier_extractor = IdentifierExtractor(cities_path, water_bodies_path)
-        capstone_detector = CapstoneDetector(capstone_path)
+        artifacts = ExtractorArtifacts(extractor_artifact_dir, app.logger) if extractor_artifact_dir else None
+        keyword_extractor = load_extractor(KeywordExtractor, [vocab_path, priority_categories_path, keyword_idf_path], artifacts, app.logger)
+        # The spaCy pipeline is loaded from its own package, so this one is always built
+        identifier_extractor = load_extractor(IdentifierExtractor, [cities_path, water_bodies_path], None, app.logger)
+        capstone_detector = load_extractor(CapstoneDetector, [capstone_path], artifacts, app.logger)
+        document_scanner = DocumentScanner(keyword_extractor, capstone_detector)
         app.logger.info('Keyword extractor initialized.')
         mailbox_manager = SharedMailboxManager(mailbox_data_path)
         app.logger.info('Mailboxes loaded.')
@@ -68,8 +90,25 @@ def create_app(env, region_name, patt_host, patt_api_key, model_path, capstone_p
             c.wam_password = wam_password
         if wam_host:
             c.wam_host = wam_host
+        tika_client = TikaClient(c.tika_server, tika_pool_size, tika_connect_timeout, tika_read_timeout, tika_ocr_timeout, tika_text_limit if stream_tika_text else None, tika_max_concurrency, tika_max_queue_depth, tika_queue_timeout, tika_hedge_after, tika_probe_interval, tika_eject_after, tika_eject_seconds)
+        if tika_cache_dir:
+            # Results extracted with other settings differ, so they must not be served from the cache
+            extraction_settings = dict(text_limit=tika_client.text_limit, local_extraction=local_extraction, large_pdf_pages=large_pdf_pages, pdf_pages_per_range=pdf_pages_per_range)
+            tika_cache = TikaResultCache(tika_cache_dir, tika_cache_max_mb * 2**20, tika_cache_ttl_hours * 60 * 60, extraction_settings, app.logger)
+            app.logger.info('Tika result cache loaded with ' + str(len(tika_cache.entries)) + ' entries.')
+        if local_extraction:
+            local_extractors = LocalExtractors()
+        if large_pdf_pages > 0:
+            pdf_splitter = PdfPageSplitter(large_pdf_pages, pdf_pages_per_range, pdf_range_parallelism)
+        if ocr_workers > 0:
+            # Created before the workers are forked so that they all share one job directory
+            # Each worker queues its share of ocr_max_pending
+            ocr_jobs = OcrJobQueue(ocr_job_dir or tempfile.mkdtemp(prefix='cis-ocr-jobs-'), ocr_workers, max(1, ocr_max_pending // workers), ocr_job_ttl_hours * 60 * 60, app.logger)
         app.app_context().push()
-        model = HuggingFaceModel(model_path, label_mapping_path, office_info_mapping_path)
+        configure_threads(intra_op_thread_count(intra_op_threads, workers, threads, max_batch_size), inter_op_threads, app.logger)
+        # Models swapped in later are loaded with the same runtime options
+        model_options = dict(model_backend=model_backend, tokenizer_pool_size=tokenizer_pool_size or threads, max_batch_size=max_batch_size, batch_wait_ms=batch_wait_ms, batch_buckets=batch_buckets, cascade_path=cascade_path, cascade_threshold=cascade_threshold, cascade_audit_rate=cascade_audit_rate, max_windows=max_windows)
+        model = ModelManager(HuggingFaceModel(model_path, label_mapping_path, office_info_mapping_path, logger=app.logger, **model_options), model_options, app.logger, warmup_rounds, model_root or os.path.dirname(os.path.abspath(model_path)), workers)
         app.logger.info('Model loaded.')
         swagger_yml['servers'] = [{'url':f'https://{c.cis_server}/'}, {'url':f'http://{c.cis_server}/'}]
         blueprint = get_swaggerui_blueprint(SWAGGER_URL, SWAGGER_PATH, config={'spec': swagger_yml})
@@ -84,4 +123,18 @@ def create_app(env, region_name, patt_host, patt_api_key, model_path, capstone_p
         if upgrade_db:
             upgrade()
 
-        return app
\ No newline at end of file
+        return app
+
+def init_worker(app):
+    """Prepare a worker process forked from a fully loaded app."""
+    with app.app_context():
+        # Connections opened by the parent must not be shared with the children
+        db.engine.dispose(close=False)
+    if tika_client is not None:
+        tika_client.reset()
+    if ocr_jobs is not None:
+        ocr_jobs.reset()
+    # Warm up in the serving process, inference thread pools started before a fork are not usable by the children
+    if model is not None:
+        model.warmup()
+    app.logger.info('Worker ' + str(os.getpid()) + ' memory -- ' + format_memory_breakdown(get_memory_breakdown()))
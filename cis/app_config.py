@@ -32,7 +32,8 @@ class CISConfig:
         arms_upload_prefix,
         email_username,
         email_password,
-        ui_url
+        ui_url,
+        admin_users=None
         ):
         self.cis_server = cis_server
         self.tika_server = tika_server
@@ -58,4 +59,6 @@ class CISConfig:
         self.email_username = email_username
         self.email_password = email_password
         self.ui_url = ui_url
+        # Emails of users allowed to call admin APIs such as model hot swap
+        self.admin_users = [x.lower() for x in (admin_users or [])]
         
@@ -0,0 +1,79 @@
+import numpy as np
+import random
+import threading
+
+SUBJECT_PREFIX = 'subject:'
+
+def cascade_features(keyword_weights, subjects):
+    # Keyword weights are summed IDF values, log scaling keeps frequently repeated keywords from dominating
+    features = {keyword: float(np.log1p(weight)) for keyword, weight in keyword_weights.items()}
+    for subject in subjects:
+        features[SUBJECT_PREFIX + subject] = 1.0
+    return features
+
+class CascadeClassifier():
+    """
+    Linear model over the keyword and subject features which answers easy predictions without running the transformer.
+    Weights are trained with train_cascade.py against the same label mapping as the transformer.
+    """
+    def __init__(self, cascade_path, label_mapping, threshold=0.9, audit_rate=0.05):
+        data = np.load(cascade_path)
+        self.vocabulary = {str(feature): i for i, feature in enumerate(data['features'])}
+        labels = {str(label): i for i, label in enumerate(data['labels'])}
+        missing = [label for label in label_mapping if label not in labels]
+        if len(missing) > 0:
+            raise ValueError('Cascade model at ' + cascade_path + ' was trained without labels ' + ', '.join(missing[:5]) + '.')
+        # Reorder the output columns to the label indices of the transformer
+        columns = [labels[label] for label, _ in sorted(label_mapping.items(), key=lambda x: x[1])]
+        self.weights = data['weights'][:, columns]
+        self.bias = data['bias'][columns]
+        self.threshold = threshold
+        self.audit_rate = audit_rate
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.short_circuited = 0
+        self.audited = 0
+        self.audit_agreements = 0
+        self.fallbacks = 0
+        self.fallback_agreements = 0
+
+    def logits(self, keyword_weights, subjects):
+        features = cascade_features(keyword_weights, subjects)
+        indices = [self.vocabulary[f] for f in features if f in self.vocabulary]
+        if len(indices) == 0:
+            return self.bias.copy()
+        values = np.array([features[f] for f in features if f in self.vocabulary], dtype=self.weights.dtype)
+        return self.bias + values @ self.weights[indices]
+
+    def should_audit(self):
+        # A sample of confident predictions is still sent to the transformer to measure how often the cascade agrees with it
+        return random.random() < self.audit_rate
+
+    def record_short_circuit(self):
+        with self.lock:
+            self.requests += 1
+            self.short_circuited += 1
+
+    def record_comparison(self, confident, agreed):
+        with self.lock:
+            self.requests += 1
+            if confident:
+                self.audited += 1
+                self.audit_agreements += int(agreed)
+            else:
+                self.fallbacks += 1
+                self.fallback_agreements += int(agreed)
+
+    def get_stats(self):
+        with self.lock:
+            return {
+                'threshold': self.threshold,
+                'audit_rate': self.audit_rate,
+                'requests': self.requests,
+                'short_circuited': self.short_circuited,
+                'short_circuit_fraction': self.short_circuited / self.requests if self.requests > 0 else None,
+                'audited': self.audited,
+                'audit_agreement_rate': self.audit_agreements / self.audited if self.audited > 0 else None,
+                'fallbacks': self.fallbacks,
+                'fallback_agreement_rate': self.fallback_agreements / self.fallbacks if self.fallbacks > 0 else None
+            }
@@ -2,14 +2,20 @@ import requests
 from requests.auth import HTTPBasicAuth
 from .data_classes import *
 import json 
-from flask import Response, current_app as app, send_file, g
+from flask import Response, current_app as app, send_file, g, copy_current_request_context
 import urllib 
 import io
 import re
 import uuid
 from .models import User, RecordSubmission, BatchUpload, BatchUploadStatus, BatchUploadSource, DelegationRule, db
 from sqlalchemy import null
-from . import model, help_item_cache, schedule_cache, keyword_extractor, identifier_extractor, capstone_detector
+from . import model, help_item_cache, schedule_cache, identifier_extractor, document_scanner, tika_client, tika_cache, file_sniffer, local_extractors, ocr_jobs, pdf_splitter
+from .tika_client import spool_download, TikaOverloadedError, TIKA_TEXT_UPPER_LIMIT
+from .tika_cache import file_digest
+from .file_sniffer import AUTO, NO_OCR, OCR, SKIP
+from .ocr_jobs import QUEUED, DONE, FAILED
+from .pdf_pages import PdfSplitError
+from concurrent.futures import ThreadPoolExecutor
 from xhtml2pdf import pisa
 from email import policy 
 from email.parser import BytesParser
@@ -27,47 +33,164 @@ from oauthlib.oauth2 import OAuth2Token
 import pytz
 
 TIKA_CUTOFF = 20
-TIKA_TEXT_UPPER_LIMIT = 10000
+TIKA_RETRY_AFTER_SECONDS = 5
 ARMS_ARCHIVE_FOLDER_NAME = 'ARMS Archive'
 ARMS_SYNC_FOLDER_NAME = 'ARMS File Sync'
+TIKA_OCR_STRATEGIES = {AUTO: 'auto', NO_OCR: 'no_ocr', OCR: 'ocr_only'}
+
+def tika_headers(strategy):
+  return {
+    "X-Tika-PDFOcrStrategy": TIKA_OCR_STRATEGIES[strategy],
+    "X-Tika-PDFextractInlineImages": "true" if strategy == OCR else "false",
+    "Cache-Control": "no-cache",
+    "accept": 'application/json'
+  }
 
-def tika(file, config):
-  headers = {
-            "X-Tika-PDFOcrStrategy": "auto",
-            "X-Tika-PDFextractInlineImages": "false",
-            "Cache-Control": "no-cache",
-            "accept": 'application/json'
-          }
-  server = "http://" + config.tika_server + "/rmeta/text"
+def tika_extract(file, strategy):
+  # Either the full /rmeta/text output, or the plain text streamed up to the character budget plus a separate metadata call
+  if tika_client.text_limit is None:
+    r = tika_client.put("/rmeta/text", file, tika_headers(strategy), ocr=strategy == OCR, stream=strategy == OCR)
+    return r.status_code, (r.json()[0] if r.status_code == 200 else None)
+  status, text = tika_client.put_text(file, tika_headers(strategy), ocr=strategy == OCR)
+  if status != 200:
+    return status, None
+  status, metadata = tika_client.put_metadata(file)
+  if status != 200:
+    return status, None
+  metadata['X-TIKA:content'] = text
+  return 200, metadata
+
+def tika_extract_slot(file, strategy):
+  with tika_client.slot():
+    return tika_extract(file, strategy)
+
+def tika_extract_pages(file, strategy):
+  """
+  Extract a large PDF as page ranges on several Tika calls at once and join the text in page order.
+  Every range call takes its own extraction slot. No more ranges are sent once the text so far covers what classification reads.
+  """
+  budget = tika_client.text_limit or TIKA_TEXT_UPPER_LIMIT
+  executor = ThreadPoolExecutor(max_workers=pdf_splitter.parallelism)
+  split_failed = False
+  try:
+    ranges = pdf_splitter.ranges(file)
+    futures = [executor.submit(tika_extract_slot, data, strategy) for _, data in zip(range(pdf_splitter.parallelism), ranges)]
+    metadata = None
+    texts = []
+    length = 0
+    # Ranges are appended while iterating, keeping parallelism calls in flight
+    for future in futures:
+      status, result = future.result()
+      if status != 200:
+        return status, None
+      metadata = metadata or result
+      texts.append(result.get('X-TIKA:content', ''))
+      length += len(texts[-1])
+      if length >= budget:
+        pdf_splitter.record('stopped_early')
+        break
+      data = next(ranges, None)
+      if data is not None:
+        futures.append(executor.submit(tika_extract_slot, data, strategy))
+    pdf_splitter.record('split')
+    pdf_splitter.record('ranges', len(futures))
+  except PdfSplitError:
+    app.logger.info('Could not split PDF, extracting it whole.', exc_info=True)
+    split_failed = True
+  finally:
+    # Ranges which have not started are dropped, the ones still running hold slots and connections until they finish
+    executor.shutdown(wait=True, cancel_futures=True)
+  if split_failed:
+    # Only once the ranges have given their slots back, which the whole file could otherwise be waiting for
+    pdf_splitter.record('fallbacks')
+    return tika_extract_slot(file, strategy)
+  result = dict(metadata, **{'X-TIKA:content': '\n'.join(texts)})
+  return 200, result
+
+def parse_tika_result(result):
+  cui_categories = []
+  for k, v in result.items():
+    if 'MSIP_Label_' in k and '_Name' in k:
+      cui_categories.append(v)
+  return TikaResult(text=result.get('X-TIKA:content',''), is_encrypted=result.get('pdf:encrypted', 'false') == 'true', cui_categories=cui_categories)
+
+def ocr_extract(file):
+  # Runs on an OCR job thread, so failures are raised for the job instead of returned as responses
+  status, result = tika_extract(file, OCR)
+  if status != 200:
+    raise RuntimeError('Tika failed with status ' + str(status))
+  tika_result = parse_tika_result(result)
+  if tika_cache is not None:
+    tika_cache.put(tika_cache.key(file_digest(file)[0]), tika_result)
+  return tika_result.to_dict()
+
+def queue_ocr_job(file, prediction_metadata):
+  job_id = ocr_jobs.submit(ocr_extract, file, g.token_data['email'], prediction_metadata.to_dict())
+  if job_id is None:
+    return Response(StatusResponse(status='Failed', reason='Too many documents are waiting for OCR, please try again shortly.', request_id=g.get('request_id', None)).to_json(), 503, mimetype='application/json', headers={'Retry-After': str(TIKA_RETRY_AFTER_SECONDS)})
+  job_status = OcrJobStatus(job_id=job_id, status=QUEUED)
+  return Response(job_status.to_json(), 202, mimetype='application/json', headers={'Location': '/file_metadata_prediction/' + job_id})
+
+def tika(file, config, deferred_metadata=None):
+  """
+  Extract text from a file. When deferred_metadata is given and OCR jobs are enabled, files which need OCR are queued
+  instead of holding the request, and the failure response is a 202 with the job to poll.
+  """
+  if tika_cache is not None:
+    file_sha, file_size = file_digest(file)
+    cache_key = tika_cache.key(file_sha)
+    cached_result = tika_cache.get(cache_key, file_size)
+    if cached_result is not None:
+      return True, cached_result, None
+  # Pick the OCR strategy up front instead of extracting scanned PDFs twice
+  preflight = file_sniffer.sniff(file)
+  if preflight.strategy == SKIP:
+    file_sniffer.record(preflight, False, False)
+    return True, TikaResult(text='', is_encrypted=True, cui_categories=[]), None
+  # Simple formats are parsed in process, only PDFs, images and legacy binary formats go to Tika
+  if local_extractors is not None:
+    local_result = local_extractors.extract(file, preflight, app.logger)
+    if local_result is not None:
+      if tika_client.text_limit is not None:
+        local_result.text = local_result.text[:tika_client.text_limit]
+      if tika_cache is not None:
+        tika_cache.put(cache_key, local_result)
+      return True, local_result, None
+  defer_ocr = deferred_metadata is not None and ocr_jobs is not None
+  if defer_ocr and preflight.strategy == OCR:
+    file_sniffer.record(preflight, False, False)
+    return False, None, queue_ocr_job(file, deferred_metadata)
   try:
-    r = requests.put(server, data=file, headers=headers, timeout=30)
+    # Each extraction call waits for a free slot, or fails fast when too many extractions are queued
+    if pdf_splitter is not None and pdf_splitter.applies(preflight):
+      status, result = tika_extract_pages(file, preflight.strategy)
+    else:
+      status, result = tika_extract_slot(file, preflight.strategy)
+    short_text = status == 200 and len(result.get('X-TIKA:content','')) < TIKA_CUTOFF
+    # Encrypted PDFs which open without a password are read for their text and labels but never OCRed
+    retry = preflight.strategy != OCR and not preflight.is_encrypted and (status != 200 or (preflight.strategy == AUTO and short_text))
+    file_sniffer.record(preflight, retry, short_text)
+    # The OCR retry queues for a slot of its own, so that slow scans do not hold on to the one taken for the first attempt
+    if retry and not defer_ocr:
+      status, result = tika_extract_slot(file, OCR)
+  except TikaOverloadedError as e:
+    app.logger.info(str(e) + ' ' + json.dumps(tika_client.get_stats()))
+    return False, None, Response(StatusResponse(status='Failed', reason='Text extraction is busy, please try again shortly.', request_id=g.get('request_id', None)).to_json(), 503, mimetype='application/json', headers={'Retry-After': str(TIKA_RETRY_AFTER_SECONDS)})
   except:
     app.logger.error(traceback.format_exc())
     return False, None, Response(StatusResponse(status='Failed', reason='Could not connect to Tika server', request_id=g.get('request_id', None)).to_json(), 500, mimetype='application/json')
-
-  if r.status_code != 200 or len(r.json()[0].get('X-TIKA:content','')) < TIKA_CUTOFF:
-      headers = {
-          "X-Tika-PDFOcrStrategy": "ocr_only",
-          "X-Tika-PDFextractInlineImages": "true",
-          "Cache-Control": "no-cache",
-          "accept": 'application/json'
-        }
-      r = requests.put(server, data=file, headers=headers, stream=True)
-      if r.status_code != 200:
-          return False, None, Response(StatusResponse(status='Failed', reason='Tika failed with status ' + str(r.status_code), request_id=g.get('request_id', None)).to_json(), 500, mimetype='application/json')
+  if retry and defer_ocr:
+    return False, None, queue_ocr_job(file, deferred_metadata)
+  if status != 200:
+      return False, None, Response(StatusResponse(status='Failed', reason='Tika failed with status ' + str(status), request_id=g.get('request_id', None)).to_json(), 500, mimetype='application/json')
   
   try:
-    result = r.json()[0]
-    text = result.get('X-TIKA:content','')
-    is_encrypted = result.get('pdf:encrypted', 'false') == 'true'
-    cui_categories = []
-    for k, v in result.items():
-      if 'MSIP_Label_' in k and '_Name' in k:
-        cui_categories.append(v)
-    tika_result = TikaResult(text=text, is_encrypted=is_encrypted, cui_categories=cui_categories)
+    tika_result = parse_tika_result(result)
   except:
     app.logger.error(traceback.format_exc())
     return False, None, Response(StatusResponse(status='Failed', reason='Failed to parse Tika result.', request_id=g.get('request_id', None)).to_json(), 500, mimetype='application/json')
+  if tika_cache is not None:
+    tika_cache.put(cache_key, tika_result)
 
   return True, tika_result, None
 
@@ -204,6 +327,46 @@ def eml_to_pdf(eml):
 
     return success, result, attachments
 
+def get_eml_attachments(eml):
+  msg = BytesParser(policy=policy.default).parsebytes(eml)
+  # Only keep attachments with names, matching eml_to_pdf
+  return [(part.get_filename(), part.get_payload(decode=True)) for part in msg.walk() if part.is_attachment() and part.get_filename() is not None]
+
+def attachment_prediction_documents(attachments, department, config):
+  """
+  Extract text and keyword signals for each attachment so they can be classified together with the message.
+  Attachments are extracted at the same time, no more of them than Tika admits at once.
+  Returns the documents to classify and the names of the encrypted attachments and of those which could not be extracted.
+  """
+  documents = []
+  encrypted = []
+  failed = []
+  if len(attachments) == 0:
+    return documents, encrypted, failed
+  with ThreadPoolExecutor(max_workers=min(len(attachments), tika_client.max_concurrency)) as executor:
+    futures = [executor.submit(copy_current_request_context(tika), content, config) for _, content in attachments]
+  for (name, _), future in zip(attachments, futures):
+    try:
+      success, tika_result, _ = future.result()
+    except:
+      app.logger.error(traceback.format_exc())
+      success = False
+    if not success:
+      app.logger.info('Text extraction failed for attachment ' + name + '.')
+      failed.append(name)
+      continue
+    if tika_result.is_encrypted:
+      encrypted.append(name)
+      continue
+    keyword_scores = document_scanner.scan(tika_result.text)
+    keyword_weights = keyword_scores.keyword_weights()
+    keywords = keyword_scores.top_keywords(5)
+    subjects = keyword_scores.subjects(tika_result.text)
+    has_capstone = keyword_scores.has_capstone
+    # Attachments are classified against every schedule like uploaded documents, not only the ones for emails
+    documents.append((name, dict(text=tika_result.text, doc_type='document', prediction_metadata=PredictionMetadata(name, department), has_capstone=has_capstone, keywords=keywords, subjects=subjects, attachments=[], keyword_weights=keyword_weights, valid_schedules=None)))
+  return documents, encrypted, failed
+
 def parse_email_metadata(graph_email_value, mailbox, access_token, emailsource):
   categories = set(graph_email_value.get('categories', []))
   filtered_cats = [x for x in categories if x.lower() != 'record']
@@ -957,27 +1120,30 @@ def sharepoint_record_prediction(req: SharepointPredictionRequest, access_token,
     app.logger.error('Unable to find OneDrive item: ' + r.text)
     return Response('Unable to find OneDrive item: ' + str(r.text), status=400, mimetype='application/json')
   download_url = r.json()['@microsoft.graph.downloadUrl']
-  content_req = requests.get(download_url, timeout=30)
+  content_req = requests.get(download_url, timeout=30, stream=True)
   if content_req.status_code != 200:
     return Response('Content request failed with status ' + str(content_req.status_code), status=500, mimetype='application/json')
-  content = content_req.content
-  success, tika_result, response = tika(content, c)
+  # Spool the download so that large files are streamed to Tika from disk instead of being held in memory
+  with spool_download(content_req) as content:
+    success, tika_result, response = tika(content, c)
   if not success:
       return response
   if tika_result.is_encrypted:
     prediction = MetadataPrediction(predicted_schedules=[], title=mock_prediction_with_explanation, is_encrypted=True, description=mock_prediction_with_explanation, default_schedule=None, subjects=[], identifiers={}, cui_categories=tika_result.cui_categories)
     return Response(prediction.to_json(), status=200, mimetype='application/json')
-  keyword_weights = keyword_extractor.extract_keywords(tika_result.text)
-  keywords = [x[0] for x in sorted(keyword_weights.items(), key=lambda y: y[1], reverse=True)][:5]
-  subjects=keyword_extractor.extract_subjects(tika_result.text, keyword_weights)
+  keyword_scores = document_scanner.scan(tika_result.text)
+  keyword_weights = keyword_scores.keyword_weights()
+  keywords = keyword_scores.top_keywords(5)
+  subjects = keyword_scores.subjects(tika_result.text)
   identifiers=identifier_extractor.extract_identifiers(tika_result.text)
-  has_capstone=capstone_detector.detect_capstone_text(tika_result.text)
+  has_capstone=keyword_scores.has_capstone
   spatial_extent, temporal_extent = identifier_extractor.extract_spatial_temporal(tika_result.text)
   # TODO: Handle case where attachments are present
-  predicted_schedules, default_schedule = model.predict(tika_result.text, 'document', PredictionMetadata(req.file_name, req.department), has_capstone, keywords, subjects, attachments=[])
+  active_model = model.current
+  predicted_schedules, default_schedule = active_model.predict(tika_result.text, 'document', PredictionMetadata(req.file_name, req.department), has_capstone, keywords, subjects, attachments=[], keyword_weights=keyword_weights)
   predicted_title = mock_prediction_with_explanation
   predicted_description = mock_prediction_with_explanation
-  prediction = MetadataPrediction(predicted_schedules=predicted_schedules, title=predicted_title, is_encrypted=tika_result.is_encrypted, description=predicted_description, default_schedule=default_schedule, subjects=subjects, identifiers=identifiers, cui_categories=tika_result.cui_categories, spatial_extent=spatial_extent, temporal_extent=temporal_extent)
+  prediction = MetadataPrediction(predicted_schedules=predicted_schedules, title=predicted_title, is_encrypted=tika_result.is_encrypted, description=predicted_description, default_schedule=default_schedule, subjects=subjects, identifiers=identifiers, cui_categories=tika_result.cui_categories, spatial_extent=spatial_extent, temporal_extent=temporal_extent, model_version=active_model.version)
   return Response(prediction.to_json(), status=200, mimetype='application/json')
 
 def upload_sharepoint_record_v3(req: SharepointUploadRequestV3, access_token, user_info, c):
@@ -1696,17 +1862,31 @@ def log_user_activity(req: LogActivityRequest, config):
     return Response(StatusResponse(status='OK', reason='Successfully logged user activity.', request_id=g.get('request_id', None)).to_json(), status=200, mimetype='application/json')
 
 def get_file_metadata_prediction(config, file, prediction_metadata: PredictionMetadata):
-  file_obj = file.read()
-  success, tika_result, response = tika(file_obj, config)
+  # Stream the upload to Tika straight from the request instead of reading it into memory
+  success, tika_result, response = tika(file.stream, config, deferred_metadata=prediction_metadata)
   if not success:
       return response
+  return file_text_metadata_prediction(tika_result, prediction_metadata)
+
+def get_ocr_job_prediction(config, job_id):
+  job = ocr_jobs.get(job_id, g.token_data['email']) if ocr_jobs is not None else None
+  if job is None:
+    return Response(StatusResponse(status='Failed', reason='OCR job not found.', request_id=g.get('request_id', None)).to_json(), 404, mimetype='application/json')
+  if job['status'] == FAILED:
+    return Response(StatusResponse(status='Failed', reason='Text extraction failed.', request_id=g.get('request_id', None)).to_json(), 500, mimetype='application/json')
+  if job['status'] != DONE:
+    return Response(OcrJobStatus(job_id=job_id, status=job['status']).to_json(), 202, mimetype='application/json', headers={'Retry-After': str(TIKA_RETRY_AFTER_SECONDS)})
+  return file_text_metadata_prediction(TikaResult.from_dict(job['result']), PredictionMetadata.from_dict(job['context']))
+
+def file_text_metadata_prediction(tika_result, prediction_metadata: PredictionMetadata):
   if tika_result.is_encrypted:
     prediction = MetadataPrediction(predicted_schedules=[], title=mock_prediction_with_explanation, is_encrypted=True, description=mock_prediction_with_explanation, default_schedule=None, subjects=[], identifiers={}, cui_categories=tika_result.cui_categories)
     return Response(prediction.to_json(), status=200, mimetype='application/json')
-  keyword_weights = keyword_extractor.extract_keywords(tika_result.text)
-  keywords = [x[0] for x in sorted(keyword_weights.items(), key=lambda y: y[1], reverse=True)][:5]
-  subjects=keyword_extractor.extract_subjects(tika_result.text, keyword_weights)
-  has_capstone=capstone_detector.detect_capstone_text(tika_result.text)
+  keyword_scores = document_scanner.scan(tika_result.text)
+  keyword_weights = keyword_scores.keyword_weights()
+  keywords = keyword_scores.top_keywords(5)
+  subjects = keyword_scores.subjects(tika_result.text)
+  has_capstone=keyword_scores.has_capstone
   identifiers=identifier_extractor.extract_identifiers(tika_result.text)
   spatial_extent, temporal_extent = identifier_extractor.extract_spatial_temporal(tika_result.text)
 
@@ -1714,6 +1894,7 @@ def get_file_metadata_prediction(config, file, prediction_metadata: PredictionMe
   mapping = schedule_cache.get_schedule_mapping()
   default_schedule = None
   predicted_schedules = []
+  model_version = None
   if prediction_metadata.file_path is not None:
     for item in prediction_metadata.file_path.split('\\'):
       detected_schedule = detect_schedule_from_string(item, mapping)
@@ -1724,7 +1905,9 @@ def get_file_metadata_prediction(config, file, prediction_metadata: PredictionMe
 
   # If not found then make prediction
   if default_schedule is None:
-    predicted_schedules, default_schedule = model.predict(tika_result.text, 'document', prediction_metadata, has_capstone, keywords, subjects, attachments=[])
+    active_model = model.current
+    predicted_schedules, default_schedule = active_model.predict(tika_result.text, 'document', prediction_metadata, has_capstone, keywords, subjects, attachments=[], keyword_weights=keyword_weights)
+    model_version = active_model.version
   predicted_title = mock_prediction_with_explanation
   predicted_description = mock_prediction_with_explanation
 
@@ -1738,7 +1921,8 @@ def get_file_metadata_prediction(config, file, prediction_metadata: PredictionMe
       cui_categories=tika_result.cui_categories,
       is_encrypted=tika_result.is_encrypted,
       spatial_extent=spatial_extent,
-      temporal_extent=temporal_extent
+      temporal_extent=temporal_extent,
+      model_version=model_version
       )
   return Response(prediction.to_json(), status=200, mimetype='application/json')
 
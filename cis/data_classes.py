@@ -99,6 +99,7 @@ class PredictionMetadata:
     file_name: Optional[str]
     department: Optional[str]
     file_path: Optional[str] = None
+    max_windows: Optional[int] = None
 
 @dataclass_json
 @dataclass 
@@ -210,6 +211,16 @@ class RecordDownloadRequestV2:
     uid: str
     nuxeo_env: Optional[str] = "dev"
 
+@dataclass_json
+@dataclass 
+class AttachmentPrediction:
+    name: str
+    predicted_schedules: list[Recommendation]
+    default_schedule: Optional[RecordSchedule]
+    subjects: list[str]
+    is_encrypted: bool = False
+    extraction_failed: bool = False
+
 @dataclass_json
 @dataclass 
 class MetadataPrediction:
@@ -223,6 +234,8 @@ class MetadataPrediction:
     is_encrypted: bool = False
     spatial_extent: Optional[list[str]] = None
     temporal_extent: Optional[list[str]] = None
+    model_version: Optional[str] = None
+    attachment_predictions: Optional[list[AttachmentPrediction]] = None
 
 mock_predicted_schedules = [
     Recommendation(**{"schedule": RecordSchedule(**{"function_number": "404", "schedule_number": "1012", "disposition_number": "e"}), "probability": 0.6403017640113831}), 
@@ -780,3 +793,16 @@ class DelegationRuleResponse:
 class DeleteDelegationRuleRequest:
     rule_id: int
 
+@dataclass_json
+@dataclass
+class ModelSwapRequest:
+    model_path: str
+    label_mapping_path: str
+    office_info_mapping_path: str
+    version: Optional[str] = None
+
+@dataclass_json
+@dataclass
+class OcrJobStatus:
+    job_id: str
+    status: str
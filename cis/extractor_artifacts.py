@@ -0,0 +1,87 @@
+import hashlib
+import inspect
+import pickle
+import time
+import os
+
+# Bump when the pickled layout changes in a way the source hashes below would not catch
+ARTIFACT_VERSION = 1
+
+def file_hash(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def load_extractor(cls, paths, artifacts=None, logger=None):
+    """Build cls(*paths), or load it from artifacts when given, and log how long that took."""
+    if artifacts is not None:
+        return artifacts.load_or_build(cls.__name__, list(paths) + [inspect.getsourcefile(cls)], lambda: cls(*paths))
+    start = time.monotonic()
+    extractor = cls(*paths)
+    if logger is not None:
+        logger.info(cls.__name__ + ' built in ' + format(time.monotonic() - start, '.3f') + 's.')
+    return extractor
+
+class ExtractorArtifacts():
+    """
+    Pickles fully built extractors, automata included, into cache_dir so that later starts load them instead of
+    parsing the vocabularies again. Artifacts are keyed by the hashes of their input files and of the module which
+    defines them, so they are rebuilt whenever either changes. Pickles run code when loaded, so cache_dir must only
+    be writable by the service.
+    """
+    def __init__(self, cache_dir, logger=None):
+        self.cache_dir = cache_dir
+        self.logger = logger
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def key(self, name, paths):
+        digest = hashlib.sha256((name + ':' + str(ARTIFACT_VERSION)).encode())
+        for path in paths:
+            digest.update(file_hash(path).encode())
+        return digest.hexdigest()
+
+    def path(self, name, key):
+        return os.path.join(self.cache_dir, name + '-' + key + '.pkl')
+
+    def load_or_build(self, name, paths, build):
+        """Load the artifact for name, or call build and save its result. paths are every file the result depends on."""
+        start = time.monotonic()
+        key = self.key(name, paths)
+        try:
+            with open(self.path(name, key), 'rb') as f:
+                artifact = pickle.load(f)
+            self.log(name + ' loaded from artifact in ' + format(time.monotonic() - start, '.3f') + 's.')
+            return artifact
+        except FileNotFoundError:
+            pass
+        except Exception:
+            if self.logger is not None:
+                self.logger.exception('Failed to load ' + name + ' artifact, rebuilding it.')
+        artifact = build()
+        build_time = time.monotonic() - start
+        try:
+            # Other workers may be starting at the same time, so write under a private name and swap it in
+            tmp_path = self.path(name, key) + '.' + str(os.getpid()) + '.tmp'
+            with open(tmp_path, 'wb') as f:
+                pickle.dump(artifact, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, self.path(name, key))
+            self.remove_stale(name, key)
+        except OSError:
+            if self.logger is not None:
+                self.logger.exception('Failed to save ' + name + ' artifact.')
+        self.log(name + ' built in ' + format(build_time, '.3f') + 's.')
+        return artifact
+
+    def remove_stale(self, name, key):
+        for file_name in os.listdir(self.cache_dir):
+            if file_name.startswith(name + '-') and file_name.endswith('.pkl') and file_name != os.path.basename(self.path(name, key)):
+                try:
+                    os.remove(os.path.join(self.cache_dir, file_name))
+                except FileNotFoundError:
+                    pass
+
+    def log(self, message):
+        if self.logger is not None:
+            self.logger.info(message)
@@ -0,0 +1,172 @@
+from collections import Counter
+import threading
+import io
+import re
+
+try:
+    from pypdf import PdfReader, PasswordType
+except ImportError:
+    PdfReader = None
+
+CHUNK_SIZE = 1024 * 1024
+# Large enough to hold any of the markers below when they straddle two chunks
+CHUNK_OVERLAP = 64
+MAX_SCAN_BYTES = 64 * 1024 * 1024
+
+# Tika strategies chosen by the preflight
+NO_OCR = 'no_ocr'
+OCR = 'ocr'
+AUTO = 'auto'
+SKIP = 'skip'
+
+MAGIC_BYTES = [
+    (b'%PDF-', 'pdf'),
+    (b'PK\x03\x04', 'zip'),
+    (b'\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1', 'ole'),
+    (b'\x89PNG', 'image'),
+    (b'\xff\xd8\xff', 'image'),
+    (b'II*\x00', 'image'),
+    (b'MM\x00*', 'image')
+]
+
+PDF_PAGE = re.compile(rb'/Type\s*/Page(?![a-zA-Z])')
+PDF_FONT = re.compile(rb'/Font\b')
+PDF_IMAGE = re.compile(rb'/Subtype\s*/Image\b')
+PDF_ENCRYPT = re.compile(rb'/Encrypt\b')
+PDF_OBJECT_STREAM = re.compile(rb'/Type\s*/ObjStm\b')
+
+class Preflight():
+    def __init__(self, kind, size, is_encrypted=False, page_count=None, has_fonts=False, has_images=False, has_object_streams=False, partial=False, needs_password=False):
+        self.kind = kind
+        self.size = size
+        self.is_encrypted = is_encrypted
+        self.needs_password = needs_password
+        self.page_count = page_count
+        self.has_fonts = has_fonts
+        self.has_images = has_images
+        self.has_object_streams = has_object_streams
+        self.partial = partial
+        self.strategy = self.choose_strategy()
+
+    def choose_strategy(self):
+        if self.kind != 'pdf':
+            return AUTO
+        # PDFs with only an owner password can still be read, and Tika reads their labels, but they are not OCRed
+        if self.is_encrypted:
+            return SKIP if self.needs_password else NO_OCR
+        # Markers past the scan limit are unknown, so let Tika decide page by page
+        if self.partial:
+            return AUTO
+        if self.has_fonts and not self.has_images:
+            return NO_OCR
+        # Font dictionaries can be hidden inside compressed object streams, so only trust their absence without them
+        if self.has_images and not self.has_fonts and not self.has_object_streams:
+            return OCR
+        return AUTO
+
+    def describe(self):
+        return self.kind + ', ' + str(self.size) + ' bytes, ' + (str(self.page_count) + ' pages, ' if self.page_count is not None else '') + 'strategy ' + self.strategy
+
+def read_chunks(body):
+    if isinstance(body, (bytes, bytearray)):
+        for start in range(0, min(len(body), MAX_SCAN_BYTES), CHUNK_SIZE):
+            yield bytes(body[start:start + CHUNK_SIZE])
+        return
+    body.seek(0)
+    scanned = 0
+    while scanned < MAX_SCAN_BYTES:
+        chunk = body.read(CHUNK_SIZE)
+        if not chunk:
+            break
+        scanned += len(chunk)
+        yield chunk
+    body.seek(0)
+
+def body_size(body):
+    if isinstance(body, (bytes, bytearray)):
+        return len(body)
+    body.seek(0, 2)
+    size = body.tell()
+    body.seek(0)
+    return size
+
+def pdf_needs_password(body):
+    """Whether the PDF cannot be opened without a user password. Unknown without pypdf, in which case Tika is left to tell."""
+    if PdfReader is None:
+        return False
+    try:
+        reader = PdfReader(io.BytesIO(body) if isinstance(body, (bytes, bytearray)) else body)
+        return reader.is_encrypted and reader.decrypt('') == PasswordType.NOT_DECRYPTED
+    except Exception:
+        return False
+    finally:
+        if not isinstance(body, (bytes, bytearray)):
+            body.seek(0)
+
+def sniff_pdf(body, size):
+    page_count = 0
+    markers = {'fonts': False, 'images': False, 'encrypted': False, 'object_streams': False}
+    tail = b''
+    for chunk in read_chunks(body):
+        data = tail + chunk
+        # Pages starting in the overlap are counted with the next chunk, once the whole marker is visible
+        boundary = max(0, len(data) - CHUNK_OVERLAP)
+        page_count += len([m for m in PDF_PAGE.finditer(data) if m.start() < boundary])
+        markers['fonts'] = markers['fonts'] or PDF_FONT.search(data) is not None
+        markers['images'] = markers['images'] or PDF_IMAGE.search(data) is not None
+        markers['encrypted'] = markers['encrypted'] or PDF_ENCRYPT.search(data) is not None
+        markers['object_streams'] = markers['object_streams'] or PDF_OBJECT_STREAM.search(data) is not None
+        tail = data[boundary:]
+    page_count += len(PDF_PAGE.findall(tail))
+    needs_password = markers['encrypted'] and pdf_needs_password(body)
+    return Preflight('pdf', size, markers['encrypted'], page_count or None, markers['fonts'], markers['images'], markers['object_streams'], size > MAX_SCAN_BYTES, needs_password)
+
+class FileSniffer():
+    """
+    Inspects files before they are sent to Tika so that scanned PDFs are OCRed on the first call,
+    PDFs with a text layer are never OCRed and PDFs which need a password are not sent at all.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.strategies = Counter()
+        self.kinds = Counter()
+        self.retries = 0
+        self.double_extractions_avoided = 0
+
+    def sniff(self, body):
+        size = body_size(body)
+        if isinstance(body, (bytes, bytearray)):
+            head = bytes(body[:16])
+        else:
+            head = body.read(16)
+            body.seek(0)
+        kind = 'other'
+        for magic, magic_kind in MAGIC_BYTES:
+            if head.startswith(magic):
+                kind = magic_kind
+                break
+        # Some generators write a few bytes of junk before the PDF header
+        if kind == 'other' and b'%PDF-' in head:
+            kind = 'pdf'
+        if kind == 'pdf':
+            return sniff_pdf(body, size)
+        return Preflight(kind, size)
+
+    def record(self, preflight, retried, short_text):
+        with self.lock:
+            self.kinds[preflight.kind] += 1
+            self.strategies[preflight.strategy] += 1
+            if retried:
+                self.retries += 1
+            # Without the preflight these files were sent once with the auto strategy and again with OCR
+            elif preflight.strategy == OCR or (preflight.strategy == NO_OCR and short_text) or preflight.strategy == SKIP:
+                self.double_extractions_avoided += 1
+
+    def get_stats(self):
+        with self.lock:
+            return {
+                'kinds': dict(self.kinds),
+                'strategies': dict(self.strategies),
+                'ocr_retries': self.retries,
+                'double_extractions_avoided': self.double_extractions_avoided
+            }
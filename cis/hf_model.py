@@ -1,8 +1,20 @@
-from transformers import AutoTokenizer, AutoModelForSequenceClassification
+from transformers import AutoTokenizer
 from .data_classes import RecordSchedule, Recommendation
+from .inference_batcher import InferenceBatcher, DEFAULT_BUCKET_BOUNDARIES
+from .inference_backends import load_backend
+from .cascade import CascadeClassifier
+from .ranking import top_k
 import numpy as np
 import json
-import threading
+import os
+import queue
+import time
+from contextlib import contextmanager
+
+BODY_CHAR_LIMIT = 4000
+# Characters of body text tokenized for each window. Tokens average well under 8 characters, so this nearly always
+# fills a window while the characters tokenized per document stay fixed however long the document is
+WINDOW_CHARS_PER_TOKEN = 8
 
 def softmax(logits):
     return np.exp(logits)/sum(np.exp(logits))
@@ -11,22 +23,97 @@ def format_record_schedule(sched):
     split = sched.split('-')
     return RecordSchedule(function_number=split[0], schedule_number=split[1], disposition_number=split[2])
 
+def window_starts(num_tokens, window_size, max_windows, overlap=0.25):
+    """Start offsets of at most max_windows overlapping windows, sampled evenly from the head to the tail of the document."""
+    stride = max(1, int(window_size * (1 - overlap)))
+    last = max(0, num_tokens - window_size)
+    starts = list(range(0, last, stride)) + [last]
+    if len(starts) <= max_windows:
+        return starts
+    if max_windows == 1:
+        return [0]
+    return [starts[round(i * (len(starts) - 1) / (max_windows - 1))] for i in range(max_windows)]
+
+class TokenizerPool():
+    """
+    Fast tokenizers are not safe to share between threads (https://github.com/huggingface/tokenizers/issues/537),
+    so each prediction thread checks out its own tokenizer instance instead of serializing on a single one.
+    """
+    def __init__(self, model_path, size):
+        self.size = size
+        self.tokenizers = queue.Queue()
+        for _ in range(size):
+            self.tokenizers.put(AutoTokenizer.from_pretrained(model_path))
+
+    @contextmanager
+    def checkout(self):
+        tokenizer = self.tokenizers.get()
+        try:
+            yield tokenizer
+        finally:
+            self.tokenizers.put(tokenizer)
+
+    def available(self):
+        return self.tokenizers.qsize()
+
+class ClassIndex():
+    """
+    Maps label indices to record schedules and their "function-schedule-disposition" keys, and caches
+    boolean masks over the labels for the schedule sets predictions are filtered against.
+    """
+    max_masks = 16
+
+    def __init__(self, reverse_mapping):
+        self.classes = [format_record_schedule(reverse_mapping[x]) for x in range(len(reverse_mapping))]
+        self.keys = [f'{x.function_number}-{x.schedule_number}-{x.disposition_number}' for x in self.classes]
+        self.masks = {}
+
+    def __len__(self):
+        return len(self.classes)
+
+    def mask_for(self, valid_schedules):
+        # Schedule sets from RecordScheduleCache are frozensets which are replaced on refresh, so a refresh builds a new mask
+        if not isinstance(valid_schedules, frozenset):
+            valid_schedules = frozenset(valid_schedules)
+        mask = self.masks.get(valid_schedules)
+        if mask is None:
+            mask = np.array([key in valid_schedules for key in self.keys], dtype=bool)
+            if len(self.masks) >= self.max_masks:
+                self.masks = {}
+            self.masks[valid_schedules] = mask
+        return mask
+
 class HuggingFaceModel():
-    def __init__(self, model_path, label_mapping_path, office_info_mapping_path):
-        self.lock = threading.Lock()
-        self.tokenizer = AutoTokenizer.from_pretrained(model_path)
-        self.model = AutoModelForSequenceClassification.from_pretrained(model_path)
+    def __init__(self, model_path, label_mapping_path, office_info_mapping_path, model_backend='pytorch', tokenizer_pool_size=4, max_batch_size=1, batch_wait_ms=5, batch_buckets=None, cascade_path=None, cascade_threshold=0.9, cascade_audit_rate=0.05, max_windows=1, version=None, logger=None):
+        self.version = version or os.path.basename(os.path.normpath(model_path))
+        self.logger = logger
+        self.tokenizer_pool = TokenizerPool(model_path, tokenizer_pool_size)
+        with self.tokenizer_pool.checkout() as tokenizer:
+            self.pad_token_id = tokenizer.pad_token_id
+            self.max_length = min(tokenizer.model_max_length, 512)
+        # Upper bound on the windows scored for a long document, requests can ask for fewer
+        self.max_windows = max_windows
+        self.backend_name = model_backend
+        self.backend = load_backend(model_backend, model_path, logger)
         with open(label_mapping_path, 'r') as f:
             self.label_mapping = json.loads(f.read())
             self.reverse_mapping = {v:k for k,v in self.label_mapping.items()}
         with open(office_info_mapping_path, 'r') as g:
             self.office_info_mapping = json.loads(g.read())
         # Convert indices to record schedules using mapping saved at model training time
-        self.classes = [format_record_schedule(self.reverse_mapping[x]) for x in range(len(self.label_mapping))]
-        
-    def predict(self, text, doc_type, prediction_metadata, has_capstone, keywords, subjects, attachments, k=3, default_categorization_threshold=0.95, valid_schedules=None):
+        self.class_index = ClassIndex(self.reverse_mapping)
+        self.classes = self.class_index.classes
+        self.cascade = None
+        if cascade_path is not None:
+            self.cascade = CascadeClassifier(cascade_path, self.label_mapping, cascade_threshold, cascade_audit_rate)
+        # Concurrent requests are only batched together when a batch size greater than one is configured
+        self.batcher = None
+        if max_batch_size > 1:
+            self.batcher = InferenceBatcher(self.forward, max_batch_size, batch_wait_ms, batch_buckets, logger)
+
+    def format_input(self, text, doc_type, prediction_metadata, has_capstone, keywords, subjects, attachments):
         # Preprocess text to include metadata
-        body = 'body:' + text[:4000]
+        body = 'body:' + text[:BODY_CHAR_LIMIT]
         if prediction_metadata is not None:
             if prediction_metadata.department is not None:
                 group_name =  prediction_metadata.department
@@ -48,25 +135,150 @@ class HuggingFaceModel():
             has_senior = 'mentions senior official'
         else:
             has_senior = ''
-        content = f'{title}, {doc_type}, {group_name}, {keywords}, {topics}, {attachments}, {has_senior}, {body}'
-        # Tokenize text
-        # thread lock tokenization https://github.com/huggingface/tokenizers/issues/537
-        with self.lock:
-            tokens = self.tokenizer(content, truncation=True, padding=True, return_tensors="pt")
-        # Apply model, get logits
-        outputs = self.model(**tokens)
-        preds = outputs[0][0].detach().cpu().numpy()
-        # Convert logits to probabilities and select top k
-        probs = [float(x) for x in list(softmax(preds))] 
-        # Prepare response
-        final_preds = [Recommendation(probability=probs[i], schedule = self.classes[i]) for i in range(len(self.label_mapping))]
-        final_preds = sorted(final_preds, key=lambda x:-x.probability)
-        if valid_schedules is not None:
-            final_preds = list(filter(lambda x: "{fn}-{sn}-{dn}".format(fn=x.schedule.function_number, sn=x.schedule.schedule_number, dn=x.schedule.disposition_number) in valid_schedules, final_preds))
-        filtered_preds = final_preds[0:k]
+        return f'{title}, {doc_type}, {group_name}, {keywords}, {topics}, {attachments}, {has_senior}, {body}'
+
+    def tokenize(self, content):
+        with self.tokenizer_pool.checkout() as tokenizer:
+            return tokenizer(content, truncation=True)['input_ids']
+
+    def window_budget(self, prediction_metadata):
+        requested = prediction_metadata.max_windows if prediction_metadata is not None else None
+        if requested is None:
+            return self.max_windows
+        return max(1, min(requested, self.max_windows))
+
+    def document_windows(self, document):
+        text = document['text']
+        # The single truncated input only covers the first BODY_CHAR_LIMIT characters, so it also tells whether the document is short
+        content = self.format_input(text, document['doc_type'], document['prediction_metadata'], document['has_capstone'], document['keywords'], document['subjects'], document['attachments'])
+        input_ids = self.tokenize(content)
+        budget = self.window_budget(document['prediction_metadata'])
+        # Documents which fit in a single input keep the original truncated input
+        if budget <= 1 or (len(text) <= BODY_CHAR_LIMIT and len(input_ids) < self.max_length):
+            return [input_ids]
+        # Metadata is repeated in every window. Windows are placed over the characters of the body and only
+        # the characters of each window are tokenized, so long documents cost no more than budget windows
+        prefix = self.format_input('', document['doc_type'], document['prediction_metadata'], document['has_capstone'], document['keywords'], document['subjects'], document['attachments'])
+        with self.tokenizer_pool.checkout() as tokenizer:
+            prefix_ids = tokenizer(prefix, add_special_tokens=False)['input_ids']
+            window_size = self.max_length - len(prefix_ids) - 2
+            if window_size <= 0:
+                return [input_ids]
+            window_chars = window_size * WINDOW_CHARS_PER_TOKEN
+            head_ids = tokenizer(text[:window_chars], add_special_tokens=False)['input_ids']
+            # Windows are spaced by the number of characters a window covers at the head of the document
+            window_span = min(window_chars, max(1, min(len(text), window_chars) * window_size // max(1, len(head_ids))))
+            windows = []
+            for start in window_starts(len(text), window_span, budget):
+                if start == 0:
+                    body_ids = head_ids
+                else:
+                    # Start at a word so that the window does not open with the end of a cut word
+                    space = text.find(' ', start, start + window_chars)
+                    if space >= 0:
+                        start = space + 1
+                    body_ids = tokenizer(text[start:start + window_chars], add_special_tokens=False)['input_ids']
+                windows.append([tokenizer.cls_token_id] + prefix_ids + body_ids[:window_size] + [tokenizer.sep_token_id])
+        return windows
+
+    def forward(self, batch_input_ids):
+        # Pad every input to the longest one in the batch and mask out the padding
+        max_length = max(len(x) for x in batch_input_ids)
+        input_ids = np.array([x + [self.pad_token_id] * (max_length - len(x)) for x in batch_input_ids], dtype=np.int64)
+        attention_mask = np.array([[1] * len(x) + [0] * (max_length - len(x)) for x in batch_input_ids], dtype=np.int64)
+        return self.backend.forward(input_ids, attention_mask)
+
+    def postprocess(self, preds, k, default_categorization_threshold, valid_schedules):
+        # Convert logits to probabilities and select top k among the allowed schedules
+        probs = softmax(preds)
+        mask = self.class_index.mask_for(valid_schedules) if valid_schedules is not None else None
+        # Only the k winners are turned into response objects
+        filtered_preds = [Recommendation(probability=float(probs[i]), schedule=self.classes[i]) for i in top_k(probs, k, mask)]
         # Automatically categorize if top prediction exceeds threshold
         default_schedule = None
         highest_pred = filtered_preds[0]
         if highest_pred.probability > default_categorization_threshold:
             default_schedule = highest_pred.schedule
-        return filtered_preds, default_schedule
\ No newline at end of file
+        return filtered_preds, default_schedule
+
+    def logits(self, input_ids):
+        if self.batcher is not None:
+            return self.batcher.submit(input_ids)
+        return self.forward([input_ids])[0]
+
+    def predict(self, text, doc_type, prediction_metadata, has_capstone, keywords, subjects, attachments, k=3, default_categorization_threshold=0.95, valid_schedules=None, keyword_weights=None):
+        document = dict(text=text, doc_type=doc_type, prediction_metadata=prediction_metadata, has_capstone=has_capstone, keywords=keywords, subjects=subjects, attachments=attachments, keyword_weights=keyword_weights)
+        return self.predict_batch([document], k, default_categorization_threshold, valid_schedules)[0]
+
+    def predict_batch(self, documents, k=3, default_categorization_threshold=0.95, valid_schedules=None):
+        """
+        Predict schedules for several documents of one request, e.g. an email and its attachments, in a single forward pass.
+        Each document is a dict of the keyword arguments of predict. A valid_schedules key in a document overrides valid_schedules.
+        """
+        results = [None] * len(documents)
+        cascade_results = {}
+        batch_windows = {}
+        for i, document in enumerate(documents):
+            keyword_weights = document.get('keyword_weights')
+            # The cascade answers from the keyword signals alone when it is confident enough
+            if self.cascade is not None and keyword_weights is not None:
+                cascade_result = self.postprocess(self.cascade.logits(keyword_weights, document['subjects']), k, default_categorization_threshold, document.get('valid_schedules', valid_schedules))
+                confident = cascade_result[0][0].probability >= self.cascade.threshold
+                if confident and not self.cascade.should_audit():
+                    self.cascade.record_short_circuit()
+                    results[i] = cascade_result
+                    continue
+                cascade_results[i] = (cascade_result, confident)
+            batch_windows[i] = self.document_windows(document)
+        windows = [(i, input_ids) for i, document_windows in batch_windows.items() for input_ids in document_windows]
+        # Apply model, get logits
+        if len(windows) == 1:
+            # A single input goes through the batcher so that it can share a forward pass with concurrent requests
+            window_preds = [self.logits(windows[0][1])]
+        elif len(windows) > 1:
+            window_preds = self.forward([input_ids for _, input_ids in windows])
+        else:
+            window_preds = []
+        for i in batch_windows.keys():
+            preds = [p for (j, _), p in zip(windows, window_preds) if j == i]
+            # Long documents are scored by the mean logits of their windows
+            preds = preds[0] if len(preds) == 1 else np.mean(preds, axis=0)
+            results[i] = self.postprocess(preds, k, default_categorization_threshold, documents[i].get('valid_schedules', valid_schedules))
+            if i in cascade_results:
+                cascade_result, confident = cascade_results[i]
+                self.cascade.record_comparison(confident, cascade_result[0][0].schedule == results[i][0][0].schedule)
+        return results
+
+    def warmup(self, rounds=3):
+        """
+        Run synthetic predictions at the length of every token bucket so that lazy initialization
+        and shape specific kernel selection happen before real traffic arrives.
+        """
+        boundaries = self.batcher.bucket_boundaries if self.batcher is not None else DEFAULT_BUCKET_BOUNDARIES
+        timings = {}
+        for boundary in boundaries:
+            input_ids = self.tokenize(self.format_input('warmup ' * boundary, 'document', None, False, [], [], []))
+            # Keep the closing special token when cutting the input down to the bucket length
+            if len(input_ids) > boundary:
+                input_ids = input_ids[:boundary - 1] + input_ids[-1:]
+            timings[boundary] = []
+            for _ in range(rounds):
+                start = time.perf_counter()
+                self.postprocess(self.logits(input_ids), 3, 0.95, None)
+                timings[boundary].append((time.perf_counter() - start) * 1000)
+        if self.logger is not None:
+            for boundary, values in timings.items():
+                self.logger.info('Warmup ' + str(boundary) + ' tokens -- p50: ' + format(np.percentile(values, 50), '.1f') + 'ms, p99: ' + format(np.percentile(values, 99), '.1f') + 'ms')
+        return timings
+
+    def close(self):
+        if self.batcher is not None:
+            self.batcher.close()
+
+    def get_stats(self):
+        stats = {'version': self.version, 'backend': self.backend_name, 'num_labels': len(self.label_mapping), 'max_windows': self.max_windows, 'tokenizer_pool_size': self.tokenizer_pool.size, 'tokenizers_available': self.tokenizer_pool.available()}
+        if self.batcher is not None:
+            stats['batching'] = self.batcher.get_stats()
+        if self.cascade is not None:
+            stats['cascade'] = self.cascade.get_stats()
+        return stats
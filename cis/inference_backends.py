@@ -0,0 +1,185 @@
+from transformers import AutoConfig, AutoModelForSequenceClassification
+import torch
+import os
+import shutil
+import tempfile
+import json
+import mmap
+import struct
+
+ONNX_FILE_NAME = 'model.onnx'
+SAFETENSORS_FILE_NAME = 'model.safetensors'
+SAFETENSORS_DTYPES = {
+    'F64': torch.float64,
+    'F32': torch.float32,
+    'F16': torch.float16,
+    'BF16': torch.bfloat16,
+    'I64': torch.int64,
+    'I32': torch.int32,
+    'I16': torch.int16,
+    'I8': torch.int8,
+    'U8': torch.uint8,
+    'BOOL': torch.bool
+}
+QUANTIZED_FILE_NAME = 'model_int8.pt'
+
+def convert_to_safetensors(model_path, weights_path):
+    # Imported here since safetensors is only needed to convert checkpoints saved in the pytorch_model.bin format
+    from safetensors.torch import save_file
+    model = AutoModelForSequenceClassification.from_pretrained(model_path)
+    tmp_path = weights_path + '.tmp'
+    save_file({k: v.contiguous() for k, v in model.state_dict().items()}, tmp_path, metadata={'format': 'pt'})
+    os.replace(tmp_path, weights_path)
+
+def mmap_safetensors(weights_path):
+    """
+    Maps a safetensors file into memory and returns tensors which point directly at the mapped pages.
+    The mapping is private (copy on write), so pages are shared with the page cache and with any other
+    process mapping the same file, including workers forked after the model is loaded, until they are written to.
+    """
+    with open(weights_path, 'rb') as f:
+        header_size = struct.unpack('<Q', f.read(8))[0]
+        header = json.loads(f.read(header_size))
+        buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)
+    data_start = 8 + header_size
+    tensors = {}
+    for name, info in header.items():
+        if name == '__metadata__':
+            continue
+        dtype = SAFETENSORS_DTYPES[info['dtype']]
+        start, end = info['data_offsets']
+        count = (end - start) // torch.tensor([], dtype=dtype).element_size()
+        if count == 0:
+            tensors[name] = torch.empty(info['shape'], dtype=dtype)
+        else:
+            tensors[name] = torch.frombuffer(buffer, dtype=dtype, count=count, offset=data_start + start).reshape(info['shape'])
+    return tensors
+
+def load_mmap_model(model_path, logger=None):
+    weights_path = os.path.join(model_path, SAFETENSORS_FILE_NAME)
+    if not os.path.exists(weights_path):
+        if logger is not None:
+            logger.info('Converting model weights to safetensors at ' + weights_path)
+        convert_to_safetensors(model_path, weights_path)
+    state_dict = mmap_safetensors(weights_path)
+    model = AutoModelForSequenceClassification.from_config(AutoConfig.from_pretrained(model_path))
+    missing = [name for name, _ in model.named_parameters() if name not in state_dict]
+    if len(missing) > 0:
+        if logger is not None:
+            logger.info('Safetensors weights do not match the model (missing ' + ', '.join(missing[:5]) + '). Loading without mmap.')
+        return AutoModelForSequenceClassification.from_pretrained(model_path)
+    # Point parameters and buffers at the mapped tensors instead of copying the weights into private memory
+    for name, param in model.named_parameters():
+        param.data = state_dict[name]
+    for name, _ in model.named_buffers():
+        if name in state_dict:
+            module_name, _, buffer_name = name.rpartition('.')
+            model.get_submodule(module_name)._buffers[buffer_name] = state_dict[name]
+    model.eval()
+    return model
+
+def intra_op_thread_count(intra_op_threads, workers, threads, max_batch_size, cpu_count=None):
+    if intra_op_threads is not None:
+        return intra_op_threads
+    # Every worker process gets its share of the cores, which concurrent predictions split between them unless
+    # batching funnels them through one scheduler thread
+    cpu_count = cpu_count or os.cpu_count() or 1
+    return max(1, cpu_count // (workers * (1 if max_batch_size > 1 else threads)))
+
+def configure_threads(intra_op_threads, inter_op_threads=1, logger=None):
+    torch.set_num_threads(intra_op_threads)
+    try:
+        torch.set_num_interop_threads(inter_op_threads)
+    except RuntimeError:
+        # The inter-op pool can only be sized once, before any inter-op parallel work has started
+        if logger is not None:
+            logger.info('Inter-op thread count already set to ' + str(torch.get_num_interop_threads()) + '.')
+    if logger is not None:
+        logger.info('Inference threads -- intra-op: ' + str(torch.get_num_threads()) + ', inter-op: ' + str(torch.get_num_interop_threads()))
+
+class PyTorchBackend():
+    def __init__(self, model_path, logger=None):
+        self.model = load_mmap_model(model_path, logger)
+
+    def forward(self, input_ids, attention_mask):
+        # Inference mode skips autograd tracking and version counters entirely
+        with torch.inference_mode():
+            outputs = self.model(input_ids=torch.from_numpy(input_ids), attention_mask=torch.from_numpy(attention_mask))
+        return outputs[0].cpu().numpy()
+
+def quantize_model(model):
+    # Dynamic quantization stores linear layer weights as int8 and quantizes activations on the fly
+    return torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+
+def save_quantized(model_path):
+    model = quantize_model(AutoModelForSequenceClassification.from_pretrained(model_path))
+    quantized_path = os.path.join(model_path, QUANTIZED_FILE_NAME)
+    torch.save(model.state_dict(), quantized_path)
+    return quantized_path
+
+class QuantizedPyTorchBackend(PyTorchBackend):
+    def __init__(self, model_path, logger=None):
+        quantized_path = os.path.join(model_path, QUANTIZED_FILE_NAME)
+        if os.path.exists(quantized_path):
+            # Build the quantized module structure from the config and load the pre-quantized weights into it
+            model = quantize_model(AutoModelForSequenceClassification.from_config(AutoConfig.from_pretrained(model_path)))
+            model.load_state_dict(torch.load(quantized_path))
+            model.eval()
+            self.model = model
+        else:
+            if logger is not None:
+                logger.info('No pre-quantized model found at ' + quantized_path + '. Quantizing at load time.')
+            self.model = quantize_model(AutoModelForSequenceClassification.from_pretrained(model_path))
+
+def export_onnx(model_path, onnx_path):
+    model = AutoModelForSequenceClassification.from_pretrained(model_path)
+    dummy_input_ids = torch.ones((1, 8), dtype=torch.int64)
+    dummy_attention_mask = torch.ones((1, 8), dtype=torch.int64)
+    # Export into a temporary directory first so that a partially written graph is never picked up by another process
+    tmp_dir = tempfile.mkdtemp(dir=os.path.dirname(onnx_path))
+    try:
+        torch.onnx.export(
+            model,
+            (dummy_input_ids, dummy_attention_mask),
+            os.path.join(tmp_dir, os.path.basename(onnx_path)),
+            input_names=['input_ids', 'attention_mask'],
+            output_names=['logits'],
+            dynamic_axes={'input_ids': {0: 'batch', 1: 'sequence'}, 'attention_mask': {0: 'batch', 1: 'sequence'}, 'logits': {0: 'batch'}},
+            opset_version=14
+        )
+        # Move any external weight files before the graph itself
+        exported = sorted(os.listdir(tmp_dir), key=lambda x: x == os.path.basename(onnx_path))
+        for name in exported:
+            os.replace(os.path.join(tmp_dir, name), os.path.join(os.path.dirname(onnx_path), name))
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+class OnnxBackend():
+    def __init__(self, model_path, logger=None):
+        # Imported here so that onnxruntime is only required when the ONNX backend is selected
+        import onnxruntime as ort
+        onnx_path = os.path.join(model_path, ONNX_FILE_NAME)
+        if not os.path.exists(onnx_path):
+            if logger is not None:
+                logger.info('Exporting model to ONNX at ' + onnx_path)
+            export_onnx(model_path, onnx_path)
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        # Use the same per-prediction thread budget as the pytorch backends
+        options.intra_op_num_threads = torch.get_num_threads()
+        options.inter_op_num_threads = torch.get_num_interop_threads()
+        self.session = ort.InferenceSession(onnx_path, options, providers=['CPUExecutionProvider'])
+
+    def forward(self, input_ids, attention_mask):
+        return self.session.run(['logits'], {'input_ids': input_ids, 'attention_mask': attention_mask})[0]
+
+MODEL_BACKENDS = {
+    'pytorch': PyTorchBackend,
+    'pytorch_int8': QuantizedPyTorchBackend,
+    'onnx': OnnxBackend
+}
+
+def load_backend(backend_name, model_path, logger=None):
+    if backend_name not in MODEL_BACKENDS:
+        raise ValueError('Unknown model backend ' + str(backend_name) + '. Options are ' + ', '.join(MODEL_BACKENDS.keys()) + '.')
+    return MODEL_BACKENDS[backend_name](model_path, logger)
@@ -0,0 +1,114 @@
+import threading
+import time
+from collections import Counter
+
+DEFAULT_BUCKET_BOUNDARIES = [64, 128, 256, 512]
+
+class PendingPrediction():
+    def __init__(self, input_ids):
+        self.input_ids = input_ids
+        self.logits = None
+        self.error = None
+        self.done = threading.Event()
+
+class InferenceBatcher():
+    """
+    Collects concurrent prediction requests for a short window and runs them through the model together.
+    Requests are grouped into token length buckets so that short inputs are not padded to the length of long ones.
+    """
+    def __init__(self, forward_fn, max_batch_size=8, max_wait_ms=5, bucket_boundaries=None, logger=None):
+        self.forward_fn = forward_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.bucket_boundaries = sorted(bucket_boundaries or DEFAULT_BUCKET_BOUNDARIES)
+        self.logger = logger
+        self.condition = threading.Condition()
+        self.pending = []
+        self.thread = None
+        self.closed = False
+        self.batch_size_counts = Counter()
+        self.total_batches = 0
+        self.total_requests = 0
+
+    def bucket_for(self, length):
+        for boundary in self.bucket_boundaries:
+            if length <= boundary:
+                return boundary
+        return self.bucket_boundaries[-1]
+
+    def submit(self, input_ids):
+        item = PendingPrediction(input_ids)
+        with self.condition:
+            # The scheduler thread is started lazily so that it is created in the process which serves requests
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(target=self.run, name='inference-batcher', daemon=True)
+                self.thread.start()
+            self.pending.append(item)
+            self.condition.notify()
+        item.done.wait()
+        if item.error is not None:
+            raise item.error
+        return item.logits
+
+    def close(self):
+        # The scheduler thread exits once the requests already queued have been served
+        with self.condition:
+            self.closed = True
+            self.condition.notify()
+
+    def next_batch(self):
+        with self.condition:
+            while len(self.pending) == 0:
+                if self.closed:
+                    return None
+                self.condition.wait()
+            # Wait for the batch to fill up or for the window to close, whichever comes first
+            deadline = time.monotonic() + self.max_wait
+            while len(self.pending) < self.max_batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self.condition.wait(remaining)
+            batch = self.pending[:self.max_batch_size]
+            self.pending = self.pending[self.max_batch_size:]
+            return batch
+
+    def run(self):
+        while True:
+            batch = self.next_batch()
+            if batch is None:
+                return
+            buckets = {}
+            for item in batch:
+                buckets.setdefault(self.bucket_for(len(item.input_ids)), []).append(item)
+            for items in buckets.values():
+                self.run_bucket(items)
+
+    def run_bucket(self, items):
+        try:
+            logits = self.forward_fn([item.input_ids for item in items])
+            for i, item in enumerate(items):
+                item.logits = logits[i]
+        except Exception as e:
+            if self.logger is not None:
+                self.logger.exception('Batched inference failed.')
+            for item in items:
+                item.error = e
+        with self.condition:
+            self.batch_size_counts[len(items)] += 1
+            self.total_batches += 1
+            self.total_requests += len(items)
+        for item in items:
+            item.done.set()
+
+    def get_stats(self):
+        with self.condition:
+            return {
+                'queue_depth': len(self.pending),
+                'max_batch_size': self.max_batch_size,
+                'max_wait_ms': self.max_wait * 1000,
+                'bucket_boundaries': self.bucket_boundaries,
+                'total_batches': self.total_batches,
+                'total_requests': self.total_requests,
+                'batch_size_distribution': {str(k): v for k, v in sorted(self.batch_size_counts.items())}
+            }
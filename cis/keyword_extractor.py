@@ -9,42 +9,106 @@ import spacy
 import pytz
 from datetime import datetime
 import calendar
-
-def search_keywords(automaton, content):
-    keywords = []
-    for end_index, (_, original_value) in automaton.iter(content.lower()):
-        start_index = end_index - len(original_value) + 1
-        keywords.append((original_value, start_index))
-    return keywords
-
-def extract_keywords(doc, kwtree, keyword_idf):
-    keywords = search_keywords(kwtree, doc)
+import heapq
+import numpy as np
+from .ranking import top_k
+
+# Terms only count as whole words, i.e. between one of these characters before and one after
+BOUNDARY_PREFIXES = frozenset(['\n', ' ', "'", '"'])
+BOUNDARY_SUFFIXES = frozenset(['\n', ' ', ',', '.', '?', "'", '"'])
+# Characters of text lowercased and scanned at a time
+CHUNK_SIZE = 64 * 1024
+
+def build_automaton(words):
+    """Automaton over the non-empty words, with (id, word) payloads where id is the position of the word in words."""
+    automaton = ahocorasick.Automaton()
+    for word_id, word in enumerate(words):
+        if word != '':
+            automaton.add_word(word, (word_id, word))
+    automaton.make_automaton()
+    return automaton
+
+def longest_word(automaton):
+    return automaton.get_stats()['longest_word']
+
+def chunk_end(content, position, chunk_size):
+    """End of the chunk of content starting at position, just after a space or newline so lowercasing it alone gives the same text."""
+    end = position + chunk_size
+    if end >= len(content):
+        return len(content)
+    split = max(content.rfind(' ', position, end), content.rfind('\n', position, end))
+    if split < position:
+        following = [i for i in (content.find(' ', end), content.find('\n', end)) if i >= 0]
+        return min(following) + 1 if following else len(content)
+    return split + 1
+
+def whole_word_matches(automaton, content, max_length=None, chunk_size=CHUNK_SIZE):
+    """
+    (start index, payload) of the matches in content which are whole words, in the order of their end index. payload[1]
+    must be the matched word and max_length the length of the longest word. Indices are into content.lower(), which is
+    built one chunk at a time, each scanned together with the max_length + 1 characters before it.
+    """
+    if max_length is None:
+        max_length = longest_word(automaton)
+    lowered = ''
+    offset = 0
+    checked = 0
+    position = 0
+    while position < len(content):
+        split = chunk_end(content, position, chunk_size)
+        keep = max(checked - max_length - offset, 0)
+        offset += keep
+        lowered = lowered[keep:] + content[position:split].lower()
+        position = split
+        last_index = len(lowered) - 1
+        for end_index, payload in automaton.iter(lowered):
+            start_index = end_index - len(payload[1]) + 1
+            # Matches ending before checked were found in the previous chunk, the last one needs the next character
+            if end_index + offset >= checked and start_index > 0 and end_index < last_index and lowered[start_index - 1] in BOUNDARY_PREFIXES and lowered[end_index + 1] in BOUNDARY_SUFFIXES:
+                yield offset + start_index, payload
+        checked = offset + last_index
+
+def search_keywords(automaton, content, max_length=None):
+    return [(word_id, word, start_index) for start_index, (word_id, word) in whole_word_matches(automaton, content, max_length)]
+
+def resolve_keywords(automaton, doc, max_length=None):
+    if max_length is None:
+        max_length = longest_word(automaton)
+    return resolve_matches(((word_id, word, start_index) for start_index, (word_id, word) in whole_word_matches(automaton, doc, max_length)), max_length)
+
+def longest_match_at_each_start(matches, max_length):
+    """
+    (start index, id, word) of the longest of the (id, word, start index) matches at each start, in start order. matches
+    must come in end index order, so a start is settled once a match ends max_length characters past it.
+    """
+    pending = {}
+    starts = []
+    for word_id, word, start_index in matches:
+        end_index = start_index + len(word) - 1
+        while starts and starts[0] <= end_index - max_length:
+            settled = heapq.heappop(starts)
+            yield (settled,) + pending.pop(settled)
+        if start_index not in pending:
+            heapq.heappush(starts, start_index)
+            pending[start_index] = (word_id, word)
+        elif len(word) > len(pending[start_index][1]):
+            pending[start_index] = (word_id, word)
+    while starts:
+        settled = heapq.heappop(starts)
+        yield (settled,) + pending.pop(settled)
+
+def resolve_matches(matches, max_length):
+    """(id, word) of the matches left after keeping the longest word at each start and dropping the words it overlaps, in text order."""
+    current_end = 0
+    for start_index, word_id, word in longest_match_at_each_start(matches, max_length):
+        if start_index > current_end:
+            yield word_id, word
+            current_end = start_index + len(word)
+
+def extract_keywords(doc, kwtree, keyword_idf, max_length=None):
     keyword_counts = {}
-    current_longest_word = ''
-    current_starting_index = 0
-    for k, v in sorted(keywords, key=lambda x: x[1]):
-        word = k[1:-1]
-        actual_index = v + 1
-        if actual_index == current_starting_index:
-            if len(word) > len(current_longest_word):
-                current_longest_word = word
-                continue
-        if actual_index <= current_starting_index + len(current_longest_word):
-            continue
-        if actual_index > current_starting_index + len(current_longest_word):
-            if current_longest_word != '':
-                if current_longest_word not in keyword_counts:
-                    keyword_counts[current_longest_word] = keyword_idf.get(current_longest_word, 1)
-                else:
-                    keyword_counts[current_longest_word] += keyword_idf.get(current_longest_word, 1)
-            current_starting_index = actual_index
-            current_longest_word = word
-
-    if current_longest_word != '':
-        if current_longest_word not in keyword_counts:
-            keyword_counts[current_longest_word] = keyword_idf.get(current_longest_word, 1)
-        else:
-            keyword_counts[current_longest_word] += keyword_idf.get(current_longest_word, 1)
+    for _, word in resolve_keywords(kwtree, doc, max_length):
+        keyword_counts[word] = keyword_counts.get(word, 0) + keyword_idf.get(word, 1)
     return keyword_counts
 
 def convert_keywords_to_subjects(text, keyword_weights, keyword_mapping, priority_categories, num_top_cats=3):
@@ -69,22 +133,16 @@ def convert_keywords_to_subjects(text, keyword_weights, keyword_mapping, priorit
 
 class CapstoneDetector():
     def __init__(self, capstone_path):
-        index = 0
-        self.capstone_kwtree = ahocorasick.Automaton()
         self.capstone_set = set([])
         with open(capstone_path, 'r') as f:
             for line in f.read().splitlines():
-                item = line.lower().replace('"', '')
-                for prefix in ['\n', ' ',"'",'"']:
-                    for suffix in ['\n', ' ', ',','.','?',"'",'"']:
-                        padded = prefix + item + suffix
-                        self.capstone_kwtree.add_word(padded, (index, padded))
-                        index += 1
-                self.capstone_set.add(item)
-        self.capstone_kwtree.make_automaton()
+                self.capstone_set.add(line.lower().replace('"', ''))
+        self.capstone_kwtree = build_automaton(self.capstone_set)
+        self.max_length = longest_word(self.capstone_kwtree)
     
     def detect_capstone_text(self, text):
-        return len(extract_keywords(text, self.capstone_kwtree, {})) > 0
+        # Any match survives resolving overlaps, so there is no need to resolve them
+        return any(True for _ in whole_word_matches(self.capstone_kwtree, text, self.max_length))
     
     def detect_capstone_username(self, aliases):
         for x in aliases:
@@ -92,6 +150,47 @@ class CapstoneDetector():
                 return True
         return False
 
+class KeywordScores():
+    """
+    Keyword and subject weights of one text, as ids into the extractor's vocabulary and subjects. Both are kept in
+    the order they first appear in the text, which is how ties were broken when the weights were dicts.
+    """
+    def __init__(self, extractor, matched_ids, has_capstone=None):
+        self.extractor = extractor
+        self.has_capstone = has_capstone
+        matched_ids = np.asarray(matched_ids, dtype=np.int64)
+        keyword_ids, first_index, inverse = np.unique(matched_ids, return_index=True, return_inverse=True)
+        order = np.argsort(first_index)
+        # bincount adds the weights in match order, so the sums equal adding them up one match at a time
+        weights = np.bincount(inverse, weights=extractor.idf[matched_ids], minlength=len(keyword_ids))
+        self.keyword_ids = keyword_ids[order]
+        self.weights = weights[order]
+        subject_ids = extractor.keyword_subjects[self.keyword_ids]
+        mapped = subject_ids >= 0
+        subject_ids, first_index, inverse = np.unique(subject_ids[mapped], return_index=True, return_inverse=True)
+        order = np.argsort(first_index)
+        self.subject_ids = subject_ids[order]
+        self.subject_weights = np.bincount(inverse, weights=self.weights[mapped], minlength=len(subject_ids))[order]
+
+    def keyword_weights(self):
+        vocabulary = self.extractor.vocabulary
+        return {vocabulary[i]: weight for i, weight in zip(self.keyword_ids.tolist(), self.weights.tolist())}
+
+    def top_keywords(self, k=5):
+        return [self.extractor.vocabulary[i] for i in self.keyword_ids[top_k(self.weights, k)].tolist()]
+
+    def subjects(self, text, num_top_cats=3):
+        subject_names = self.extractor.subject_names
+        top_cats = set(subject_names[i] for i in self.subject_ids[top_k(self.subject_weights, num_top_cats)].tolist())
+        subjects = {subject_names[i]: weight for i, weight in zip(self.subject_ids.tolist(), self.subject_weights.tolist())}
+        for p in self.extractor.priority_categories:
+            if p in subjects and subjects[p] > 0 and len(text) <= 2000:
+                top_cats.add(p)
+            # Same threshold as convert_keywords_to_subjects
+            elif p in subjects and subjects[p] >= 12 and len(text) > 2000:
+                top_cats.add(p)
+        return list(top_cats)
+
 class KeywordExtractor():
     def __init__(self, vocab_path, priority_categories_path, keyword_idf_path):
         with open(vocab_path, 'r', encoding='cp1252') as f:
@@ -101,23 +200,53 @@ class KeywordExtractor():
         with open(keyword_idf_path, 'r') as f:
             self.keyword_idf = json.loads(f.read())
 
-        self.kwtree = ahocorasick.Automaton()
-        index = 0
-        for row in self.keyword_mapping.keys():
-            word = row.lower()
-            for prefix in ['\n', ' ',"'",'"']:
-                for suffix in ['\n', ' ', ',','.','?',"'",'"']:
-                    padded = prefix + word + suffix
-                    self.kwtree.add_word(padded, (index, padded))
-            index += 1
-        self.kwtree.make_automaton()
+        self.vocabulary = sorted(set(row.lower() for row in self.keyword_mapping.keys()))
+        self.kwtree = build_automaton(self.vocabulary)
+        self.max_length = longest_word(self.kwtree)
+        self.idf = np.array([self.keyword_idf.get(word, 1) for word in self.vocabulary], dtype=np.float64)
+        # Matches are lower case, so only terms written in lower case in the vocabulary file map to a subject
+        self.subject_names = sorted(set(self.keyword_mapping.values()))
+        subject_index = {subject: i for i, subject in enumerate(self.subject_names)}
+        self.keyword_subjects = np.array([subject_index.get(self.keyword_mapping.get(word), -1) for word in self.vocabulary], dtype=np.int64)
     
+    def score(self, text):
+        return KeywordScores(self, np.fromiter((word_id for word_id, _ in resolve_keywords(self.kwtree, text, self.max_length)), dtype=np.int64))
+
     def extract_keywords(self, text):
-        return extract_keywords(text, self.kwtree, self.keyword_idf)
+        return self.score(text).keyword_weights()
     
     def extract_subjects(self, text, keyword_weights):
         return convert_keywords_to_subjects(text, keyword_weights, self.keyword_mapping, self.priority_categories)
 
+class DocumentScanner():
+    """
+    Finds the keywords and the Capstone officials of a text in one pass over it, with a single automaton whose
+    payloads are (keyword id or -1, word, is Capstone official). Gives the same results as running
+    KeywordExtractor.score and CapstoneDetector.detect_capstone_text separately.
+    """
+    def __init__(self, keyword_extractor, capstone_detector):
+        self.keyword_extractor = keyword_extractor
+        keyword_ids = {word: word_id for word_id, word in enumerate(keyword_extractor.vocabulary)}
+        self.automaton = ahocorasick.Automaton()
+        for word in keyword_ids.keys() | capstone_detector.capstone_set:
+            if word != '':
+                self.automaton.add_word(word, (keyword_ids.get(word, -1), word, word in capstone_detector.capstone_set))
+        self.automaton.make_automaton()
+        self.max_length = longest_word(self.automaton)
+
+    def scan(self, text):
+        """KeywordScores of text, with has_capstone set."""
+        has_capstone = False
+        def keyword_matches():
+            nonlocal has_capstone
+            for start_index, (word_id, word, is_capstone) in whole_word_matches(self.automaton, text, self.max_length):
+                # Capstone matches are resolved on their own, and any match survives resolving, so one is enough
+                has_capstone = has_capstone or is_capstone
+                if word_id >= 0:
+                    yield word_id, word, start_index
+        matched_ids = np.fromiter((word_id for word_id, _ in resolve_matches(keyword_matches(), self.max_length)), dtype=np.int64)
+        return KeywordScores(self.keyword_extractor, matched_ids, has_capstone)
+
 # Dedupe a list of identifiers case insensitively
 def dedupe_lower(_set):
     result=[]
@@ -0,0 +1,231 @@
+from .data_classes import TikaResult
+from bs4 import BeautifulSoup
+from collections import Counter
+from email import policy
+from email.parser import BytesParser
+import xml.etree.ElementTree as ET
+import threading
+import posixpath
+import zipfile
+import io
+import re
+
+# Larger inputs are left to Tika, which streams them instead of holding them in memory
+MAX_LOCAL_BYTES = 20 * 1024 * 1024
+MAX_ZIP_MEMBER_BYTES = 50 * 1024 * 1024
+
+W = '{http://schemas.openxmlformats.org/wordprocessingml/2006/main}'
+S = '{http://schemas.openxmlformats.org/spreadsheetml/2006/main}'
+A = '{http://schemas.openxmlformats.org/drawingml/2006/main}'
+CUSTOM_PROPERTIES = '{http://schemas.openxmlformats.org/officeDocument/2006/custom-properties}'
+R = '{http://schemas.openxmlformats.org/officeDocument/2006/relationships}'
+RELATIONSHIPS = '{http://schemas.openxmlformats.org/package/2006/relationships}'
+
+def read_body(body, limit):
+    if isinstance(body, (bytes, bytearray)):
+        return bytes(body[:limit + 1])
+    body.seek(0)
+    data = body.read(limit + 1)
+    body.seek(0)
+    return data
+
+def read_member(archive, name):
+    if archive.getinfo(name).file_size > MAX_ZIP_MEMBER_BYTES:
+        raise ValueError('Archive member ' + name + ' is too large to extract locally.')
+    return archive.read(name)
+
+def numbered_members(archive, pattern):
+    # Order slide1, slide2, ..., slide10 numerically
+    members = [(int(m.group(1)), name) for name in archive.namelist() for m in [re.fullmatch(pattern, name)] if m is not None]
+    return [name for _, name in sorted(members)]
+
+def msip_labels(archive):
+    """Names of the sensitivity labels stored as MSIP_Label_<id>_Name custom document properties."""
+    if 'docProps/custom.xml' not in archive.namelist():
+        return []
+    labels = []
+    for prop in ET.fromstring(read_member(archive, 'docProps/custom.xml')).iter(CUSTOM_PROPERTIES + 'property'):
+        name = prop.get('name', '')
+        if 'MSIP_Label_' in name and '_Name' in name and len(prop) > 0:
+            labels.append(prop[0].text or '')
+    return labels
+
+def paragraph_parts(node, paragraph_tag, text_tag, extra_tags):
+    for child in node:
+        # Paragraphs nested in text boxes or tables are lines of their own, so their text is not repeated here
+        if child.tag == paragraph_tag:
+            continue
+        if child.tag == text_tag:
+            yield child.text or ''
+        elif child.tag in extra_tags:
+            yield extra_tags[child.tag]
+        yield from paragraph_parts(child, paragraph_tag, text_tag, extra_tags)
+
+def paragraphs_text(root, paragraph_tag, text_tag, extra_tags={}):
+    return '\n'.join(''.join(paragraph_parts(paragraph, paragraph_tag, text_tag, extra_tags)) for paragraph in root.iter(paragraph_tag))
+
+def docx_text(archive):
+    names = archive.namelist()
+    parts = [name for name in names if re.fullmatch(r'word/header\d*\.xml', name)]
+    parts += ['word/document.xml', 'word/footnotes.xml', 'word/endnotes.xml']
+    parts += [name for name in names if re.fullmatch(r'word/footer\d*\.xml', name)]
+    texts = []
+    for name in parts:
+        if name in names:
+            texts.append(paragraphs_text(ET.fromstring(read_member(archive, name)), W + 'p', W + 't', {W + 'tab': '\t', W + 'br': '\n'}))
+    return '\n'.join(texts)
+
+def workbook_sheets(archive):
+    """(name, part) of each worksheet in tab order. Part numbers keep the order sheets were created in, not their tab order."""
+    names = set(archive.namelist())
+    targets = {}
+    if 'xl/_rels/workbook.xml.rels' in names:
+        for relationship in ET.fromstring(read_member(archive, 'xl/_rels/workbook.xml.rels')).iter(RELATIONSHIPS + 'Relationship'):
+            # Chart sheets have no cells
+            if not relationship.get('Type', '').endswith('/worksheet'):
+                continue
+            target = relationship.get('Target', '')
+            # Targets are relative to xl/ unless they start at the package root
+            targets[relationship.get('Id')] = target[1:] if target.startswith('/') else posixpath.normpath('xl/' + target)
+    sheets = []
+    for sheet in ET.fromstring(read_member(archive, 'xl/workbook.xml')).iter(S + 'sheet'):
+        target = targets.get(sheet.get(R + 'id'))
+        if target in names:
+            sheets.append((sheet.get('name', ''), target))
+    return sheets
+
+def xlsx_text(archive):
+    names = archive.namelist()
+    shared_strings = []
+    if 'xl/sharedStrings.xml' in names:
+        for item in ET.fromstring(read_member(archive, 'xl/sharedStrings.xml')).iter(S + 'si'):
+            shared_strings.append(''.join(t.text or '' for t in item.iter(S + 't')))
+    texts = []
+    for sheet_name, name in workbook_sheets(archive):
+        rows = [sheet_name]
+        for row in ET.fromstring(read_member(archive, name)).iter(S + 'row'):
+            cells = []
+            for cell in row.iter(S + 'c'):
+                cell_type = cell.get('t')
+                if cell_type == 'inlineStr':
+                    cells.append(''.join(t.text or '' for t in cell.iter(S + 't')))
+                    continue
+                value = cell.find(S + 'v')
+                if value is None or value.text is None:
+                    continue
+                if cell_type == 's':
+                    cells.append(shared_strings[int(value.text)])
+                else:
+                    cells.append(value.text)
+            rows.append('\t'.join(cells))
+        texts.append('\n'.join(rows))
+    return '\n'.join(texts)
+
+def pptx_text(archive):
+    texts = []
+    for name in numbered_members(archive, r'ppt/slides/slide(\d+)\.xml'):
+        texts.append(paragraphs_text(ET.fromstring(read_member(archive, name)), A + 'p', A + 't', {A + 'br': '\n'}))
+    return '\n'.join(texts)
+
+OOXML_EXTRACTORS = [
+    ('word/document.xml', 'docx', docx_text),
+    ('xl/workbook.xml', 'xlsx', xlsx_text),
+    ('ppt/presentation.xml', 'pptx', pptx_text)
+]
+
+def html_text(html):
+    soup = BeautifulSoup(html, 'html.parser')
+    for node in soup(['script', 'style']):
+        node.decompose()
+    return soup.get_text()
+
+def eml_text(data):
+    msg = BytesParser(policy=policy.default).parsebytes(data)
+    body = msg.get_body(preferencelist=('plain', 'html'))
+    text = ''
+    if body is not None:
+        text = body.get_content()
+        if body.get_content_type() == 'text/html':
+            text = html_text(text)
+    return (msg['subject'] or '') + '\n' + text
+
+def looks_like_eml(head):
+    # RFC 822 messages start with header lines, and saved messages nearly always carry these
+    header_names = set(m.group(1).lower() for m in re.finditer(rb'^([A-Za-z-]+):', head, re.MULTILINE))
+    return len(header_names & {b'from', b'to', b'subject', b'date', b'message-id', b'mime-version', b'received'}) >= 3
+
+def looks_like_plain_text(text):
+    # Markup, PostScript and vCard or iCalendar files are parsed by Tika into something other than their raw text
+    head = text[:4096]
+    if head.lstrip().startswith(('<', '%!', 'BEGIN:VCARD', 'BEGIN:VCALENDAR')):
+        return False
+    return all(x.isprintable() or x in '\t\n\r\f' for x in head)
+
+def looks_like_html(head):
+    head = head.lstrip().lower()
+    return head.startswith(b'<!doctype html') or head.startswith(b'<html') or (head.startswith(b'<') and b'<body' in head)
+
+class LocalExtractors():
+    """
+    Extracts text from plain text, CSV, HTML, EML and OOXML (docx, xlsx, pptx) files in process.
+    Everything else, and anything which fails to parse here, is sent to Tika.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.extracted = Counter()
+        self.fallbacks = 0
+
+    def extract(self, body, preflight, logger=None):
+        if preflight.size > MAX_LOCAL_BYTES or preflight.kind not in ('zip', 'other'):
+            return None
+        try:
+            if preflight.kind == 'zip':
+                result = self.extract_ooxml(body)
+            else:
+                result = self.extract_text(read_body(body, MAX_LOCAL_BYTES))
+        except Exception:
+            if logger is not None:
+                logger.info('Local extraction failed, falling back to Tika.', exc_info=True)
+            with self.lock:
+                self.fallbacks += 1
+            return None
+        if result is None:
+            return None
+        file_format, tika_result = result
+        with self.lock:
+            self.extracted[file_format] += 1
+        return tika_result
+
+    def extract_ooxml(self, body):
+        if isinstance(body, (bytes, bytearray)):
+            body = io.BytesIO(body)
+        body.seek(0)
+        try:
+            with zipfile.ZipFile(body) as archive:
+                names = set(archive.namelist())
+                for marker, file_format, extractor in OOXML_EXTRACTORS:
+                    if marker in names:
+                        return file_format, TikaResult(text=extractor(archive), is_encrypted=False, cui_categories=msip_labels(archive))
+        finally:
+            body.seek(0)
+        return None
+
+    def extract_text(self, data):
+        head = data[:4096]
+        if b'\x00' in head or head.startswith(b'{\\rtf') or head.lstrip().startswith(b'<?xml'):
+            return None
+        if looks_like_eml(head):
+            return 'eml', TikaResult(text=eml_text(data), is_encrypted=False, cui_categories=[])
+        try:
+            text = data.decode('utf-8-sig')
+        except UnicodeDecodeError:
+            return None
+        if looks_like_html(head):
+            return 'html', TikaResult(text=html_text(text), is_encrypted=False, cui_categories=[])
+        if not looks_like_plain_text(text):
+            return None
+        return 'text', TikaResult(text=text, is_encrypted=False, cui_categories=[])
+
+    def get_stats(self):
+        with self.lock:
+            return {'extracted': dict(self.extracted), 'fallbacks': self.fallbacks}
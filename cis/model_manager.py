@@ -0,0 +1,70 @@
+from .hf_model import HuggingFaceModel
+from datetime import datetime
+import threading
+import traceback
+import os
+
+class ModelManager():
+    """
+    Holds the active HuggingFaceModel and swaps in new models without restarting the server.
+    Callers take a reference to the current model for the duration of a request, so in-flight predictions
+    finish on the model they started with while new requests go to the swapped in model. Swapped in models
+    must be under model_root, and swaps are refused when there are several worker processes since only the
+    one which received the request would change model.
+    """
+    def __init__(self, model, model_options, logger, warmup_rounds=3, model_root=None, workers=1):
+        self.current = model
+        self.model_root = os.path.realpath(model_root) if model_root else None
+        self.workers = workers
+        self.model_options = model_options
+        self.warmup_rounds = warmup_rounds
+        self.logger = logger
+        self.lock = threading.Lock()
+        self.swap_thread = None
+        self.swap_status = {'state': 'idle', 'version': None, 'started': None, 'finished': None, 'error': None}
+
+    def predict(self, *args, **kwargs):
+        return self.current.predict(*args, **kwargs)
+
+    def warmup(self):
+        return self.current.warmup(self.warmup_rounds)
+
+    def swappable(self):
+        return self.model_root is not None and self.workers == 1
+
+    def in_model_root(self, path):
+        path = os.path.realpath(path)
+        return self.model_root is not None and os.path.commonpath([path, self.model_root]) == self.model_root
+
+    def start_swap(self, model_path, label_mapping_path, office_info_mapping_path, version=None):
+        with self.lock:
+            if self.swap_thread is not None and self.swap_thread.is_alive():
+                return False
+            self.swap_status = {'state': 'loading', 'version': version, 'started': datetime.now().isoformat(), 'finished': None, 'error': None}
+            self.swap_thread = threading.Thread(target=self.swap, args=(model_path, label_mapping_path, office_info_mapping_path, version), name='model-swap', daemon=True)
+            self.swap_thread.start()
+            return True
+
+    def swap(self, model_path, label_mapping_path, office_info_mapping_path, version=None):
+        try:
+            self.logger.info('Loading model from ' + model_path + ' for hot swap.')
+            new_model = HuggingFaceModel(model_path, label_mapping_path, office_info_mapping_path, version=version, logger=self.logger, **self.model_options)
+            new_model.warmup(self.warmup_rounds)
+        except Exception:
+            self.logger.error(traceback.format_exc())
+            with self.lock:
+                self.swap_status.update({'state': 'failed', 'finished': datetime.now().isoformat(), 'error': traceback.format_exc(limit=1)})
+            return
+        with self.lock:
+            old_model = self.current
+            self.current = new_model
+            self.swap_status.update({'state': 'complete', 'version': new_model.version, 'finished': datetime.now().isoformat()})
+        # Requests still holding the old model keep working, its batcher only stops once it is idle
+        old_model.close()
+        self.logger.info('Swapped model ' + old_model.version + ' for ' + new_model.version + '.')
+
+    def get_stats(self):
+        stats = self.current.get_stats()
+        with self.lock:
+            stats['swap'] = dict(self.swap_status)
+        return stats
@@ -0,0 +1,162 @@
+from concurrent.futures import ThreadPoolExecutor
+import tempfile
+import threading
+import shutil
+import json
+import time
+import uuid
+import os
+import re
+
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+
+JOB_ID = re.compile(r'^[0-9a-f]{32}$')
+EXPIRE_INTERVAL = 60
+# Jobs are polled by clients, so the cause of a failure is only logged
+FAILED_REASON = 'Text extraction failed.'
+
+class OcrJobQueue():
+    """
+    Runs OCR extractions on a small pool of background threads so that scanned documents never hold a request thread
+    while Tika works through them. Job state is written to JSON files in job_dir, which lets any worker process answer polls.
+    Every worker process has its own threads and accepts up to max_pending queued jobs, finished jobs are removed after ttl_seconds.
+    """
+    def __init__(self, job_dir, workers=2, max_pending=32, ttl_seconds=3600, logger=None):
+        self.job_dir = job_dir
+        self.workers = workers
+        self.max_pending = max_pending
+        self.ttl_seconds = ttl_seconds
+        self.logger = logger
+        self.lock = threading.Lock()
+        self.pending = 0
+        self.running = 0
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+        self.total_run_time = 0
+        os.makedirs(job_dir, exist_ok=True)
+        self.executor = None
+        self.stopped = threading.Event()
+
+    def reset(self):
+        # Forked workers start their own threads
+        self.executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='ocr')
+        self.stopped = threading.Event()
+        threading.Thread(target=self.expire_periodically, daemon=True).start()
+
+    def close(self):
+        self.stopped.set()
+        self.executor.shutdown(wait=False)
+
+    def path(self, job_id):
+        return os.path.join(self.job_dir, job_id + '.json')
+
+    def write(self, job):
+        # Replace the file in one step so that pollers in other processes never read a partial job
+        tmp_path = self.path(job['job_id']) + '.' + str(os.getpid()) + '.tmp'
+        with open(tmp_path, 'w') as f:
+            f.write(json.dumps(job))
+        os.replace(tmp_path, self.path(job['job_id']))
+
+    def read(self, job_id):
+        try:
+            with open(self.path(job_id), 'r') as f:
+                return json.loads(f.read())
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def expire(self):
+        cutoff = time.time() - self.ttl_seconds
+        for name in os.listdir(self.job_dir):
+            if name.endswith('.json'):
+                try:
+                    if os.stat(os.path.join(self.job_dir, name)).st_mtime < cutoff:
+                        os.remove(os.path.join(self.job_dir, name))
+                except FileNotFoundError:
+                    pass
+
+    def expire_periodically(self):
+        while not self.stopped.wait(EXPIRE_INTERVAL):
+            try:
+                self.expire()
+            except OSError:
+                if self.logger is not None:
+                    self.logger.exception('Could not expire OCR jobs.')
+
+    def submit(self, extract, body, owner, context=None):
+        """
+        Queue extract(file) for body, which can be bytes or a seekable file object. The body is copied first since
+        request streams are closed once the response is sent. Returns the job id, or None when the queue is full.
+        """
+        with self.lock:
+            if self.pending >= self.max_pending:
+                self.rejected += 1
+                return None
+            self.pending += 1
+        if self.executor is None:
+            self.reset()
+        try:
+            spool = tempfile.TemporaryFile(dir=self.job_dir)
+            if isinstance(body, (bytes, bytearray)):
+                spool.write(body)
+            else:
+                body.seek(0)
+                shutil.copyfileobj(body, spool)
+                body.seek(0)
+            spool.seek(0)
+            job = {'job_id': uuid.uuid4().hex, 'owner': owner, 'status': QUEUED, 'created': time.time(), 'context': context, 'result': None, 'reason': None}
+            self.write(job)
+        except:
+            with self.lock:
+                self.pending -= 1
+            raise
+        self.executor.submit(self.run, job, extract, spool)
+        return job['job_id']
+
+    def run(self, job, extract, spool):
+        start = time.monotonic()
+        with self.lock:
+            self.pending -= 1
+            self.running += 1
+        self.write(dict(job, status=RUNNING))
+        try:
+            job = dict(job, status=DONE, result=extract(spool))
+        except Exception:
+            if self.logger is not None:
+                self.logger.exception('OCR job ' + job['job_id'] + ' failed.')
+            job = dict(job, status=FAILED, reason=FAILED_REASON)
+        finally:
+            spool.close()
+        self.write(job)
+        with self.lock:
+            self.running -= 1
+            self.total_run_time += time.monotonic() - start
+            if job['status'] == DONE:
+                self.completed += 1
+            else:
+                self.failed += 1
+
+    def get(self, job_id, owner):
+        """Current state of a job. Jobs of other users are reported as missing."""
+        if JOB_ID.match(job_id) is None:
+            return None
+        job = self.read(job_id)
+        if job is None or job['owner'] != owner:
+            return None
+        return job
+
+    def get_stats(self):
+        with self.lock:
+            finished = self.completed + self.failed
+            return {
+                'workers': self.workers,
+                'pending': self.pending,
+                'running': self.running,
+                'completed': self.completed,
+                'failed': self.failed,
+                'rejected': self.rejected,
+                'mean_run_seconds': self.total_run_time / finished if finished > 0 else None
+            }
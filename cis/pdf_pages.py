@@ -0,0 +1,61 @@
+from collections import Counter
+import threading
+import io
+
+try:
+    from pypdf import PdfReader, PdfWriter
+except ImportError:
+    PdfReader = None
+
+class PdfSplitError(Exception):
+    pass
+
+class PdfPageSplitter():
+    """
+    Splits PDFs with at least min_pages pages into separate PDFs of pages_per_range pages each, so that Tika
+    can extract them in parallel instead of timing out on the whole document. Needs pypdf, without it nothing is split.
+    """
+    def __init__(self, min_pages=100, pages_per_range=25, parallelism=4):
+        self.min_pages = min_pages
+        self.pages_per_range = pages_per_range
+        self.parallelism = parallelism
+        self.lock = threading.Lock()
+        self.counts = Counter()
+
+    def applies(self, preflight):
+        return PdfReader is not None and preflight.kind == 'pdf' and preflight.page_count is not None and preflight.page_count >= self.min_pages
+
+    def ranges(self, body):
+        """
+        Yield the page ranges as PDF bytes, one range at a time so that ranges past an early stop are never built.
+        The first range keeps the document information, which is where sensitivity labels are stored.
+        """
+        try:
+            if isinstance(body, (bytes, bytearray)):
+                body = io.BytesIO(body)
+            body.seek(0)
+            reader = PdfReader(body)
+            metadata = reader.metadata
+            page_count = len(reader.pages)
+        except Exception as e:
+            raise PdfSplitError(str(e)) from e
+        for start in range(0, page_count, self.pages_per_range):
+            try:
+                writer = PdfWriter()
+                for page in reader.pages[start:start + self.pages_per_range]:
+                    writer.add_page(page)
+                if start == 0 and metadata is not None:
+                    writer.add_metadata(metadata)
+                data = io.BytesIO()
+                writer.write(data)
+            except Exception as e:
+                raise PdfSplitError(str(e)) from e
+            yield data.getvalue()
+
+    def record(self, name, count=1):
+        with self.lock:
+            self.counts[name] += count
+
+    def get_stats(self):
+        with self.lock:
+            return dict(self.counts, min_pages=self.min_pages, pages_per_range=self.pages_per_range, parallelism=self.parallelism)
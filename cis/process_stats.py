@@ -0,0 +1,40 @@
+import resource
+
+def read_proc_status():
+    status = {}
+    with open('/proc/self/status', 'r') as f:
+        for line in f.read().splitlines():
+            key, _, value = line.partition(':')
+            status[key] = value.strip()
+    return status
+
+def get_rss_bytes():
+    # /proc is only available on Linux, fall back to the peak RSS reported by getrusage elsewhere
+    try:
+        return int(read_proc_status()['VmRSS'].split()[0]) * 1024
+    except (OSError, KeyError):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+def get_memory_breakdown():
+    """
+    Splits the resident memory of this process into pages only it uses and pages shared with other processes
+    (e.g. the parent and sibling workers after a fork, or other processes mapping the same model file).
+    """
+    totals = {'Rss': 0, 'Pss': 0, 'Shared_Clean': 0, 'Shared_Dirty': 0, 'Private_Clean': 0, 'Private_Dirty': 0}
+    try:
+        with open('/proc/self/smaps_rollup', 'r') as f:
+            for line in f.read().splitlines():
+                key, _, value = line.partition(':')
+                if key in totals:
+                    totals[key] = int(value.split()[0]) * 1024
+    except OSError:
+        return {'rss_bytes': get_rss_bytes()}
+    return {
+        'rss_bytes': totals['Rss'],
+        'pss_bytes': totals['Pss'],
+        'unique_bytes': totals['Private_Clean'] + totals['Private_Dirty'],
+        'shared_bytes': totals['Shared_Clean'] + totals['Shared_Dirty']
+    }
+
+def format_memory_breakdown(breakdown):
+    return ', '.join(k.replace('_bytes', '') + ': ' + '{:.1f} MB'.format(v / 2**20) for k, v in breakdown.items())
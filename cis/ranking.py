@@ -0,0 +1,12 @@
+import numpy as np
+
+def top_k(values, k, mask=None):
+    """Indices of the k highest values, in the order a stable descending sort would return them."""
+    candidates = np.arange(len(values)) if mask is None else np.flatnonzero(mask)
+    if len(candidates) > k:
+        scores = values[candidates]
+        kth_score = scores[np.argpartition(-scores, k - 1)[k - 1]]
+        # Keep every candidate tied with the k-th score so ties are broken by index like the sort did
+        candidates = candidates[scores >= kth_score]
+    order = np.lexsort((candidates, -values[candidates]))
+    return candidates[order][:k]
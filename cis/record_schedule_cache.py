@@ -5,6 +5,13 @@ import threading
 import requests
 import traceback
 
+SCHEDULE_FILTERS = {
+  'ten_year': lambda x: x.ten_year
+}
+
+def format_schedule_key(sched):
+  return "{fn}-{sn}-{dn}".format(fn=sched.function_number, sn=sched.schedule_number, dn=sched.disposition_number)
+
 class RecordScheduleCache:
     def __init__(self, config, logger):
       self.logger = logger  
@@ -12,6 +19,7 @@ class RecordScheduleCache:
       _, self.schedules, self.schedule_mapping = get_record_schedules(config, self.logger)
       self.update_ts = datetime.now()
       self.lock = threading.Lock()
+      self.schedule_sets = {}
 
     def get_schedules(self):
       with self.lock:
@@ -22,8 +30,17 @@ class RecordScheduleCache:
             self.logger.info('Record schedule refresh failed and no data is cached. Defaulting to local data.')
           self.schedules = schedules
           self.schedule_mapping = schedule_mapping
+          self.schedule_sets = {}
           self.update_ts = datetime.now()
         return self.schedules
+
+    def get_schedule_set(self, name):
+      # Sets are built once per refresh, so callers can cache anything derived from them by identity
+      self.get_schedules()
+      with self.lock:
+        if name not in self.schedule_sets:
+          self.schedule_sets[name] = frozenset(format_schedule_key(x) for x in self.schedules.schedules if SCHEDULE_FILTERS[name](x))
+        return self.schedule_sets[name]
     
     def get_schedule_mapping(self):
       with self.lock:
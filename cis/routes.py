@@ -5,10 +5,12 @@ from .data_classes import *
 from io import BytesIO
 from .models import User, Favorite, AppSettings, DelegationRequest, DelegationRequestStatus, DelegationRule, db
 import uuid
-from . import key_cache, c, model, mailbox_manager, schedule_cache, keyword_extractor, identifier_extractor, capstone_detector
+from . import key_cache, c, model, tika_client, tika_cache, file_sniffer, local_extractors, ocr_jobs, pdf_splitter, mailbox_manager, schedule_cache, keyword_extractor, identifier_extractor, document_scanner
 import json
 from datetime import datetime
 from dateutil.relativedelta import relativedelta
+from .process_stats import get_memory_breakdown
+import os
 
 @app.before_request
 def log_request_info():
@@ -64,6 +66,10 @@ def file_metadata_prediction():
     else:
         return Response(StatusResponse(status='Failed', reason="No file found.", request_id=g.get('request_id', None)).to_json(), status=400, mimetype='application/json')
 
+@app.route('/file_metadata_prediction/<job_id>', methods=['GET'])
+def file_metadata_prediction_job(job_id):
+    return get_ocr_job_prediction(c, job_id)
+
 @app.route('/text_metadata_prediction', methods=['POST'])
 def text_metadata_prediction():  
     req = request.json
@@ -73,14 +79,16 @@ def text_metadata_prediction():
         return Response(StatusResponse(status='Failed', reason='Request not formatted correctly.', request_id=g.get('request_id', None)).to_json(), status=400, mimetype='application/json')
     predicted_title = mock_prediction_with_explanation
     predicted_description = mock_prediction_with_explanation
-    keyword_weights = keyword_extractor.extract_keywords(req.text)
-    keywords = [x[0] for x in sorted(keyword_weights.items(), key=lambda y: y[1], reverse=True)][:5]
-    subjects=keyword_extractor.extract_subjects(req.text, keyword_weights)
-    has_capstone=capstone_detector.detect_capstone_text(req.text)
+    keyword_scores = document_scanner.scan(req.text)
+    keyword_weights = keyword_scores.keyword_weights()
+    keywords = keyword_scores.top_keywords(5)
+    subjects = keyword_scores.subjects(req.text)
+    has_capstone=keyword_scores.has_capstone
     identifiers=identifier_extractor.extract_identifiers(req.text)
     spatial_extent, temporal_extent = identifier_extractor.extract_spatial_temporal(req.text)
-    predicted_schedules, default_schedule = model.predict(req.text, 'document', req.prediction_metadata, has_capstone, keywords, subjects, attachments=[])
-    prediction = MetadataPrediction(predicted_schedules=predicted_schedules, title=predicted_title, description=predicted_description, default_schedule=default_schedule, subjects=subjects, identifiers=identifiers, spatial_extent=spatial_extent, temporal_extent=temporal_extent)
+    active_model = model.current
+    predicted_schedules, default_schedule = active_model.predict(req.text, 'document', req.prediction_metadata, has_capstone, keywords, subjects, attachments=[], keyword_weights=keyword_weights)
+    prediction = MetadataPrediction(predicted_schedules=predicted_schedules, title=predicted_title, description=predicted_description, default_schedule=default_schedule, subjects=subjects, identifiers=identifiers, spatial_extent=spatial_extent, temporal_extent=temporal_extent, model_version=active_model.version)
     return Response(prediction.to_json(), status=200, mimetype='application/json')
 
 @app.route('/email_metadata_prediction/<emailsource>', methods=['GET'])
@@ -106,22 +114,29 @@ def email_metadata_prediction_graph(emailsource):
     email_text = get_email_text(req.email_id, emailsource, req.mailbox, g.access_token)
     if email_text is None:
         return Response(StatusResponse(status='Failed', reason="Could not retrieve email text.", request_id=g.get('request_id', None)).to_json(), status=500, mimetype='application/json')
-    schedules = schedule_cache.get_schedules().schedules
-    valid_schedules = list(filter(lambda x: x.ten_year, schedules))
-    valid_schedules = ["{fn}-{sn}-{dn}".format(fn=x.function_number, sn=x.schedule_number, dn=x.disposition_number) for x in valid_schedules]
-    keyword_weights = keyword_extractor.extract_keywords(email_text)
-    keywords = [x[0] for x in sorted(keyword_weights.items(), key=lambda y: y[1], reverse=True)][:5]
-    subjects=keyword_extractor.extract_subjects(email_text, keyword_weights)
-    has_capstone=capstone_detector.detect_capstone_text(email_text)
+    valid_schedules = schedule_cache.get_schedule_set('ten_year')
+    keyword_scores = document_scanner.scan(email_text)
+    keyword_weights = keyword_scores.keyword_weights()
+    keywords = keyword_scores.top_keywords(5)
+    subjects = keyword_scores.subjects(email_text)
+    has_capstone=keyword_scores.has_capstone
     identifiers=identifier_extractor.extract_identifiers(email_text)
     spatial_extent, temporal_extent = identifier_extractor.extract_spatial_temporal(email_text)
     
-    # TODO: Handle case where attachments are present
-    predicted_schedules, default_schedule = model.predict(email_text, 'email', PredictionMetadata(req.file_name, req.department), has_capstone, keywords, subjects, attachments=[], valid_schedules=valid_schedules)
+    # The message and its attachments are classified in a single forward pass
+    attachments = get_eml_attachments(eml_file)
+    attachment_documents, encrypted_attachments, failed_attachments = attachment_prediction_documents(attachments, req.department, c)
+    email_document = dict(text=email_text, doc_type='email', prediction_metadata=PredictionMetadata(req.file_name, req.department), has_capstone=has_capstone, keywords=keywords, subjects=subjects, attachments=[], keyword_weights=keyword_weights, valid_schedules=valid_schedules)
+    active_model = model.current
+    results = active_model.predict_batch([email_document] + [x[1] for x in attachment_documents])
+    predicted_schedules, default_schedule = results[0]
+    attachment_predictions = [AttachmentPrediction(name=name, predicted_schedules=attachment_schedules, default_schedule=attachment_default, subjects=document['subjects']) for (name, document), (attachment_schedules, attachment_default) in zip(attachment_documents, results[1:])]
+    attachment_predictions += [AttachmentPrediction(name=name, predicted_schedules=[], default_schedule=None, subjects=[], is_encrypted=True) for name in encrypted_attachments]
+    attachment_predictions += [AttachmentPrediction(name=name, predicted_schedules=[], default_schedule=None, subjects=[], extraction_failed=True) for name in failed_attachments]
     
     predicted_title = mock_prediction_with_explanation
     predicted_description = mock_prediction_with_explanation
-    prediction = MetadataPrediction(predicted_schedules=predicted_schedules, title=predicted_title, description=predicted_description, default_schedule=default_schedule, subjects=subjects, identifiers=identifiers, is_encrypted=is_encrypted, spatial_extent=spatial_extent, temporal_extent=temporal_extent)
+    prediction = MetadataPrediction(predicted_schedules=predicted_schedules, title=predicted_title, description=predicted_description, default_schedule=default_schedule, subjects=subjects, identifiers=identifiers, is_encrypted=is_encrypted, spatial_extent=spatial_extent, temporal_extent=temporal_extent, model_version=active_model.version, attachment_predictions=attachment_predictions)
     return Response(prediction.to_json(), status=200, mimetype='application/json')
 
 @app.route('/upload_file/v3', methods=['POST'])
@@ -512,10 +527,10 @@ def extract():
         req = KeywordExtractionRequest.from_dict(req)
     except:
         return Response(StatusResponse(status='Failed', reason="Request is not formatted correctly.", request_id=g.get('request_id', None)).to_json(), status=400, mimetype='application/json')
-    keyword_weights = keyword_extractor.extract_keywords(req.text)
+    keyword_scores = keyword_extractor.score(req.text)
     response = KeywordExtractionResponse(
-        keywords = list(keyword_weights.keys()),
-        subjects=keyword_extractor.extract_subjects(req.text, keyword_weights),
+        keywords = list(keyword_scores.keyword_weights().keys()),
+        subjects=keyword_scores.subjects(req.text),
         identifiers=identifier_extractor.extract_identifiers(req.text)
     )
     return Response(response.to_json(), status=200, mimetype='application/json')
@@ -756,4 +771,37 @@ def delete_delegation_rule():
         return Response(StatusResponse(status='Failed', reason="User is not authorized to remove this rule.", request_id=g.get('request_id', None)).to_json(), status=401, mimetype='application/json')
     db.session.delete(rule)
     db.session.commit()
-    return Response(StatusResponse(status="OK", reason="Delegation rule removed.", request_id=g.get('request_id', None)).to_json(), status=200, mimetype="application/json")
\ No newline at end of file
+    return Response(StatusResponse(status="OK", reason="Delegation rule removed.", request_id=g.get('request_id', None)).to_json(), status=200, mimetype="application/json")
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    stats = {'model': model.get_stats(), 'process': dict(pid=os.getpid(), **get_memory_breakdown())}
+    if tika_client is not None:
+        stats['tika'] = tika_client.get_stats()
+    stats['tika_preflight'] = file_sniffer.get_stats()
+    if local_extractors is not None:
+        stats['local_extraction'] = local_extractors.get_stats()
+    if tika_cache is not None:
+        stats['tika_cache'] = tika_cache.get_stats()
+    if ocr_jobs is not None:
+        stats['ocr_jobs'] = ocr_jobs.get_stats()
+    if pdf_splitter is not None:
+        stats['pdf_ranges'] = pdf_splitter.get_stats()
+    return Response(json.dumps(stats), status=200, mimetype='application/json')
+
+@app.route('/admin/swap_model', methods=['POST'])
+def swap_model():
+    if g.token_data['email'].lower() not in c.admin_users:
+        return Response(StatusResponse(status='Failed', reason="User is not authorized to swap models.", request_id=g.get('request_id', None)).to_json(), status=403, mimetype='application/json')
+    req = request.json
+    try:
+        req = ModelSwapRequest.from_dict(req)
+    except:
+        return Response(StatusResponse(status='Failed', reason="Request is not formatted correctly.", request_id=g.get('request_id', None)).to_json(), status=400, mimetype='application/json')
+    if not model.swappable():
+        return Response(StatusResponse(status='Failed', reason="Model swaps are disabled when running several workers, restart the service to change the model.", request_id=g.get('request_id', None)).to_json(), status=409, mimetype='application/json')
+    if not all(model.in_model_root(x) for x in [req.model_path, req.label_mapping_path, req.office_info_mapping_path]):
+        return Response(StatusResponse(status='Failed', reason="Model files must be under the model root.", request_id=g.get('request_id', None)).to_json(), status=400, mimetype='application/json')
+    if not model.start_swap(req.model_path, req.label_mapping_path, req.office_info_mapping_path, req.version):
+        return Response(StatusResponse(status='Failed', reason="A model swap is already in progress.", request_id=g.get('request_id', None)).to_json(), status=409, mimetype='application/json')
+    return Response(StatusResponse(status='OK', reason="Model swap started. Progress is reported in /metrics.", request_id=g.get('request_id', None)).to_json(), status=202, mimetype='application/json')
@@ -0,0 +1,140 @@
+from .data_classes import TikaResult
+from collections import OrderedDict
+import hashlib
+import threading
+import json
+import time
+import os
+
+CHUNK_SIZE = 64 * 1024
+# Other workers write to the same directory, so its real size is read again at least this often
+RESCAN_SECONDS = 60
+
+def file_digest(body):
+    """SHA-256 and size of a request body given as bytes or a seekable file object."""
+    digest = hashlib.sha256()
+    if isinstance(body, (bytes, bytearray)):
+        digest.update(body)
+        return digest.hexdigest(), len(body)
+    size = 0
+    body.seek(0)
+    for chunk in iter(lambda: body.read(CHUNK_SIZE), b''):
+        digest.update(chunk)
+        size += len(chunk)
+    body.seek(0)
+    return digest.hexdigest(), size
+
+class TikaResultCache():
+    """
+    Size bounded on-disk LRU cache of Tika results keyed by the SHA-256 of the file bytes and the extraction settings,
+    so that results extracted with other settings are never served. Entries expire after ttl_seconds. Recency is kept
+    in the file modification times so that the cache survives restarts and can be shared by worker processes, each of
+    which reads the directory again before evicting.
+    """
+    def __init__(self, cache_dir, max_bytes, ttl_seconds, settings=None, logger=None):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.settings_digest = hashlib.sha256(json.dumps(settings or {}, sort_keys=True).encode()).hexdigest()[:16]
+        self.logger = logger
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.bytes_saved = 0
+        self.evictions = 0
+        self.expirations = 0
+        os.makedirs(cache_dir, exist_ok=True)
+        self.scan()
+
+    def key(self, file_sha):
+        return file_sha + '-' + self.settings_digest
+
+    def scan(self):
+        """Rebuild the LRU order from disk, least recently used first, and drop entries not used within the TTL."""
+        entries = []
+        now = time.time()
+        for name in os.listdir(self.cache_dir):
+            if name.endswith('.json'):
+                try:
+                    stat = os.stat(os.path.join(self.cache_dir, name))
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, name[:-len('.json')], stat.st_size))
+        self.entries = OrderedDict((key, size) for _, key, size in sorted(entries))
+        self.size_bytes = sum(self.entries.values())
+        self.scanned_at = time.monotonic()
+        # Entries are created no later than they were last used, so these are expired
+        for mtime, key, _ in entries:
+            if now - mtime > self.ttl_seconds:
+                self.remove(key)
+                self.expirations += 1
+
+    def path(self, key):
+        return os.path.join(self.cache_dir, key + '.json')
+
+    def remove(self, key):
+        self.size_bytes -= self.entries.pop(key, 0)
+        try:
+            os.remove(self.path(key))
+        except FileNotFoundError:
+            pass
+
+    def get(self, key, file_size=0):
+        with self.lock:
+            try:
+                with open(self.path(key), 'r') as f:
+                    entry = json.loads(f.read())
+            except (FileNotFoundError, ValueError):
+                self.misses += 1
+                return None
+            if time.time() - entry['created'] > self.ttl_seconds:
+                self.remove(key)
+                self.misses += 1
+                return None
+            try:
+                # Marks the entry as recently used for eviction, another worker may have evicted it since it was read
+                os.utime(self.path(key))
+            except OSError:
+                pass
+            if key in self.entries:
+                self.entries.move_to_end(key)
+            self.hits += 1
+            self.bytes_saved += file_size
+            return TikaResult.from_dict(entry['result'])
+
+    def put(self, key, tika_result):
+        data = json.dumps({'created': time.time(), 'result': tika_result.to_dict()})
+        with self.lock:
+            # Write to a temporary file first so that other workers never read a partial entry
+            tmp_path = self.path(key) + '.' + str(os.getpid()) + '.tmp'
+            try:
+                with open(tmp_path, 'w') as f:
+                    f.write(data)
+                os.replace(tmp_path, self.path(key))
+            except OSError:
+                # A full or read only cache directory should not fail the request
+                if self.logger is not None:
+                    self.logger.exception('Failed to write Tika cache entry ' + key)
+                return
+            self.size_bytes += len(data) - self.entries.pop(key, 0)
+            self.entries[key] = len(data)
+            if self.size_bytes > self.max_bytes or time.monotonic() - self.scanned_at > RESCAN_SECONDS:
+                self.scan()
+            while self.size_bytes > self.max_bytes and len(self.entries) > 1:
+                self.remove(next(iter(self.entries)))
+                self.evictions += 1
+
+    def get_stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups > 0 else None,
+                'bytes_saved': self.bytes_saved,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+                'entries': len(self.entries),
+                'size_bytes': self.size_bytes,
+                'max_bytes': self.max_bytes
+            }
@@ -0,0 +1,314 @@
+import requests
+from requests.adapters import HTTPAdapter
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from contextlib import contextmanager
+import tempfile
+import threading
+import time
+
+SPOOL_MAX_SIZE = 1024 * 1024
+CHUNK_SIZE = 64 * 1024
+TIKA_TEXT_UPPER_LIMIT = 10000
+# Hedged requests send the body twice at the same time, so larger files are not hedged instead of being read into memory
+HEDGE_MAX_BYTES = 4 * 1024 * 1024
+# Responses which say more about the node than about the document
+NODE_FAILURE_STATUSES = (502, 503, 504)
+# Metadata never needs OCR, and without these headers the server default could OCR a scanned PDF a second time
+METADATA_HEADERS = {'X-Tika-PDFOcrStrategy': 'no_ocr', 'X-Tika-PDFextractInlineImages': 'false', 'Cache-Control': 'no-cache', 'accept': 'application/json'}
+
+def spool_download(response):
+    """Copy a streamed download into a temporary file which moves to disk once it is larger than SPOOL_MAX_SIZE."""
+    spool = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE)
+    for chunk in response.iter_content(CHUNK_SIZE):
+        spool.write(chunk)
+    spool.seek(0)
+    return spool
+
+def read_small_body(body):
+    body.seek(0, 2)
+    size = body.tell()
+    body.seek(0)
+    if size > HEDGE_MAX_BYTES:
+        return None
+    data = body.read()
+    body.seek(0)
+    return data
+
+class TikaOverloadedError(Exception):
+    pass
+
+def close_response(future):
+    if not future.cancelled() and future.exception() is None:
+        future.result().close()
+
+class TikaNode():
+    def __init__(self, server):
+        self.server = server
+        self.outstanding = 0
+        self.requests = 0
+        self.errors = 0
+        self.consecutive_failures = 0
+        self.ejected = False
+        self.ejected_at = 0
+        self.ejections = 0
+
+    def available(self, now, eject_seconds):
+        # Ejected nodes get traffic again after eject_seconds, a success then re-admits them
+        return not self.ejected or now - self.ejected_at >= eject_seconds
+
+    def get_stats(self):
+        return {'server': self.server, 'ejected': self.ejected, 'outstanding': self.outstanding, 'requests': self.requests, 'errors': self.errors, 'ejections': self.ejections}
+
+class TikaClient():
+    """
+    Sends documents to Tika over a pool of keep-alive connections.
+    Request bodies can be bytes or seekable file objects, which requests streams in chunks instead of reading them into memory.
+    At most max_concurrency extractions run at once. Up to max_queue_depth more wait for queue_timeout seconds,
+    anything beyond that is rejected right away so that slow extractions cannot tie up every server thread.
+    server can be a comma separated list of Tika nodes. Each request goes to the node with the fewest outstanding requests,
+    nodes are ejected after eject_after consecutive connection failures or failed health probes, and calls which take longer
+    than hedge_after seconds are sent to a second node as well, using whichever answers first.
+    """
+    def __init__(self, server, pool_size=10, connect_timeout=5, read_timeout=30, ocr_read_timeout=300, text_limit=None, max_concurrency=4, max_queue_depth=8, queue_timeout=10, hedge_after=None, probe_interval=10, eject_after=3, eject_seconds=30):
+        self.nodes = [TikaNode(x.strip()) for x in server.split(',') if x.strip() != '']
+        # When set, only this many characters of plain text are read from Tika instead of the full /rmeta/text output
+        self.text_limit = text_limit
+        self.pool_size = pool_size
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.ocr_read_timeout = ocr_read_timeout
+        self.session = self.create_session()
+        self.max_concurrency = max_concurrency
+        self.max_queue_depth = max_queue_depth
+        self.queue_timeout = queue_timeout
+        self.condition = threading.Condition()
+        self.active = 0
+        self.waiting = 0
+        self.admitted = 0
+        self.rejected = 0
+        self.timed_out = 0
+        self.total_wait = 0
+        self.max_wait = 0
+        self.node_lock = threading.Lock()
+        self.hedge_after = hedge_after
+        self.probe_interval = probe_interval
+        self.eject_after = eject_after
+        self.eject_seconds = eject_seconds
+        self.hedges = 0
+        self.hedge_wins = 0
+        self.failovers = 0
+        self.stopped = threading.Event()
+        self.executor = ThreadPoolExecutor(max_workers=2 * pool_size, thread_name_prefix='tika-hedge')
+
+    def create_session(self):
+        session = requests.Session()
+        # Block instead of opening throwaway connections when every pooled connection is busy
+        adapter = HTTPAdapter(pool_connections=len(self.nodes), pool_maxsize=self.pool_size, pool_block=True)
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        return session
+
+    def reset(self):
+        # Forked workers must not share the parent's sockets, and threads do not survive the fork
+        self.session = self.create_session()
+        self.executor = ThreadPoolExecutor(max_workers=2 * self.pool_size, thread_name_prefix='tika-hedge')
+        if len(self.nodes) > 1 and self.probe_interval > 0:
+            self.stopped = threading.Event()
+            threading.Thread(target=self.probe, daemon=True).start()
+
+    def close(self):
+        self.stopped.set()
+        self.executor.shutdown(wait=False)
+
+    def probe(self):
+        while not self.stopped.wait(self.probe_interval):
+            for node in self.nodes:
+                try:
+                    # Probes use their own connections so that a busy pool cannot hold them up
+                    healthy = requests.get('http://' + node.server + '/tika', timeout=self.connect_timeout).status_code == 200
+                except requests.RequestException:
+                    healthy = False
+                with self.node_lock:
+                    if healthy:
+                        node.consecutive_failures = 0
+                        node.ejected = False
+                    else:
+                        self.eject(node)
+
+    def eject(self, node):
+        if not node.ejected:
+            node.ejections += 1
+        node.ejected = True
+        node.ejected_at = time.monotonic()
+
+    def choose_node(self, exclude=()):
+        with self.node_lock:
+            now = time.monotonic()
+            candidates = [n for n in self.nodes if n not in exclude and n.available(now, self.eject_seconds)]
+            # With every node ejected, trying one beats failing the request
+            if len(candidates) == 0:
+                candidates = [n for n in self.nodes if n not in exclude]
+            if len(candidates) == 0:
+                return None
+            node = min(candidates, key=lambda n: (n.outstanding, n.requests))
+            node.outstanding += 1
+            node.requests += 1
+            return node
+
+    def release(self, node, failed):
+        with self.node_lock:
+            node.outstanding -= 1
+            if not failed:
+                node.consecutive_failures = 0
+                node.ejected = False
+                return
+            node.errors += 1
+            node.consecutive_failures += 1
+            if node.consecutive_failures >= self.eject_after:
+                self.eject(node)
+
+    def send(self, node, path, body, headers, timeout, stream):
+        failed = False
+        try:
+            r = self.session.put('http://' + node.server + path, data=body, headers=headers, timeout=timeout, stream=stream)
+            failed = r.status_code in NODE_FAILURE_STATUSES
+            return r
+        except requests.ConnectionError:
+            failed = True
+            raise
+        finally:
+            self.release(node, failed)
+
+    @contextmanager
+    def slot(self):
+        start = time.monotonic()
+        with self.condition:
+            if self.active >= self.max_concurrency and self.waiting >= self.max_queue_depth:
+                self.rejected += 1
+                raise TikaOverloadedError('Tika queue is full.')
+            self.waiting += 1
+            try:
+                deadline = start + self.queue_timeout
+                while self.active >= self.max_concurrency:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self.timed_out += 1
+                        raise TikaOverloadedError('Timed out waiting for Tika.')
+                    self.condition.wait(remaining)
+            finally:
+                self.waiting -= 1
+            self.active += 1
+            wait = time.monotonic() - start
+            self.admitted += 1
+            self.total_wait += wait
+            self.max_wait = max(self.max_wait, wait)
+        try:
+            yield
+        finally:
+            with self.condition:
+                self.active -= 1
+                self.condition.notify()
+
+    def get_stats(self):
+        with self.condition:
+            stats = {
+                'active': self.active,
+                'queue_depth': self.waiting,
+                'max_concurrency': self.max_concurrency,
+                'max_queue_depth': self.max_queue_depth,
+                'admitted': self.admitted,
+                'rejected': self.rejected,
+                'timed_out': self.timed_out,
+                'mean_wait_ms': self.total_wait / self.admitted * 1000 if self.admitted > 0 else None,
+                'max_wait_ms': self.max_wait * 1000
+            }
+        with self.node_lock:
+            stats.update(hedges=self.hedges, hedge_wins=self.hedge_wins, failovers=self.failovers, nodes=[node.get_stats() for node in self.nodes])
+        return stats
+
+    def put(self, path, body, headers, ocr=False, stream=False):
+        # File bodies are rewound so that the same upload can be sent again, e.g. for the OCR retry
+        if hasattr(body, 'seek'):
+            body.seek(0)
+        timeout = (self.connect_timeout, self.ocr_read_timeout if ocr else self.read_timeout)
+        # OCR is slow on every node, so hedging it would only double the work
+        if self.hedge_after is not None and not ocr and len(self.nodes) > 1:
+            hedge_body = body if isinstance(body, (bytes, bytearray)) else read_small_body(body)
+            if hedge_body is not None:
+                return self.put_hedged(path, hedge_body, headers, timeout, stream)
+        tried = []
+        while True:
+            node = self.choose_node(tried)
+            tried.append(node)
+            try:
+                return self.send(node, path, body, headers, timeout, stream)
+            except requests.ConnectionError:
+                # Only failures to reach a node are retried elsewhere, a read timeout is more likely caused by the document
+                if len(tried) >= len(self.nodes):
+                    raise
+                with self.node_lock:
+                    self.failovers += 1
+                if hasattr(body, 'seek'):
+                    body.seek(0)
+
+    def put_hedged(self, path, body, headers, timeout, stream):
+        tried = [self.choose_node()]
+        pending = {self.executor.submit(self.send, tried[0], path, body, headers, timeout, stream)}
+        hedge = None
+        error = None
+        while len(pending) > 0:
+            done, pending = wait(pending, timeout=self.hedge_after if len(tried) < 2 else None, return_when=FIRST_COMPLETED)
+            for future in done:
+                try:
+                    r = future.result()
+                except Exception as e:
+                    error = e
+                    continue
+                # Whichever call loses is closed when it finishes so that its connection goes back to the pool
+                for other in pending | (done - {future}):
+                    other.add_done_callback(close_response)
+                if future is hedge:
+                    with self.node_lock:
+                        self.hedge_wins += 1
+                return r
+            # Nothing usable yet, so the first call is either slow or failed
+            node = self.choose_node(tried) if len(tried) < len(self.nodes) else None
+            if node is None:
+                continue
+            tried.append(node)
+            future = self.executor.submit(self.send, node, path, body, headers, timeout, stream)
+            with self.node_lock:
+                if len(done) == 0:
+                    self.hedges += 1
+                    hedge = future
+                else:
+                    self.failovers += 1
+            pending.add(future)
+        raise error
+
+    def put_text(self, body, headers, ocr=False):
+        """
+        Stream the plain text of a document and stop reading once text_limit characters have arrived.
+        Like the first /rmeta/text entry, only the text of the container is read and not that of embedded documents.
+        """
+        r = self.put('/tika', body, dict(headers, accept='text/plain', **{'X-Tika-Skip-Embedded': 'true'}), ocr=ocr, stream=True)
+        with r:
+            if r.status_code != 200:
+                return r.status_code, None
+            # requests assumes ISO-8859-1 for text without a charset, Tika writes UTF-8
+            if 'charset' not in r.headers.get('Content-Type', ''):
+                r.encoding = 'utf-8'
+            parts = []
+            length = 0
+            for part in r.iter_content(CHUNK_SIZE, decode_unicode=True):
+                parts.append(part)
+                length += len(part)
+                if length >= self.text_limit:
+                    break
+        return 200, ''.join(parts)[:self.text_limit]
+
+    def put_metadata(self, body):
+        r = self.put('/meta', body, METADATA_HEADERS)
+        if r.status_code != 200:
+            return r.status_code, None
+        return 200, r.json()
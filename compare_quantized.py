@@ -0,0 +1,111 @@
+"""Compares the fp32 and int8 quantized record schedule classifiers on a held-out corpus."""
+from cis.hf_model import HuggingFaceModel
+from cis.inference_backends import save_quantized
+from cis.process_stats import get_rss_bytes
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+import resource
+import numpy as np
+import argparse
+import json
+import time
+import os
+
+def load_corpus(corpus_path):
+    # A directory of .txt files or a single file with one document per line
+    if os.path.isdir(corpus_path):
+        texts = []
+        for name in sorted(os.listdir(corpus_path)):
+            if name.endswith('.txt'):
+                with open(os.path.join(corpus_path, name), 'r', errors='ignore') as f:
+                    texts.append(f.read())
+        return texts
+    with open(corpus_path, 'r', errors='ignore') as f:
+        return [line for line in f.read().splitlines() if line.strip() != '']
+
+def run_model(model, texts):
+    predictions = []
+    latencies = []
+    num_labels = len(model.label_mapping)
+    for text in texts:
+        start = time.perf_counter()
+        preds, _ = model.predict(text, 'document', None, False, [], [], [], k=num_labels)
+        latencies.append(time.perf_counter() - start)
+        predictions.append(preds)
+    return predictions, latencies
+
+def measure_backend(model_path, label_mapping_path, office_info_mapping_path, backend, texts):
+    """Runs in a fresh process, so that the memory numbers only cover this backend's model."""
+    rss_before = get_rss_bytes()
+    model = HuggingFaceModel(model_path, label_mapping_path, office_info_mapping_path, model_backend=backend)
+    memory = get_rss_bytes() - rss_before
+    predictions, latencies = run_model(model, texts)
+    peak_memory = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    return predictions, latencies, memory, peak_memory
+
+def run_backend(args, backend, texts):
+    # RSS never shrinks after a model is freed, so each backend gets its own process
+    with ProcessPoolExecutor(1, mp_context=multiprocessing.get_context('spawn')) as executor:
+        return executor.submit(measure_backend, args.model_path, args.label_mapping_path, args.office_info_mapping_path, backend, texts).result()
+
+def summarize_latency(latencies):
+    latencies = np.array(latencies) * 1000
+    return {'mean_ms': float(np.mean(latencies)), 'p50_ms': float(np.percentile(latencies, 50)), 'p99_ms': float(np.percentile(latencies, 99))}
+
+def compare(fp32_preds, int8_preds, threshold):
+    top1_agree = 0
+    top3_agree = 0
+    threshold_flips = 0
+    drift = []
+    for fp32, int8 in zip(fp32_preds, int8_preds):
+        if fp32[0].schedule == int8[0].schedule:
+            top1_agree += 1
+        if set(sched_key(x) for x in fp32[:3]) == set(sched_key(x) for x in int8[:3]):
+            top3_agree += 1
+        if (fp32[0].probability > threshold) != (int8[0].probability > threshold):
+            threshold_flips += 1
+        # Drift is measured on the probability the int8 model gives to the fp32 top prediction
+        int8_probs = {sched_key(x): x.probability for x in int8}
+        drift.append(abs(fp32[0].probability - int8_probs[sched_key(fp32[0])]))
+    count = len(fp32_preds)
+    return {
+        'documents': count,
+        'top1_agreement': top1_agree / count,
+        'top3_agreement': top3_agree / count,
+        'default_threshold': threshold,
+        'default_decision_flips': threshold_flips,
+        'mean_top1_probability_drift': float(np.mean(drift)),
+        'max_top1_probability_drift': float(np.max(drift))
+    }
+
+def sched_key(rec):
+    return '-'.join([rec.schedule.function_number, rec.schedule.schedule_number, rec.schedule.disposition_number])
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Compare accuracy, latency and memory of the fp32 and int8 quantized classifiers.')
+    parser.add_argument('--model_path', default='/home/models/trained_model',
+                    help='Path to HuggingFace classifier model.')
+    parser.add_argument('--label_mapping_path', default='/home/models/label_mapping.json',
+                    help='Path to mapping between prediction indices and corresponding record schedules.')
+    parser.add_argument('--office_info_mapping_path', default='/home/models/office_info_mapping.json',
+                    help='Path to mapping between office acronym and office description.')
+    parser.add_argument('--corpus_path', required=True,
+                    help='Held-out corpus. Either a directory of .txt files or a file with one document per line.')
+    parser.add_argument('--default_categorization_threshold', default=0.95, type=float,
+                    help='Probability above which a prediction is used as the default schedule.')
+    parser.add_argument('--save_quantized', default=False, action="store_true",
+                    help='Save the quantized weights next to the model so that they can be loaded directly at startup.')
+    args = parser.parse_args()
+    texts = load_corpus(args.corpus_path)
+    if args.save_quantized:
+        print('Saved quantized model to ' + save_quantized(args.model_path))
+    fp32_preds, fp32_latencies, fp32_memory, fp32_peak_memory = run_backend(args, 'pytorch', texts)
+    int8_preds, int8_latencies, int8_memory, int8_peak_memory = run_backend(args, 'pytorch_int8', texts)
+    report = compare(fp32_preds, int8_preds, args.default_categorization_threshold)
+    report['fp32_latency'] = summarize_latency(fp32_latencies)
+    report['int8_latency'] = summarize_latency(int8_latencies)
+    report['fp32_memory_mb'] = fp32_memory / 2**20
+    report['int8_memory_mb'] = int8_memory / 2**20
+    report['fp32_peak_memory_mb'] = fp32_peak_memory / 2**20
+    report['int8_peak_memory_mb'] = int8_peak_memory / 2**20
+    print(json.dumps(report, indent=2))
@@ -12,3 +12,10 @@ def hf_model(pytestconfig):
     label_mapping_path = pytestconfig.getoption("--label_mapping_path")
     office_info_mapping_path = pytestconfig.getoption("--office_info_mapping_path")
     return HuggingFaceModel(model_path, label_mapping_path, office_info_mapping_path)
+
+@pytest.fixture(scope='session')
+def onnx_model(pytestconfig):
+    model_path = pytestconfig.getoption("--model_path")
+    label_mapping_path = pytestconfig.getoption("--label_mapping_path")
+    office_info_mapping_path = pytestconfig.getoption("--office_info_mapping_path")
+    return HuggingFaceModel(model_path, label_mapping_path, office_info_mapping_path, model_backend='onnx')
@@ -0,0 +1,51 @@
+from context import cis
+from cis.hf_model import ClassIndex, HuggingFaceModel, TokenizerPool
+import queue
+
+SCHEDULES = ['301-1016-c', '306-1023-c', '108-1044-d', '401-1006-b']
+
+class WordTokenizer():
+    """One token per word, each id being the word's length. Counts the characters it is given."""
+    cls_token_id = 1
+    sep_token_id = 2
+    pad_token_id = 0
+
+    def __init__(self):
+        self.characters = 0
+
+    def __call__(self, text, truncation=False, add_special_tokens=True):
+        self.characters += len(text)
+        input_ids = [len(x) for x in text.split()]
+        if add_special_tokens:
+            input_ids = [self.cls_token_id] + input_ids[:510 if truncation else None] + [self.sep_token_id]
+        return {'input_ids': input_ids}
+
+def stub_hf_model(labels=SCHEDULES, tokenizer=None, **attributes):
+    """
+    A HuggingFaceModel which loads nothing from disk. Every attribute __init__ sets has a default, attributes replaces
+    any of them or adds others, e.g. forward, document_windows or cascade.
+    """
+    model = HuggingFaceModel.__new__(HuggingFaceModel)
+    tokenizer_pool = TokenizerPool.__new__(TokenizerPool)
+    tokenizer_pool.size = 1
+    tokenizer_pool.tokenizers = queue.Queue()
+    tokenizer_pool.tokenizers.put(tokenizer or WordTokenizer())
+    label_mapping = {label: i for i, label in enumerate(labels)}
+    model.version = 'stub'
+    model.logger = None
+    model.tokenizer_pool = tokenizer_pool
+    model.pad_token_id = 0
+    model.max_length = 512
+    model.max_windows = 1
+    model.backend_name = 'stub'
+    model.backend = None
+    model.label_mapping = label_mapping
+    model.reverse_mapping = {v: k for k, v in label_mapping.items()}
+    model.office_info_mapping = {}
+    model.class_index = ClassIndex(model.reverse_mapping)
+    model.classes = model.class_index.classes
+    model.cascade = None
+    model.batcher = None
+    for name, value in attributes.items():
+        setattr(model, name, value)
+    return model
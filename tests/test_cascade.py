@@ -0,0 +1,50 @@
+from context import cis
+from cis.cascade import CascadeClassifier
+from stubs import stub_hf_model
+import numpy as np
+
+LABEL_MAPPING = {'301-1016-c': 0, '306-1023-c': 1, '108-1044-d': 2}
+
+def cascade_model(tmp_path, audit_rate=0.0):
+    """A model whose transformer always picks the second label and whose cascade is confident about 'permits'."""
+    # Saved in a different label order than the transformer's to check the columns are reordered
+    labels = ['108-1044-d', '301-1016-c', '306-1023-c']
+    weights = np.array([[0.0, 10.0, 0.0], [0.0, 0.0, 0.3]])
+    np.savez(tmp_path / 'cascade.npz', features=np.array(['permits', 'subject:Water']), labels=np.array(labels), weights=weights, bias=np.zeros(3))
+    def forward(batch_input_ids):
+        model.forward_calls += 1
+        return [np.array([0.0, 5.0, 0.0]) for _ in batch_input_ids]
+    cascade = CascadeClassifier(str(tmp_path / 'cascade.npz'), LABEL_MAPPING, threshold=0.9, audit_rate=audit_rate)
+    model = stub_hf_model(list(LABEL_MAPPING), cascade=cascade, forward=forward, forward_calls=0, document_windows=lambda document: [[101, 102]])
+    return model
+
+def document(keyword_weights, subjects=[]):
+    return dict(text='text', doc_type='document', prediction_metadata=None, has_capstone=False, keywords=list(keyword_weights), subjects=subjects, attachments=[], keyword_weights=keyword_weights)
+
+def test_confident_cascade_skips_transformer(tmp_path):
+    model = cascade_model(tmp_path)
+    predictions, default_schedule = model.predict_batch([document({'permits': 20.0})])[0]
+    assert model.forward_calls == 0
+    assert predictions[0].schedule == model.classes[0]
+    assert default_schedule == model.classes[0]
+    assert model.cascade.get_stats()['short_circuited'] == 1
+
+def test_unsure_cascade_falls_back_to_transformer(tmp_path):
+    model = cascade_model(tmp_path)
+    predictions, default_schedule = model.predict_batch([document({'water': 5.0}, ['Water'])])[0]
+    assert model.forward_calls == 1
+    assert predictions[0].schedule == model.classes[1]
+    stats = model.cascade.get_stats()
+    assert stats['fallbacks'] == 1 and stats['fallback_agreement_rate'] == 1.0 and stats['short_circuited'] == 0
+    # Empty keyword weights still go through the cascade, documents without keyword weights skip it
+    model.predict_batch([document({})])
+    model.predict_batch([dict(document({}), keyword_weights=None)])
+    assert model.forward_calls == 3 and model.cascade.get_stats()['requests'] == 2
+
+def test_audited_cascade_answers_come_from_transformer(tmp_path):
+    model = cascade_model(tmp_path, audit_rate=1.0)
+    predictions, _ = model.predict_batch([document({'permits': 20.0})])[0]
+    assert model.forward_calls == 1
+    assert predictions[0].schedule == model.classes[1]
+    stats = model.cascade.get_stats()
+    assert stats['audited'] == 1 and stats['audit_agreement_rate'] == 0.0
@@ -0,0 +1,90 @@
+from context import cis
+from cis.extractor_artifacts import ExtractorArtifacts, load_extractor
+from cis.keyword_extractor import KeywordExtractor, CapstoneDetector
+import shutil
+import json
+import os
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+DOCUMENT = 'The calendars and epa forms were sent to Jane Doe, with the reminders.'
+
+class ListLogger():
+    def __init__(self):
+        self.messages = []
+
+    def info(self, message):
+        self.messages.append(message)
+
+    def exception(self, message):
+        self.messages.append(message)
+
+def inputs(tmp_path):
+    paths = []
+    for name in ['keyword_category.csv', 'rscategories.txt', 'keyword_idf.json']:
+        shutil.copy(os.path.join(ROOT, name), tmp_path / name)
+        paths.append(str(tmp_path / name))
+    (tmp_path / 'capstone.csv').write_text('Jane Doe\n"John Smith"\n')
+    return paths, [str(tmp_path / 'capstone.csv')]
+
+def load(artifacts, keyword_paths, capstone_paths):
+    artifacts.logger.messages.clear()
+    return load_extractor(KeywordExtractor, keyword_paths, artifacts), load_extractor(CapstoneDetector, capstone_paths, artifacts)
+
+def loaded(artifacts):
+    return [x.split()[0] for x in artifacts.logger.messages if 'loaded from artifact' in x]
+
+def artifact_files(artifacts):
+    return sorted(x for x in os.listdir(artifacts.cache_dir) if x.endswith('.pkl'))
+
+def test_artifacts_match_fresh_builds(tmp_path):
+    keyword_paths, capstone_paths = inputs(tmp_path)
+    artifacts = ExtractorArtifacts(str(tmp_path / 'artifacts'), ListLogger())
+    load(artifacts, keyword_paths, capstone_paths)
+    assert loaded(artifacts) == []
+    keyword_extractor, capstone_detector = load(artifacts, keyword_paths, capstone_paths)
+    assert loaded(artifacts) == ['KeywordExtractor', 'CapstoneDetector']
+    assert keyword_extractor.extract_keywords(DOCUMENT) == KeywordExtractor(*keyword_paths).extract_keywords(DOCUMENT) != {}
+    assert capstone_detector.detect_capstone_text(DOCUMENT) and not capstone_detector.detect_capstone_text('Jane Smith')
+
+def test_input_changes_rebuild(tmp_path):
+    keyword_paths, capstone_paths = inputs(tmp_path)
+    artifacts = ExtractorArtifacts(str(tmp_path / 'artifacts'), ListLogger())
+    load(artifacts, keyword_paths, capstone_paths)
+    with open(keyword_paths[0], 'a', encoding='cp1252') as f:
+        f.write('zebra mussels,Environmental Information\n')
+    keyword_extractor, _ = load(artifacts, keyword_paths, capstone_paths)
+    assert loaded(artifacts) == ['CapstoneDetector']
+    assert 'zebra mussels' in keyword_extractor.extract_keywords('Counts of zebra mussels by site.')
+    with open(keyword_paths[2]) as f:
+        keyword_idf = json.load(f)
+    keyword_idf['zebra mussels'] = 42.0
+    with open(keyword_paths[2], 'w') as f:
+        json.dump(keyword_idf, f)
+    keyword_extractor, _ = load(artifacts, keyword_paths, capstone_paths)
+    assert loaded(artifacts) == ['CapstoneDetector']
+    assert keyword_extractor.extract_keywords('Counts of zebra mussels by site.')['zebra mussels'] == 42.0
+    (tmp_path / 'capstone.csv').write_text('Jane Smith\n')
+    _, capstone_detector = load(artifacts, keyword_paths, capstone_paths)
+    assert loaded(artifacts) == ['KeywordExtractor']
+    assert capstone_detector.detect_capstone_text('Sent to Jane Smith.') and not capstone_detector.detect_capstone_text(DOCUMENT)
+    # Only the artifacts for the current inputs are kept
+    files = artifact_files(artifacts)
+    assert len(files) == 2 and [x.split('-')[0] for x in files] == ['CapstoneDetector', 'KeywordExtractor']
+
+def test_corrupt_artifacts_are_rebuilt(tmp_path):
+    keyword_paths, capstone_paths = inputs(tmp_path)
+    artifacts = ExtractorArtifacts(str(tmp_path / 'artifacts'), ListLogger())
+    load(artifacts, keyword_paths, capstone_paths)
+    for i, name in enumerate(artifact_files(artifacts)):
+        path = os.path.join(artifacts.cache_dir, name)
+        with open(path, 'rb') as f:
+            data = f.read()
+        with open(path, 'wb') as f:
+            # One truncated, one overwritten with garbage
+            f.write(data[:len(data) // 2] if i == 0 else b'not a pickle')
+    keyword_extractor, capstone_detector = load(artifacts, keyword_paths, capstone_paths)
+    assert loaded(artifacts) == [] and sum('Failed to load' in x for x in artifacts.logger.messages) == 2
+    assert keyword_extractor.extract_keywords(DOCUMENT) != {} and capstone_detector.detect_capstone_text(DOCUMENT)
+    # The rebuilt artifacts load again
+    load(artifacts, keyword_paths, capstone_paths)
+    assert loaded(artifacts) == ['KeywordExtractor', 'CapstoneDetector']
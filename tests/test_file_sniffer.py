@@ -0,0 +1,53 @@
+from context import cis
+from cis.file_sniffer import FileSniffer, AUTO, NO_OCR, OCR, SKIP
+from pypdf import PdfWriter
+import importlib
+import io
+
+# cis.file_sniffer is also the name of the app's FileSniffer instance
+file_sniffer = importlib.import_module('cis.file_sniffer')
+
+def pdf(*objects):
+    return b'%PDF-1.7\n' + b'\n'.join(objects) + b'\n%%EOF'
+
+def encrypted_pdf(user_password):
+    writer = PdfWriter()
+    writer.add_blank_page(100, 100)
+    writer.encrypt(user_password=user_password, owner_password='owner', algorithm='RC4-128')
+    data = io.BytesIO()
+    writer.write(data)
+    return data.getvalue()
+
+def test_strategies():
+    sniffer = FileSniffer()
+    assert sniffer.sniff(pdf(b'/Type /Page /Resources << /Font << >> >>')).strategy == NO_OCR
+    assert sniffer.sniff(pdf(b'/Type /Page', b'/Subtype /Image')).strategy == OCR
+    # Fonts may be inside compressed object streams, so an image only scan is not trusted with them
+    assert sniffer.sniff(pdf(b'/Type /Page', b'/Subtype /Image', b'/Type /ObjStm')).strategy == AUTO
+    assert sniffer.sniff(pdf(b'/Type /Page', b'/Font', b'/Subtype /Image')).strategy == AUTO
+    assert sniffer.sniff(b'PK\x03\x04 docx').kind == 'zip'
+    assert sniffer.sniff(io.BytesIO(b'junk%PDF-1.4 /Type /Page /Font')).strategy == NO_OCR
+
+def test_encrypted_pdfs():
+    sniffer = FileSniffer()
+    preflight = sniffer.sniff(encrypted_pdf('user'))
+    assert preflight.is_encrypted and preflight.strategy == SKIP
+    # Only an owner password, so Tika can still read the text and labels
+    preflight = sniffer.sniff(io.BytesIO(encrypted_pdf('')))
+    assert preflight.is_encrypted and preflight.strategy == NO_OCR
+
+def test_page_count_across_chunks(monkeypatch):
+    monkeypatch.setattr(file_sniffer, 'CHUNK_SIZE', 100)
+    for padding in range(0, 40, 3):
+        body = pdf(*[b' ' * padding + b'/Type /Page /Font' + b' ' * (60 - padding) for _ in range(25)], b'/Type /Pages')
+        preflight = FileSniffer().sniff(io.BytesIO(body))
+        assert preflight.page_count == 25
+        assert not preflight.partial
+
+def test_partial_scan(monkeypatch):
+    monkeypatch.setattr(file_sniffer, 'CHUNK_SIZE', 100)
+    monkeypatch.setattr(file_sniffer, 'MAX_SCAN_BYTES', 200)
+    body = pdf(b'/Type /Page /Font', b' ' * 500, b'/Subtype /Image')
+    preflight = FileSniffer().sniff(body)
+    # The image past the scan limit is never seen, so the text layer alone does not decide the strategy
+    assert preflight.partial and preflight.strategy == AUTO
@@ -0,0 +1,106 @@
+from context import cis
+from cis.inference_backends import load_mmap_model, intra_op_thread_count, SAFETENSORS_FILE_NAME
+from cis.inference_batcher import DEFAULT_BUCKET_BOUNDARIES
+from cis.process_stats import get_memory_breakdown
+from stubs import stub_hf_model
+from transformers import DistilBertConfig, DistilBertForSequenceClassification
+import builtins
+import torch
+import os
+import pytest
+
+def tiny_model(path, safe_serialization=True):
+    torch.manual_seed(0)
+    config = DistilBertConfig(vocab_size=100, dim=32, n_layers=1, n_heads=2, hidden_dim=64, max_position_embeddings=64, num_labels=3)
+    model = DistilBertForSequenceClassification(config).eval()
+    model.save_pretrained(str(path))
+    if not safe_serialization:
+        # Checkpoints saved before safetensors was the default
+        os.remove(os.path.join(str(path), SAFETENSORS_FILE_NAME))
+        torch.save(model.state_dict(), os.path.join(str(path), 'pytorch_model.bin'))
+    return model
+
+def mapped_ranges(weights_path):
+    ranges = []
+    with open('/proc/self/maps', 'r') as f:
+        for line in f.read().splitlines():
+            if line.endswith(os.path.realpath(weights_path)):
+                start, end = line.split()[0].split('-')
+                ranges.append((int(start, 16), int(end, 16)))
+    return ranges
+
+def outputs(model):
+    input_ids = torch.tensor([[1, 5, 7, 9, 2], [1, 42, 2, 0, 0]])
+    attention_mask = (input_ids != 0).long()
+    with torch.inference_mode():
+        return model(input_ids=input_ids, attention_mask=attention_mask).logits
+
+def test_mmap_model_matches_from_pretrained(tmp_path):
+    tiny_model(tmp_path)
+    model = load_mmap_model(str(tmp_path))
+    reference = DistilBertForSequenceClassification.from_pretrained(str(tmp_path)).eval()
+    assert torch.allclose(outputs(model), outputs(reference))
+    if not os.path.exists('/proc/self/maps'):
+        pytest.skip('/proc/self/maps is needed to check where parameters live')
+    # Every parameter points into the mapped weights file instead of private memory
+    ranges = mapped_ranges(os.path.join(str(tmp_path), SAFETENSORS_FILE_NAME))
+    assert len(ranges) > 0
+    for name, param in model.named_parameters():
+        assert any(start <= param.data_ptr() < end for start, end in ranges), name
+
+def test_pytorch_checkpoints_are_converted(tmp_path):
+    reference = tiny_model(tmp_path, safe_serialization=False)
+    assert not os.path.exists(os.path.join(str(tmp_path), SAFETENSORS_FILE_NAME))
+    model = load_mmap_model(str(tmp_path))
+    assert os.path.exists(os.path.join(str(tmp_path), SAFETENSORS_FILE_NAME))
+    assert torch.allclose(outputs(model), outputs(reference))
+
+def test_memory_breakdown(monkeypatch):
+    if os.path.exists('/proc/self/smaps_rollup'):
+        breakdown = get_memory_breakdown()
+        assert set(breakdown) == {'rss_bytes', 'pss_bytes', 'unique_bytes', 'shared_bytes'}
+        assert breakdown['rss_bytes'] >= breakdown['unique_bytes'] > 0
+    # Without smaps_rollup, e.g. on older kernels or outside Linux, only the RSS is reported
+    real_open = builtins.open
+    def no_smaps(path, *args, **kwargs):
+        if path == '/proc/self/smaps_rollup':
+            raise FileNotFoundError(path)
+        return real_open(path, *args, **kwargs)
+    monkeypatch.setattr(builtins, 'open', no_smaps)
+    breakdown = get_memory_breakdown()
+    assert list(breakdown) == ['rss_bytes'] and breakdown['rss_bytes'] > 0
+
+def test_intra_op_thread_count():
+    # Without batching every request thread runs its own forward pass, with it one scheduler thread does
+    assert intra_op_thread_count(None, workers=2, threads=4, max_batch_size=1, cpu_count=16) == 2
+    assert intra_op_thread_count(None, workers=2, threads=4, max_batch_size=8, cpu_count=16) == 8
+    # More workers or threads than cores still leaves one thread each
+    assert intra_op_thread_count(None, workers=32, threads=4, max_batch_size=8, cpu_count=16) == 1
+    assert intra_op_thread_count(None, workers=8, threads=8, max_batch_size=1, cpu_count=16) == 1
+    assert intra_op_thread_count(3, workers=32, threads=4, max_batch_size=1, cpu_count=16) == 3
+    assert intra_op_thread_count(None, workers=1, threads=1, max_batch_size=1) == (os.cpu_count() or 1)
+
+class StubBackend():
+    def __init__(self):
+        self.lengths = []
+
+    def forward(self, input_ids, attention_mask):
+        self.lengths.append(input_ids.shape[1])
+        return torch.zeros((len(input_ids), 4)).numpy()
+
+class ListLogger():
+    def __init__(self):
+        self.messages = []
+
+    def info(self, message):
+        self.messages.append(message)
+
+def test_warmup_runs_every_bucket():
+    backend = StubBackend()
+    model = stub_hf_model(backend=backend, logger=ListLogger())
+    timings = model.warmup(rounds=2)
+    assert sorted(timings) == sorted(DEFAULT_BUCKET_BOUNDARIES) and all(len(x) == 2 for x in timings.values())
+    # Each bucket is run at its own length
+    assert sorted(set(backend.lengths)) == sorted(DEFAULT_BUCKET_BOUNDARIES) and len(backend.lengths) == 2 * len(DEFAULT_BUCKET_BOUNDARIES)
+    assert len(model.logger.messages) == len(DEFAULT_BUCKET_BOUNDARIES)
+    assert all('p50: ' in x and 'p99: ' in x for x in model.logger.messages)
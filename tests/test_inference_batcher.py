@@ -0,0 +1,38 @@
+from context import cis
+from cis.inference_batcher import InferenceBatcher
+from concurrent.futures import ThreadPoolExecutor
+import threading
+
+def test_concurrent_submits_are_batched():
+    batches = []
+    lock = threading.Lock()
+    def forward(batch):
+        with lock:
+            batches.append(len(batch))
+        # Each result identifies the request it belongs to
+        return [sum(input_ids) for input_ids in batch]
+    batcher = InferenceBatcher(forward, max_batch_size=8, max_wait_ms=200)
+    inputs = [[i, i + 1] for i in range(8)]
+    with ThreadPoolExecutor(8) as executor:
+        results = list(executor.map(batcher.submit, inputs))
+    batcher.close()
+    assert results == [sum(x) for x in inputs]
+    assert sum(batches) == 8 and len(batches) < 8
+    assert batcher.get_stats()['total_requests'] == 8
+
+def test_buckets_and_errors():
+    seen = []
+    def forward(batch):
+        seen.append(sorted(len(x) for x in batch))
+        if any(len(x) > 100 for x in batch):
+            raise ValueError('too long')
+        return [len(x) for x in batch]
+    batcher = InferenceBatcher(forward, max_batch_size=4, max_wait_ms=200, bucket_boundaries=[10, 1000])
+    with ThreadPoolExecutor(4) as executor:
+        futures = [executor.submit(batcher.submit, [0] * length) for length in [3, 5, 200, 300]]
+    batcher.close()
+    assert futures[0].result() == 3 and futures[1].result() == 5
+    for future in futures[2:]:
+        assert isinstance(future.exception(), ValueError)
+    # Short and long inputs are never padded into the same forward pass
+    assert all(max(x) <= 10 or min(x) > 10 for x in seen)
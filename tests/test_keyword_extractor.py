@@ -0,0 +1,124 @@
+from context import cis
+from cis.keyword_extractor import KeywordExtractor, CapstoneDetector, DocumentScanner, extract_keywords, convert_keywords_to_subjects, whole_word_matches, resolve_matches
+import ahocorasick
+import random
+import os
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+SEPARATORS = ['\n', ' ', "'", '"', ',', '.', '?', '-', '(', ')', ';', ':', '\t', '  ', ', ', '. ', '\n\n', '/']
+
+def padded_automaton(words):
+    """The automaton used before boundary checking, with every term padded by each boundary character."""
+    kwtree = ahocorasick.Automaton()
+    index = 0
+    for word in words:
+        for prefix in ['\n', ' ',"'",'"']:
+            for suffix in ['\n', ' ', ',','.','?',"'",'"']:
+                padded = prefix + word + suffix
+                kwtree.add_word(padded, (index, padded))
+        index += 1
+    kwtree.make_automaton()
+    return kwtree
+
+def padded_extract_keywords(doc, kwtree, keyword_idf):
+    keywords = []
+    for end_index, (_, original_value) in kwtree.iter(doc.lower()):
+        keywords.append((original_value, end_index - len(original_value) + 1))
+    keyword_counts = {}
+    current_longest_word = ''
+    current_starting_index = 0
+    for k, v in sorted(keywords, key=lambda x: x[1]):
+        word = k[1:-1]
+        actual_index = v + 1
+        if actual_index == current_starting_index:
+            if len(word) > len(current_longest_word):
+                current_longest_word = word
+                continue
+        if actual_index <= current_starting_index + len(current_longest_word):
+            continue
+        if current_longest_word != '':
+            keyword_counts[current_longest_word] = keyword_counts.get(current_longest_word, 0) + keyword_idf.get(current_longest_word, 1)
+        current_starting_index = actual_index
+        current_longest_word = word
+    if current_longest_word != '':
+        keyword_counts[current_longest_word] = keyword_counts.get(current_longest_word, 0) + keyword_idf.get(current_longest_word, 1)
+    return keyword_counts
+
+def random_document(rng, vocabulary):
+    parts = []
+    for _ in range(rng.randint(0, 200)):
+        choice = rng.random()
+        if choice < 0.5:
+            word = rng.choice(vocabulary)
+            parts.append(word.upper() if rng.random() < 0.1 else word)
+        elif choice < 0.6:
+            # Terms that share a prefix or overlap with their neighbours
+            word = rng.choice(vocabulary)
+            parts.append(word[:rng.randint(1, len(word))] + rng.choice(vocabulary))
+        else:
+            parts.append(rng.choice(['the', 'of', 'and', 'report', 'data', 'x', 'é', 'İ', 'ΟΔΟΣ', '']))
+        parts.append(rng.choice(SEPARATORS))
+    return ''.join(parts)
+
+def test_keyword_counts_match_padded_automaton():
+    extractor = KeywordExtractor(os.path.join(ROOT, 'keyword_category.csv'), os.path.join(ROOT, 'rscategories.txt'), os.path.join(ROOT, 'keyword_idf.json'))
+    vocabulary = sorted(set(x.lower() for x in extractor.keyword_mapping.keys()))
+    kwtree = padded_automaton(vocabulary)
+    rng = random.Random(0)
+    for _ in range(500):
+        doc = random_document(rng, vocabulary)
+        assert extractor.extract_keywords(doc) == padded_extract_keywords(doc, kwtree, extractor.keyword_idf)
+
+def test_chunked_scan_matches_padded_automaton():
+    extractor = KeywordExtractor(os.path.join(ROOT, 'keyword_category.csv'), os.path.join(ROOT, 'rscategories.txt'), os.path.join(ROOT, 'keyword_idf.json'))
+    vocabulary = sorted(set(x.lower() for x in extractor.keyword_mapping.keys()))
+    kwtree = padded_automaton(vocabulary)
+    rng = random.Random(3)
+    for _ in range(200):
+        doc = random_document(rng, vocabulary)
+        expected = padded_extract_keywords(doc, kwtree, extractor.keyword_idf)
+        for chunk_size in [1, 7, 64]:
+            matches = ((word_id, word, start_index) for start_index, (word_id, word) in whole_word_matches(extractor.kwtree, doc, extractor.max_length, chunk_size))
+            keyword_counts = {}
+            for _, word in resolve_matches(matches, extractor.max_length):
+                keyword_counts[word] = keyword_counts.get(word, 0) + extractor.keyword_idf.get(word, 1)
+            assert keyword_counts == expected
+
+def test_scores_match_dict_scoring():
+    extractor = KeywordExtractor(os.path.join(ROOT, 'keyword_category.csv'), os.path.join(ROOT, 'rscategories.txt'), os.path.join(ROOT, 'keyword_idf.json'))
+    vocabulary = sorted(set(x.lower() for x in extractor.keyword_mapping.keys()))
+    kwtree = padded_automaton(vocabulary)
+    rng = random.Random(1)
+    for _ in range(500):
+        doc = random_document(rng, vocabulary)
+        keyword_weights = padded_extract_keywords(doc, kwtree, extractor.keyword_idf)
+        scores = extractor.score(doc)
+        assert list(scores.keyword_weights().items()) == list(keyword_weights.items())
+        assert scores.top_keywords(5) == [x[0] for x in sorted(keyword_weights.items(), key=lambda y: y[1], reverse=True)][:5]
+        assert set(scores.subjects(doc)) == set(convert_keywords_to_subjects(doc, keyword_weights, extractor.keyword_mapping, extractor.priority_categories))
+
+def test_scan_matches_separate_extractors(tmp_path):
+    extractor = KeywordExtractor(os.path.join(ROOT, 'keyword_category.csv'), os.path.join(ROOT, 'rscategories.txt'), os.path.join(ROOT, 'keyword_idf.json'))
+    vocabulary = sorted(set(x.lower() for x in extractor.keyword_mapping.keys()))
+    rng = random.Random(2)
+    # Officials which are also keywords, or which overlap keywords, must not change either result
+    officials = ['Jane Doe', '"John Smith"', 'data'] + rng.sample(vocabulary, 20) + [rng.choice(vocabulary) + ' ' + rng.choice(vocabulary) for _ in range(20)]
+    capstone_path = tmp_path / 'capstone.csv'
+    capstone_path.write_text('\n'.join(officials))
+    capstone_detector = CapstoneDetector(str(capstone_path))
+    scanner = DocumentScanner(extractor, capstone_detector)
+    found = 0
+    for _ in range(500):
+        doc = random_document(rng, vocabulary + ['jane doe', 'john smith'])
+        scores = scanner.scan(doc)
+        assert scores.keyword_weights() == extractor.extract_keywords(doc)
+        assert scores.has_capstone == capstone_detector.detect_capstone_text(doc)
+        found += scores.has_capstone
+    assert 0 < found < 500
+
+def test_boundaries():
+    extractor = KeywordExtractor(os.path.join(ROOT, 'keyword_category.csv'), os.path.join(ROOT, 'rscategories.txt'), os.path.join(ROOT, 'keyword_idf.json'))
+    assert extractor.extract_keywords('epa forms') == {}
+    assert 'epa forms' in extractor.extract_keywords(' "EPA Forms", ')
+    assert 'epa forms' not in extractor.extract_keywords(' epa forms- ')
+    assert extract_keywords(' daily logs. ', extractor.kwtree, {}) == {'daily logs': 1}
@@ -0,0 +1,53 @@
+from context import cis
+from cis.local_extractors import LocalExtractors
+from cis.file_sniffer import FileSniffer
+import zipfile
+import io
+
+def docx(body):
+    data = io.BytesIO()
+    with zipfile.ZipFile(data, 'w') as archive:
+        archive.writestr('word/document.xml', '<w:document xmlns:w="http://schemas.openxmlformats.org/wordprocessingml/2006/main"><w:body>' + body + '</w:body></w:document>')
+    return data.getvalue()
+
+def extract(body):
+    result = LocalExtractors().extract(body, FileSniffer().sniff(body))
+    return None if result is None else result.text
+
+def test_docx_nested_paragraphs():
+    # A text box inside a paragraph, and a table cell paragraph, each appear once
+    body = '<w:p><w:r><w:t>Before </w:t></w:r><w:r><w:txbxContent><w:p><w:r><w:t>boxed</w:t></w:r></w:p></w:txbxContent></w:r><w:r><w:t>after</w:t><w:tab/><w:t>tab</w:t></w:r></w:p>'
+    body += '<w:tbl><w:tr><w:tc><w:p><w:r><w:t>cell</w:t></w:r></w:p></w:tc></w:tr></w:tbl>'
+    assert extract(docx(body)) == 'Before after\ttab\nboxed\ncell'
+
+def test_text_formats():
+    assert extract(b'Plain text\nwith lines\n') == 'Plain text\nwith lines\n'
+    assert extract('﻿café'.encode('utf-8')) == 'café'
+    assert extract(b'<html><body><script>x()</script><p>Hello</p></body></html>') == 'Hello'
+    eml = b'From: a@example.com\nTo: b@example.com\nSubject: Permit\nDate: Mon, 1 Jan 2024 00:00:00 +0000\n\nBody text\n'
+    assert extract(eml) == 'Permit\nBody text\n'
+
+def test_other_files_go_to_tika():
+    assert extract(b'<svg xmlns="http://www.w3.org/2000/svg"><text>x</text></svg>') is None
+    assert extract(b'%!PS-Adobe-3.0\n') is None
+    assert extract(b'BEGIN:VCARD\nVERSION:3.0\n') is None
+    assert extract(b'\x1b\x02binary\x7f') is None
+    assert extract(b'\xff\xfe\xfd not utf-8') is None
+
+def xlsx(sheets, order):
+    """A workbook whose tabs list the sheets in order, while the parts keep the numbering the sheets were created with."""
+    data = io.BytesIO()
+    ns = 'xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships"'
+    worksheet = 'http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet'
+    with zipfile.ZipFile(data, 'w') as archive:
+        archive.writestr('xl/workbook.xml', '<workbook ' + ns + '><sheets>' + ''.join('<sheet name="' + sheets[i][0] + '" sheetId="' + str(i + 1) + '" r:id="rId' + str(i + 1) + '"/>' for i in order) + '</sheets></workbook>')
+        archive.writestr('xl/_rels/workbook.xml.rels', '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">' + ''.join('<Relationship Id="rId' + str(i + 1) + '" Type="' + worksheet + '" Target="worksheets/sheet' + str(i + 1) + '.xml"/>' for i in range(len(sheets))) + '<Relationship Id="rId9" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/styles" Target="styles.xml"/></Relationships>')
+        for i, (_, value) in enumerate(sheets):
+            archive.writestr('xl/worksheets/sheet' + str(i + 1) + '.xml', '<worksheet ' + ns + '><sheetData><row><c t="inlineStr"><is><t>' + value + '</t></is></c><c><v>' + str(i) + '</v></c></row></sheetData></worksheet>')
+    return data.getvalue()
+
+def test_xlsx_sheet_names():
+    sheets = [('Budget', 'travel'), ('Permits', 'water'), ('Notes', 'misc')]
+    assert extract(xlsx(sheets, [0, 1, 2])) == 'Budget\ntravel\t0\nPermits\nwater\t1\nNotes\nmisc\t2'
+    # Reordered tabs keep each sheet's own name
+    assert extract(xlsx(sheets, [2, 0, 1])) == 'Notes\nmisc\t2\nBudget\ntravel\t0\nPermits\nwater\t1'
@@ -1,4 +1,5 @@
 from context import cis
+from concurrent.futures import ThreadPoolExecutor
 from cis import cis_requests, app_config, data_classes
 
 # def test_object_id_validation():
@@ -23,3 +24,35 @@ def test_model_output(hf_model):
     assert predictions[2].schedule == data_classes.RecordSchedule(function_number='108', schedule_number='1044', disposition_number='d')
     assert abs(predictions[2].probability - 0.11839142441749573) < 0.0001
     assert default_schedule == None
+
+def test_onnx_backend_matches_pytorch(hf_model, onnx_model):
+    texts = ["this is a test", "Quarterly water quality monitoring report for the region.", "Meeting notes " * 200]
+    for text in texts:
+        expected, expected_default = hf_model.predict(text=text, doc_type="Document", prediction_metadata=None, has_capstone=False, keywords=[], subjects=[], attachments=[])
+        actual, actual_default = onnx_model.predict(text=text, doc_type="Document", prediction_metadata=None, has_capstone=False, keywords=[], subjects=[], attachments=[])
+        assert [x.schedule for x in actual] == [x.schedule for x in expected]
+        for a, e in zip(actual, expected):
+            assert abs(a.probability - e.probability) < 0.001
+        assert actual_default == expected_default
+
+def test_parallel_predictions_match_sequential(hf_model):
+    texts = [f"record number {i} " * (i + 1) for i in range(32)]
+    def predict(text):
+        return hf_model.predict(text=text, doc_type="Document", prediction_metadata=None, has_capstone=False, keywords=["records"], subjects=[], attachments=[])
+    expected = [predict(text) for text in texts]
+    with ThreadPoolExecutor(max_workers=16) as executor:
+        actual = list(executor.map(predict, texts * 8))
+    for (predictions, default_schedule), (expected_predictions, expected_default) in zip(actual, expected * 8):
+        assert [x.schedule for x in predictions] == [x.schedule for x in expected_predictions]
+        assert [x.probability for x in predictions] == [x.probability for x in expected_predictions]
+        assert default_schedule == expected_default
+
+def test_valid_schedules_filter(hf_model):
+    valid_schedules = ['306-1023-c', '108-1044-d', '401-1006-b']
+    for schedules in [valid_schedules, frozenset(valid_schedules)]:
+        predictions, default_schedule = hf_model.predict(text="this is a test", doc_type="Document", prediction_metadata=None, has_capstone=False, keywords=[], subjects=[], attachments=[], valid_schedules=schedules)
+        assert len(predictions) == 3
+        assert predictions[0].schedule == data_classes.RecordSchedule(function_number='306', schedule_number='1023', disposition_number='c')
+        assert predictions[1].schedule == data_classes.RecordSchedule(function_number='108', schedule_number='1044', disposition_number='d')
+        assert all(f'{x.schedule.function_number}-{x.schedule.schedule_number}-{x.schedule.disposition_number}' in valid_schedules for x in predictions)
+        assert [x.probability for x in predictions] == sorted([x.probability for x in predictions], reverse=True)
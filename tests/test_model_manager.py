@@ -0,0 +1,47 @@
+from context import cis
+from cis import model_manager
+from cis.model_manager import ModelManager
+import logging
+import threading
+
+class FakeModel():
+    def __init__(self, model_path, label_mapping_path, office_info_mapping_path, version=None, logger=None, **kwargs):
+        self.version = version
+        self.release = threading.Event()
+        self.started = threading.Event()
+        self.closed = False
+
+    def predict(self, text):
+        self.started.set()
+        self.release.wait(5)
+        return self.version
+
+    def warmup(self, rounds):
+        pass
+
+    def close(self):
+        self.closed = True
+
+def test_prediction_during_swap_finishes_on_old_model(monkeypatch, tmp_path):
+    monkeypatch.setattr(model_manager, 'HuggingFaceModel', FakeModel)
+    manager = ModelManager(FakeModel(None, None, None, version='old'), {}, logging.getLogger(), model_root=str(tmp_path))
+    old_model = manager.current
+    results = []
+    thread = threading.Thread(target=lambda: results.append(manager.current.predict('text')))
+    thread.start()
+    assert old_model.started.wait(5)
+    assert manager.start_swap(str(tmp_path / 'new'), str(tmp_path / 'labels.json'), str(tmp_path / 'offices.json'), 'new')
+    manager.swap_thread.join(5)
+    assert manager.current.version == 'new'
+    assert manager.swap_status['state'] == 'complete'
+    old_model.release.set()
+    thread.join(5)
+    assert results == ['old']
+    assert old_model.closed
+
+def test_swap_restrictions(tmp_path):
+    manager = ModelManager(FakeModel(None, None, None, version='old'), {}, logging.getLogger(), model_root=str(tmp_path))
+    assert manager.swappable()
+    assert manager.in_model_root(str(tmp_path / 'models' / 'new'))
+    assert not manager.in_model_root(str(tmp_path / '..' / 'elsewhere'))
+    assert not ModelManager(manager.current, {}, logging.getLogger(), model_root=str(tmp_path), workers=4).swappable()
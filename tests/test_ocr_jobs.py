@@ -0,0 +1,65 @@
+from context import cis
+from cis.ocr_jobs import OcrJobQueue, QUEUED, DONE, FAILED
+import threading
+import json
+import io
+import os
+import time
+
+def wait_for(queue, job_id, owner):
+    for _ in range(200):
+        job = queue.get(job_id, owner)
+        if job['status'] in (DONE, FAILED):
+            return job
+        time.sleep(0.01)
+    assert False
+
+def test_submit_and_poll(tmp_path):
+    queue = OcrJobQueue(str(tmp_path), workers=1)
+    queue.reset()
+    job_id = queue.submit(lambda f: {'text': f.read().decode()}, io.BytesIO(b'scanned'), 'a@example.com', {'file_path': 'x'})
+    job = wait_for(queue, job_id, 'a@example.com')
+    assert job['status'] == DONE and job['result'] == {'text': 'scanned'} and job['context'] == {'file_path': 'x'}
+    # Other workers poll the same directory
+    assert OcrJobQueue(str(tmp_path)).get(job_id, 'a@example.com')['status'] == DONE
+    def fail(f):
+        raise RuntimeError('Could not connect to tika.internal:9998')
+    job = wait_for(queue, queue.submit(fail, b'scanned', 'a@example.com'), 'a@example.com')
+    # The cause stays in the log and is not stored for the client
+    assert job['status'] == FAILED and 'tika.internal' not in json.dumps(job)
+    # Counters are updated after the job file is written
+    queue.executor.shutdown(wait=True)
+    assert queue.get_stats()['completed'] == 1 and queue.get_stats()['failed'] == 1
+    queue.close()
+
+def test_jobs_belong_to_their_owner(tmp_path):
+    queue = OcrJobQueue(str(tmp_path), workers=1)
+    queue.reset()
+    job_id = queue.submit(lambda f: {}, b'scanned', 'a@example.com')
+    wait_for(queue, job_id, 'a@example.com')
+    assert queue.get(job_id, 'b@example.com') is None
+    assert queue.get('../' + job_id, 'a@example.com') is None
+    queue.close()
+
+def test_queue_limit_and_expiry(tmp_path):
+    queue = OcrJobQueue(str(tmp_path), workers=1, max_pending=1, ttl_seconds=60)
+    queue.reset()
+    started = threading.Event()
+    release = threading.Event()
+    def slow(f):
+        started.set()
+        release.wait()
+        return {}
+    running = queue.submit(slow, b'scanned', 'a@example.com')
+    started.wait()
+    queued = queue.submit(lambda f: {}, b'scanned', 'a@example.com')
+    assert queue.get(queued, 'a@example.com')['status'] == QUEUED
+    assert queue.submit(lambda f: {}, b'scanned', 'a@example.com') is None
+    assert queue.get_stats()['rejected'] == 1
+    release.set()
+    wait_for(queue, queued, 'a@example.com')
+    stale = time.time() - 120
+    os.utime(queue.path(running), (stale, stale))
+    queue.expire()
+    assert queue.get(running, 'a@example.com') is None and queue.get(queued, 'a@example.com') is not None
+    queue.close()
@@ -0,0 +1,98 @@
+from context import cis
+from cis import cis_requests
+from cis.pdf_pages import PdfPageSplitter, PdfSplitError
+from cis.tika_client import TikaClient
+from cis.file_sniffer import NO_OCR
+from pypdf import PdfReader, PdfWriter
+from flask import Flask
+import threading
+import time
+import io
+
+def pdf(pages):
+    writer = PdfWriter()
+    for _ in range(pages):
+        writer.add_blank_page(100, 100)
+    writer.add_metadata({'/MSIP_Label_1_Name': 'CUI'})
+    data = io.BytesIO()
+    writer.write(data)
+    return data.getvalue()
+
+class FakeTika():
+    """Stands in for tika_extract, answering with the number of pages and the labels of each range it is sent."""
+    def __init__(self, delay=0.05):
+        self.delay = delay
+        self.lock = threading.Lock()
+        self.active = 0
+        self.max_active = 0
+        self.calls = 0
+
+    def __call__(self, file, strategy):
+        with self.lock:
+            self.active += 1
+            self.calls += 1
+            self.max_active = max(self.max_active, self.active)
+        time.sleep(self.delay)
+        reader = PdfReader(io.BytesIO(file))
+        result = {'X-TIKA:content': 'p' * len(reader.pages)}
+        if reader.metadata is not None and '/MSIP_Label_1_Name' in reader.metadata:
+            result['MSIP_Label_1_Name'] = reader.metadata['/MSIP_Label_1_Name']
+        with self.lock:
+            self.active -= 1
+        return 200, result
+
+def setup(monkeypatch, text_limit=None, max_concurrency=8):
+    tika = FakeTika()
+    monkeypatch.setattr(cis_requests, 'tika_extract', tika)
+    monkeypatch.setattr(cis_requests, 'tika_client', TikaClient('127.0.0.1:1', probe_interval=0, text_limit=text_limit, max_concurrency=max_concurrency))
+    monkeypatch.setattr(cis_requests, 'pdf_splitter', PdfPageSplitter(10, 5, 3))
+    return tika
+
+def test_ranges_are_joined_in_order(monkeypatch):
+    tika = setup(monkeypatch)
+    status, result = cis_requests.tika_extract_pages(pdf(23), NO_OCR)
+    assert status == 200 and result['X-TIKA:content'] == '\n'.join(['ppppp'] * 4 + ['ppp'])
+    # Labels are kept on the first range only, and reach the result
+    assert result['MSIP_Label_1_Name'] == 'CUI'
+    assert tika.calls == 5 and tika.max_active == 3
+
+def test_ranges_take_slots(monkeypatch):
+    tika = setup(monkeypatch, max_concurrency=2)
+    assert cis_requests.tika_extract_pages(pdf(30), NO_OCR)[0] == 200
+    assert tika.max_active == 2
+    assert cis_requests.tika_client.get_stats()['admitted'] == 6 and cis_requests.tika_client.get_stats()['active'] == 0
+
+def test_stops_once_text_budget_is_reached(monkeypatch):
+    tika = setup(monkeypatch, text_limit=12)
+    status, result = cis_requests.tika_extract_pages(pdf(100), NO_OCR)
+    assert status == 200 and result['X-TIKA:content'].startswith('ppppp\nppppp\nppppp')
+    # The calls still running when the budget was reached have finished before returning
+    assert tika.active == 0 and tika.calls < 20
+    assert cis_requests.tika_client.get_stats()['active'] == 0
+
+def test_unsplittable_pdfs_are_extracted_whole(monkeypatch):
+    tika = setup(monkeypatch)
+    def ranges(body):
+        raise PdfSplitError('broken')
+        yield
+    monkeypatch.setattr(cis_requests.pdf_splitter, 'ranges', ranges)
+    with Flask('test').app_context():
+        status, result = cis_requests.tika_extract_pages(pdf(12), NO_OCR)
+    assert status == 200 and result['X-TIKA:content'] == 'p' * 12 and tika.calls == 1
+    assert cis_requests.pdf_splitter.get_stats()['fallbacks'] == 1
+
+def test_split_failing_after_the_first_range(monkeypatch):
+    # The first range holds the only slot, for longer than the whole file would wait for one
+    tika = setup(monkeypatch, max_concurrency=1)
+    tika.delay = 0.5
+    cis_requests.tika_client.queue_timeout = 0.2
+    split = cis_requests.pdf_splitter.ranges
+    def ranges(body):
+        yield next(split(body))
+        raise PdfSplitError('broken page')
+    monkeypatch.setattr(cis_requests.pdf_splitter, 'ranges', ranges)
+    with Flask('test').app_context():
+        status, result = cis_requests.tika_extract_pages(pdf(40), NO_OCR)
+    assert status == 200 and result['X-TIKA:content'] == 'p' * 40
+    assert tika.calls == 2 and tika.active == 0 and cis_requests.tika_client.get_stats()['timed_out'] == 0
+    assert cis_requests.pdf_splitter.get_stats()['fallbacks'] == 1
@@ -0,0 +1,65 @@
+from context import cis
+from cis.hf_model import window_starts
+from stubs import stub_hf_model, WordTokenizer, SCHEDULES
+import numpy as np
+
+def stub_model():
+    """A model whose windows are the label indices in the document text and whose logits favour the first id of a window."""
+    def forward(batch_input_ids):
+        model.batches.append(len(batch_input_ids))
+        logits = np.zeros((len(batch_input_ids), len(SCHEDULES)))
+        for row, input_ids in enumerate(batch_input_ids):
+            logits[row, input_ids[0]] = 4.0
+        return logits
+    model = stub_hf_model(forward=forward, batches=[], document_windows=lambda document: [[int(x)] for x in document['text'].split()])
+    return model
+
+def document(text, **kwargs):
+    return dict(text=text, doc_type='document', prediction_metadata=None, has_capstone=False, keywords=[], subjects=[], attachments=[], **kwargs)
+
+def test_documents_share_one_forward_pass():
+    model = stub_model()
+    results = model.predict_batch([document('0'), document('1'), document('2')])
+    assert model.batches == [3]
+    assert [predictions[0].schedule for predictions, _ in results] == [model.classes[0], model.classes[1], model.classes[2]]
+
+def test_documents_can_have_their_own_schedules():
+    model = stub_model()
+    email_schedules = frozenset(SCHEDULES[1:])
+    results = model.predict_batch([document('0', valid_schedules=email_schedules), document('0', valid_schedules=None), document('0')], valid_schedules=frozenset(SCHEDULES[2:]))
+    assert results[0][0][0].schedule == model.classes[1]
+    assert results[1][0][0].schedule == model.classes[0]
+    assert results[2][0][0].schedule == model.classes[2]
+    assert all(len(predictions) == 3 for predictions, _ in results[:2]) and len(results[2][0]) == 2
+
+def windowed_model(max_windows):
+    tokenizer = WordTokenizer()
+    return stub_hf_model(tokenizer=tokenizer, max_windows=max_windows), tokenizer
+
+def test_window_starts():
+    assert window_starts(100, 512, 4) == [0]
+    assert window_starts(1000, 400, 8) == [0, 300, 600]
+    starts = window_starts(100000, 400, 4)
+    assert len(starts) == 4 and starts[0] == 0 and starts[-1] == 100000 - 400
+    assert starts == sorted(starts)
+    assert window_starts(100000, 400, 1) == [0]
+
+def test_long_documents_tokenize_a_fixed_amount():
+    model, tokenizer = windowed_model(max_windows=3)
+    short = document('word ' * 100)
+    assert len(model.document_windows(short)) == 1
+    for words in [2000, 200000]:
+        tokenizer.characters = 0
+        windows = model.document_windows(document(' '.join(['head'] + ['word'] * words + ['tails'])))
+        assert len(windows) == 3
+        assert all(len(x) <= 512 and x[0] == 1 and x[-1] == 2 for x in windows)
+        # The first window is full and the last one reaches the end of the document
+        assert len(windows[0]) == 512 and len(windows[-1]) > 500 and windows[-1][-2] == len('tails')
+        assert tokenizer.characters < 3 * 512 * 8 + 5000
+
+def test_windows_are_averaged():
+    model = stub_model()
+    predictions, _ = model.predict_batch([document('0 1')])[0]
+    assert model.batches == [2]
+    assert abs(predictions[0].probability - predictions[1].probability) < 1e-9
+    assert sorted(model.classes.index(x.schedule) for x in predictions[:2]) == [0, 1]
@@ -0,0 +1,27 @@
+from context import cis
+from cis.ranking import top_k
+from stubs import stub_hf_model
+import numpy as np
+import random
+
+def test_top_k_matches_stable_sort():
+    rng = random.Random(0)
+    for _ in range(200):
+        values = np.array([rng.choice([0.1, 0.2, 0.3, rng.random()]) for _ in range(rng.randint(1, 40))])
+        mask = np.array([rng.random() < 0.7 for _ in values])
+        k = rng.randint(1, 5)
+        expected = [i for i in sorted(range(len(values)), key=lambda i: -values[i]) if mask[i]][:k]
+        assert top_k(values, k, mask).tolist() == expected
+        assert top_k(values, k).tolist() == sorted(range(len(values)), key=lambda i: -values[i])[:k]
+
+def test_postprocess_filters_and_sets_default_schedule():
+    model = stub_hf_model()
+    logits = np.log(np.array([0.97, 0.01, 0.015, 0.005]))
+    predictions, default_schedule = model.postprocess(logits, 3, 0.95, None)
+    assert [model.class_index.keys[model.classes.index(x.schedule)] for x in predictions] == ['301-1016-c', '108-1044-d', '306-1023-c']
+    assert default_schedule == model.classes[0]
+    valid_schedules = frozenset(['306-1023-c', '401-1006-b'])
+    predictions, default_schedule = model.postprocess(logits, 3, 0.95, valid_schedules)
+    assert [x.schedule for x in predictions] == [model.classes[1], model.classes[3]]
+    assert default_schedule is None
+    assert model.class_index.mask_for(valid_schedules) is model.class_index.mask_for(valid_schedules)
@@ -0,0 +1,66 @@
+from context import cis
+from cis.tika_cache import TikaResultCache, file_digest
+from cis.data_classes import TikaResult
+import io
+import os
+import time
+
+def result(text):
+    return TikaResult(text=text, is_encrypted=False, cui_categories=['CUI'])
+
+def test_hit_and_miss(tmp_path):
+    cache = TikaResultCache(str(tmp_path), 2**20, 60)
+    key = cache.key(file_digest(b'file')[0])
+    assert cache.get(key) is None
+    cache.put(key, result('text'))
+    assert cache.get(key, 4) == result('text')
+    assert file_digest(io.BytesIO(b'file')) == file_digest(b'file')
+    stats = cache.get_stats()
+    assert stats['hits'] == 1 and stats['misses'] == 1 and stats['bytes_saved'] == 4
+    # Another worker, or a restart, sees the same entry
+    assert TikaResultCache(str(tmp_path), 2**20, 60).get(key) == result('text')
+
+def test_entry_evicted_while_read(tmp_path, monkeypatch):
+    cache = TikaResultCache(str(tmp_path), 2**20, 60)
+    cache.put('key', result('text'))
+    # Another worker removes the entry between reading it and marking it used
+    def evicted(path, *args):
+        raise FileNotFoundError(path)
+    monkeypatch.setattr(os, 'utime', evicted)
+    assert cache.get('key') == result('text')
+
+def test_settings_are_part_of_the_key(tmp_path):
+    limited = TikaResultCache(str(tmp_path), 2**20, 60, dict(text_limit=10))
+    unlimited = TikaResultCache(str(tmp_path), 2**20, 60, dict(text_limit=None))
+    file_sha = file_digest(b'file')[0]
+    limited.put(limited.key(file_sha), result('short'))
+    assert unlimited.get(unlimited.key(file_sha)) is None
+    assert TikaResultCache(str(tmp_path), 2**20, 60, dict(text_limit=10)).get(limited.key(file_sha)) == result('short')
+
+def test_ttl(tmp_path):
+    cache = TikaResultCache(str(tmp_path), 2**20, 60)
+    cache.put('old', result('old'))
+    cache.put('new', result('new'))
+    stale = time.time() - 120
+    os.utime(cache.path('old'), (stale, stale))
+    # Entries which are not read again are removed when the directory is scanned
+    cache = TikaResultCache(str(tmp_path), 2**20, 60)
+    assert not os.path.exists(cache.path('old'))
+    assert cache.get_stats()['expirations'] == 1
+    # Entries which are read are checked against their creation time
+    cache = TikaResultCache(str(tmp_path), 2**20, 0)
+    time.sleep(0.01)
+    assert cache.get('new') is None and not os.path.exists(cache.path('new'))
+
+def test_eviction_counts_every_worker(tmp_path):
+    first = TikaResultCache(str(tmp_path), 2000, 60)
+    second = TikaResultCache(str(tmp_path), 2000, 60)
+    for i in range(10):
+        first.put('first' + str(i), result('x' * 100))
+        second.put('second' + str(i), result('x' * 100))
+    # Both workers wrote to the same directory, which stays within its size
+    size = sum(os.path.getsize(os.path.join(tmp_path, name)) for name in os.listdir(tmp_path))
+    assert size <= 2000
+    assert first.get_stats()['evictions'] + second.get_stats()['evictions'] > 0
+    # The most recently written entries are kept
+    assert second.get('second9') is not None and first.get('first0') is None
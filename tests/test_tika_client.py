@@ -0,0 +1,164 @@
+from context import cis
+from cis.tika_client import TikaClient, TikaOverloadedError
+from concurrent.futures import ThreadPoolExecutor
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+import threading
+import socket
+import json
+import time
+
+def stub_tika(name, delay=0):
+    """Start a Tika stand-in which answers every PUT with its name after delay seconds."""
+    class Handler(BaseHTTPRequestHandler):
+        def do_PUT(self):
+            self.rfile.read(int(self.headers.get('Content-Length', 0)))
+            time.sleep(delay)
+            body = json.dumps([{'X-TIKA:content': name}]).encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            self.send_response(200)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, '127.0.0.1:' + str(server.server_address[1])
+
+def unused_address():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return '127.0.0.1:' + str(s.getsockname()[1])
+
+def extract(client):
+    r = client.put('/rmeta/text', b'document', {'accept': 'application/json'})
+    return r.json()[0]['X-TIKA:content']
+
+def test_least_outstanding_routing():
+    _, a = stub_tika('a', delay=0.2)
+    _, b = stub_tika('b', delay=0.2)
+    client = TikaClient(a + ',' + b, probe_interval=0)
+    with ThreadPoolExecutor(8) as executor:
+        names = list(executor.map(lambda _: extract(client), range(8)))
+    assert names.count('a') == 4
+    assert names.count('b') == 4
+
+def test_dead_node_is_ejected():
+    _, a = stub_tika('a')
+    client = TikaClient(unused_address() + ',' + a, probe_interval=0, eject_after=2, eject_seconds=60)
+    assert [extract(client) for _ in range(6)] == ['a'] * 6
+    stats = client.get_stats()
+    assert stats['nodes'][0]['ejected']
+    assert stats['nodes'][0]['requests'] == 2
+    assert stats['failovers'] == 2
+
+def test_slow_call_is_hedged():
+    _, slow = stub_tika('slow', delay=2)
+    _, fast = stub_tika('fast')
+    client = TikaClient(slow + ',' + fast, probe_interval=0, hedge_after=0.1)
+    # Fill the fast node first so that the first call goes to the slow one
+    client.nodes[1].requests = 1
+    start = time.monotonic()
+    assert extract(client) == 'fast'
+    assert time.monotonic() - start < 1
+    assert client.get_stats()['hedge_wins'] == 1
+
+def stub_text_tika(text, content_type):
+    """Start a Tika stand-in which answers /tika with text and /meta with the headers it was sent."""
+    class Handler(BaseHTTPRequestHandler):
+        def do_PUT(self):
+            self.rfile.read(int(self.headers.get('Content-Length', 0)))
+            if self.path == '/meta':
+                body = json.dumps(dict(self.headers)).encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+            else:
+                body = text.encode('utf-8' if 'charset' not in content_type else content_type.split('charset=')[1])
+                self.send_response(200)
+                self.send_header('Content-Type', content_type)
+                self.send_header('X-Skip-Embedded', self.headers.get('X-Tika-Skip-Embedded', ''))
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            try:
+                self.wfile.write(body)
+            except (BrokenPipeError, ConnectionResetError):
+                pass
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, '127.0.0.1:' + str(server.server_address[1])
+
+def test_text_budget_and_charset():
+    # Multi-byte characters straddle the chunk boundaries of the stream
+    text = 'é' * 200000
+    _, server = stub_text_tika(text, 'text/plain')
+    client = TikaClient(server, probe_interval=0, text_limit=100000)
+    assert client.put_text(b'document', {}) == (200, text[:100000])
+    client = TikaClient(server, probe_interval=0, text_limit=300000)
+    assert client.put_text(b'document', {}) == (200, text)
+    _, server = stub_text_tika('façade', 'text/plain; charset=ISO-8859-1')
+    client = TikaClient(server, probe_interval=0, text_limit=100)
+    assert client.put_text(b'document', {}) == (200, 'façade')
+
+def test_metadata_is_never_ocred():
+    _, server = stub_text_tika('', 'text/plain')
+    client = TikaClient(server, probe_interval=0, text_limit=100)
+    status, headers = client.put_metadata(b'document')
+    assert status == 200 and headers['X-Tika-PDFOcrStrategy'] == 'no_ocr'
+
+def test_slots():
+    client = TikaClient('127.0.0.1:1', probe_interval=0, max_concurrency=2, max_queue_depth=1, queue_timeout=0.2)
+    held = threading.Event()
+    done = threading.Event()
+    def hold():
+        with client.slot():
+            held.set()
+            done.wait()
+    holders = [threading.Thread(target=hold) for _ in range(2)]
+    for holder in holders:
+        holder.start()
+        held.wait()
+        held.clear()
+    # Both slots are taken, so the next caller waits and gives up after queue_timeout
+    start = time.monotonic()
+    try:
+        with client.slot():
+            assert False
+    except TikaOverloadedError:
+        assert time.monotonic() - start >= 0.2
+    # With the queue full as well, callers are rejected without waiting
+    def wait():
+        try:
+            with client.slot():
+                pass
+        except TikaOverloadedError:
+            pass
+    waiter = threading.Thread(target=wait)
+    waiter.start()
+    while client.get_stats()['queue_depth'] == 0:
+        time.sleep(0.01)
+    start = time.monotonic()
+    try:
+        with client.slot():
+            assert False
+    except TikaOverloadedError:
+        assert time.monotonic() - start < 0.1
+    waiter.join()
+    done.set()
+    for holder in holders:
+        holder.join()
+    # Released slots admit callers again
+    with client.slot():
+        pass
+    stats = client.get_stats()
+    assert stats['admitted'] == 3 and stats['rejected'] == 1 and stats['timed_out'] == 2 and stats['active'] == 0
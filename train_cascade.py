@@ -0,0 +1,110 @@
+"""Trains the keyword cascade classifier which answers easy predictions before the transformer runs."""
+from cis.keyword_extractor import KeywordExtractor
+from cis.cascade import cascade_features
+from collections import Counter
+import numpy as np
+import argparse
+import json
+import random
+
+def load_corpus(corpus_path, label_mapping):
+    # One JSON object per line with the document text and its record schedule label, e.g. {"text": "...", "label": "301-1016-c"}
+    examples = []
+    with open(corpus_path, 'r', errors='ignore') as f:
+        for line in f:
+            if line.strip() == '':
+                continue
+            example = json.loads(line)
+            if example['label'] in label_mapping:
+                examples.append((example['text'], label_mapping[example['label']]))
+    return examples
+
+def featurize(extractor, examples):
+    featurized = []
+    for text, label in examples:
+        keyword_weights = extractor.extract_keywords(text)
+        featurized.append((cascade_features(keyword_weights, extractor.extract_subjects(text, keyword_weights)), label))
+    return featurized
+
+def to_matrix(featurized, vocabulary):
+    x = np.zeros((len(featurized), len(vocabulary)), dtype=np.float32)
+    for row, (features, _) in enumerate(featurized):
+        for feature, value in features.items():
+            if feature in vocabulary:
+                x[row, vocabulary[feature]] = value
+    return x, np.array([label for _, label in featurized])
+
+def softmax_rows(logits):
+    logits = logits - logits.max(axis=1, keepdims=True)
+    exp = np.exp(logits)
+    return exp / exp.sum(axis=1, keepdims=True)
+
+def train(featurized, vocabulary, num_labels, epochs, learning_rate, l2, batch_size=256):
+    weights = np.zeros((len(vocabulary), num_labels), dtype=np.float32)
+    bias = np.zeros(num_labels, dtype=np.float32)
+    for epoch in range(epochs):
+        random.shuffle(featurized)
+        for start in range(0, len(featurized), batch_size):
+            x, y = to_matrix(featurized[start:start + batch_size], vocabulary)
+            probs = softmax_rows(x @ weights + bias)
+            probs[np.arange(len(y)), y] -= 1
+            weights -= learning_rate * (x.T @ probs / len(y) + l2 * weights)
+            bias -= learning_rate * probs.mean(axis=0)
+    return weights, bias
+
+def evaluate(featurized, vocabulary, weights, bias, thresholds):
+    x, y = to_matrix(featurized, vocabulary)
+    probs = softmax_rows(x @ weights + bias)
+    top = probs.argmax(axis=1)
+    confidence = probs.max(axis=1)
+    report = {'documents': len(y), 'accuracy': float((top == y).mean()), 'thresholds': {}}
+    for threshold in thresholds:
+        confident = confidence >= threshold
+        report['thresholds'][str(threshold)] = {
+            'short_circuit_fraction': float(confident.mean()),
+            'accuracy_when_short_circuited': float((top[confident] == y[confident]).mean()) if confident.any() else None
+        }
+    return report
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Train the linear keyword cascade which runs before the transformer classifier.')
+    parser.add_argument('--label_mapping_path', default='/home/models/label_mapping.json',
+                    help='Path to mapping between prediction indices and corresponding record schedules.')
+    parser.add_argument('--vocab_path', default='keyword_category.csv',
+                    help='EPA enterprise vocabulary.')
+    parser.add_argument('--priority_categories_path', default='rscategories.txt',
+                    help='EPA enterprise vocabulary.')
+    parser.add_argument('--keyword_idf_path', default='keyword_idf.json',
+                    help='Inverse document frequency values for keywords.')
+    parser.add_argument('--corpus_path', required=True,
+                    help='Labeled training corpus with one {"text": ..., "label": ...} JSON object per line.')
+    parser.add_argument('--output_path', default='/home/models/cascade.npz',
+                    help='Where to save the trained cascade weights.')
+    parser.add_argument('--epochs', default=20, type=int,
+                    help='Passes over the training corpus.')
+    parser.add_argument('--learning_rate', default=0.5, type=float,
+                    help='Gradient descent step size.')
+    parser.add_argument('--l2', default=1e-4, type=float,
+                    help='L2 regularization strength.')
+    parser.add_argument('--min_feature_count', default=3, type=int,
+                    help='Minimum number of training documents a keyword or subject must appear in to be used as a feature.')
+    parser.add_argument('--validation_fraction', default=0.1, type=float,
+                    help='Fraction of the corpus held out to report accuracy at different confidence thresholds.')
+    args = parser.parse_args()
+    with open(args.label_mapping_path, 'r') as f:
+        label_mapping = json.loads(f.read())
+    extractor = KeywordExtractor(args.vocab_path, args.priority_categories_path, args.keyword_idf_path)
+    featurized = featurize(extractor, load_corpus(args.corpus_path, label_mapping))
+    random.seed(0)
+    random.shuffle(featurized)
+    split = int(len(featurized) * (1 - args.validation_fraction))
+    training, validation = featurized[:split], featurized[split:]
+    counts = Counter(feature for features, _ in training for feature in features)
+    features = sorted(feature for feature, count in counts.items() if count >= args.min_feature_count)
+    vocabulary = {feature: i for i, feature in enumerate(features)}
+    weights, bias = train(training, vocabulary, len(label_mapping), args.epochs, args.learning_rate, args.l2)
+    labels = [label for label, _ in sorted(label_mapping.items(), key=lambda x: x[1])]
+    np.savez(args.output_path, features=np.array(features), labels=np.array(labels), weights=weights, bias=bias)
+    if len(validation) > 0:
+        print(json.dumps(evaluate(validation, vocabulary, weights, bias, [0.7, 0.8, 0.9, 0.95]), indent=2))
+    print('Saved cascade with ' + str(len(features)) + ' features to ' + args.output_path)
@@ -1,7 +1,26 @@
 """App entry point."""
-from cis import create_app
+from cis import create_app, init_worker
 from waitress import serve
 import argparse
+import socket
+import os
+
+def serve_prefork(app, workers, threads, host='0.0.0.0', port=8000):
+    """Bind once, then fork workers from the fully loaded app so that they share its memory pages."""
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(1024)
+    children = []
+    for _ in range(workers):
+        pid = os.fork()
+        if pid == 0:
+            init_worker(app)
+            serve(app, sockets=[sock], threads=threads)
+            os._exit(0)
+        children.append(pid)
+    for pid in children:
+        os.waitpid(pid, 0)
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description='The CIS backend server provides APIs which power the EZDesktop application.')
@@ -24,7 +43,7 @@ if __name__ == "__main__":
     parser.add_argument('--patt_api_key', default=None,
                     help='API key for PATT service.')
     parser.add_argument('--tika_server', default=None,
-                    help='Host for tika service.')
+                    help='Host for tika service. Several hosts can be given as a comma separated list.')
     parser.add_argument('--cis_server', default=None,
                     help='Host for this (CIS) service.')
     parser.add_argument('--database_uri', default=None,
@@ -49,6 +68,90 @@ if __name__ == "__main__":
                     help='Username for WAM service.')
     parser.add_argument('--wam_password', default=None, 
                     help='Password for WAM service.')
+    parser.add_argument('--model_backend', default='pytorch', choices=['pytorch', 'pytorch_int8', 'onnx'],
+                    help='Inference backend for the classifier. pytorch_int8 applies dynamic int8 quantization (or loads model_int8.pt if present) and the onnx backend exports the model next to --model_path on first use.')
+    parser.add_argument('--threads', default=4, type=int,
+                    help='Number of waitress worker threads.')
+    parser.add_argument('--workers', default=1, type=int,
+                    help='Number of worker processes forked after the app is loaded. Workers share model and vocabulary memory.')
+    parser.add_argument('--model_root', default=None, 
+                    help='Directory models swapped in through /admin/swap_model must be under. Defaults to the directory containing --model_path.')
+    parser.add_argument('--tokenizer_pool_size', default=None, type=int,
+                    help='Number of tokenizer instances shared by prediction threads. Defaults to --threads.')
+    parser.add_argument('--max_batch_size', default=1, type=int, 
+                    help='Maximum number of concurrent predictions run in a single forward pass. Batching is disabled when set to 1.')
+    parser.add_argument('--batch_wait_ms', default=5, type=float, 
+                    help='Milliseconds to wait for a prediction batch to fill before running it.')
+    parser.add_argument('--batch_buckets', default=[64, 128, 256, 512], type=int, nargs='+', 
+                    help='Token length boundaries used to group batched predictions.')
+    parser.add_argument('--intra_op_threads', default=None, type=int, 
+                    help='Threads used within a single forward pass. Defaults to the number of cores divided by --workers times --threads, or by --workers alone when batching is enabled.')
+    parser.add_argument('--inter_op_threads', default=1, type=int, 
+                    help='Threads used to run independent operators of a forward pass in parallel.')
+    parser.add_argument('--warmup_rounds', default=3, type=int, 
+                    help='Synthetic predictions run for each token length bucket before the server starts accepting requests.')
+    parser.add_argument('--cascade_path', default=None, 
+                    help='Path to keyword cascade weights trained with train_cascade.py. When set, the transformer only runs for predictions the cascade is not confident about.')
+    parser.add_argument('--cascade_threshold', default=0.9, type=float, 
+                    help='Top probability at which a cascade prediction is returned without running the transformer.')
+    parser.add_argument('--cascade_audit_rate', default=0.05, type=float, 
+                    help='Fraction of confident cascade predictions also run through the transformer to measure agreement.')
+    parser.add_argument('--max_windows', default=1, type=int, 
+                    help='Maximum number of overlapping windows scored per long document, sampled from its head, middle and tail. Requests can lower it with max_windows in their prediction metadata. Set to 1 to only score the start of each document.')
+    parser.add_argument('--tika_pool_size', default=10, type=int, 
+                    help='Maximum number of keep-alive connections to the Tika server per worker.')
+    parser.add_argument('--tika_connect_timeout', default=5, type=float, 
+                    help='Seconds to wait for a connection to the Tika server.')
+    parser.add_argument('--tika_read_timeout', default=30, type=float, 
+                    help='Seconds to wait for Tika to extract text from a document.')
+    parser.add_argument('--tika_ocr_timeout', default=300, type=float, 
+                    help='Seconds to wait for Tika to OCR a document.')
+    parser.add_argument('--tika_cache_dir', default=None, 
+                    help='Directory for cached Tika results keyed by file hash. Caching is disabled when not set. Cached text is stored unencrypted, so use a directory only the service can read.')
+    parser.add_argument('--tika_cache_max_mb', default=1024, type=float, 
+                    help='Maximum size of the Tika result cache. Least recently used entries are evicted first.')
+    parser.add_argument('--tika_cache_ttl_hours', default=24, type=float, 
+                    help='Hours after which cached Tika results expire.')
+    parser.add_argument('--stream_tika_text', default=False, action="store_true", 
+                    help='Stream plain text from Tika and stop reading at --tika_text_limit characters. Encryption and sensitivity labels are read with a separate metadata call.')
+    parser.add_argument('--tika_text_limit', default=10000, type=int, 
+                    help='Maximum number of characters read from Tika per file when --stream_tika_text is set.')
+    parser.add_argument('--tika_max_concurrency', default=4, type=int, 
+                    help='Maximum number of Tika extractions running at once per worker.')
+    parser.add_argument('--tika_max_queue_depth', default=8, type=int, 
+                    help='Maximum number of requests waiting for a Tika slot. Further requests get a 503 response right away.')
+    parser.add_argument('--tika_queue_timeout', default=10, type=float, 
+                    help='Seconds a request waits for a Tika slot before it gets a 503 response.')
+    parser.add_argument('--tika_hedge_after', default=None, type=float, 
+                    help='Seconds after which a slow Tika call is also sent to a second Tika host, using whichever answers first. Hedging is disabled when not set.')
+    parser.add_argument('--tika_probe_interval', default=10, type=float, 
+                    help='Seconds between health probes of each Tika host when several are configured.')
+    parser.add_argument('--tika_eject_after', default=3, type=int, 
+                    help='Consecutive connection failures after which a Tika host stops getting requests.')
+    parser.add_argument('--tika_eject_seconds', default=30, type=float, 
+                    help='Seconds before an ejected Tika host gets requests again, unless a health probe re-admits it sooner.')
+    parser.add_argument('--large_pdf_pages', default=0, type=int, 
+                    help='PDFs with at least this many pages are split into page ranges which Tika extracts in parallel, each range taking its own extraction slot. Every PDF is sent whole when 0.')
+    parser.add_argument('--pdf_pages_per_range', default=25, type=int, 
+                    help='Number of pages per range when splitting large PDFs.')
+    parser.add_argument('--pdf_range_parallelism', default=4, type=int, 
+                    help='Maximum number of page ranges of one PDF extracted at once.')
+    parser.add_argument('--extractor_artifact_dir', default=None, 
+                    help='Directory for prebuilt keyword and Capstone extractors, which are rebuilt when their input files change. Extractors are built on every start when not set. Only the service should be able to write to it.')
+    parser.add_argument('--local_extraction', default=False, action="store_true", 
+                    help='Extract text from plain text, HTML, EML and Office Open XML files in process instead of sending them to Tika. The text can differ slightly from what Tika extracts.')
+    parser.add_argument('--ocr_workers', default=0, type=int, 
+                    help='Number of background threads per worker which OCR scanned files. When set, /file_metadata_prediction returns a 202 response with a job to poll instead of waiting for OCR. OCR runs inline when 0.')
+    parser.add_argument('--ocr_max_pending', default=32, type=int, 
+                    help='Maximum number of queued OCR jobs, split evenly between the workers. Further files needing OCR get a 503 response.')
+    parser.add_argument('--ocr_job_dir', default=None, 
+                    help='Directory shared by the workers for OCR job state and uploads. A temporary directory is used when not set.')
+    parser.add_argument('--ocr_job_ttl_hours', default=1, type=float, 
+                    help='Hours after which finished OCR jobs are removed.')
     args = parser.parse_args()
     app = create_app(**vars(args))
-    serve(app, host='0.0.0.0', port=8000)
\ No newline at end of file
+    if args.workers > 1:
+        serve_prefork(app, args.workers, args.threads)
+    else:
+        init_worker(app)
+        serve(app, host='0.0.0.0', port=8000, threads=args.threads)
\ No newline at end of file